@@ -1,6 +1,43 @@
+import os
+import sys
+
 from django.apps import AppConfig
+from django.conf import settings
+
+# points d’entrée qui servent des requêtes (gunicorn couvre aussi -k uvicorn.workers.UvicornWorker)
+_SERVER_ENTRY_POINTS = {"daphne", "uvicorn", "gunicorn", "hypercorn"}
+
+
+def _entry_point(argv0: str) -> str:
+    """Nom du programme lancé : "gunicorn", ou "uvicorn" pour `python -m uvicorn` (…/uvicorn/__main__.py)."""
+    name = os.path.basename(argv0)
+    if name == "__main__.py":
+        name = os.path.basename(os.path.dirname(argv0))
+    return name
+
+
+def _is_server_process(argv=None) -> bool:
+    """
+    Vrai seulement sous un serveur reconnu (daphne/uvicorn/gunicorn/hypercorn) ou
+    `manage.py runserver` ; faux pour tout le reste (migrate, django-admin, pytest,
+    scripts qui appellent django.setup(), `python -c`…).
+    """
+    argv = sys.argv if argv is None else argv
+    if not argv:
+        return False
+    if _entry_point(argv[0]) in _SERVER_ENTRY_POINTS:
+        return True
+    if len(argv) < 2 or argv[1] != "runserver":
+        return False
+    # autoreload : seul le process enfant (RUN_MAIN) sert les requêtes
+    return "--noreload" in argv or os.environ.get("RUN_MAIN") == "true"
 
 
 class RidevtcConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'RideVTC'
+
+    def ready(self):
+        if getattr(settings, "OUTBOX_RELAY_AUTOSTART", True) and _is_server_process():
+            from .utils.outbox import start_relay
+            start_relay()
@@ -2,14 +2,25 @@ from urllib.parse import parse_qs
 import re
 import logging
 
+from channels.consumer import get_handler_name
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
 from channels.db import database_sync_to_async
+from asgiref.sync import sync_to_async
 from django.contrib.auth.models import AnonymousUser
+from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
 
 from .models import Ride
 from .utils.rooms import user_room, driver_room, pool_room
-from RideVTC.presence import _presence_touch  # ✅ on garde l'import (async/Redis)
+from RideVTC.presence import PRESENCE, _presence_touch
+from .utils.geoindex import update_driver_location, remove_driver, mark_busy
+from .utils.claims import claim_ride, release_ride_claim
+from .utils import eventbus, outbox, sockets
+from .utils.realtime import ride_accepted_messages
+from .utils.locations import LocationRejected, parse_fixes, publish_driver_location
+from .utils.locbuffer import buffer_location, flush_ride
+from .dispatch import stop_dispatch
 
 # (optionnel) push notifications si dispo
 try:
@@ -30,35 +41,40 @@ def _clean(value: str, default: str) -> str:
     return (v[:50] or default)
 
 
-# (optionnel) check online côté DB
-@database_sync_to_async
-def _driver_is_online(driver_id: int) -> bool:
+def _opt_float(value):
     try:
-        from .models import DriverPresence
-        rec = DriverPresence.objects.filter(driver_id=driver_id).first()
-        if rec:
-            # selon ton modèle: is_online / online
-            return bool(getattr(rec, "is_online", getattr(rec, "online", False)))
-    except Exception:
-        pass
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
 
-    try:
-        from .models import Driver
-        d = Driver.objects.filter(id=driver_id).first()
-        if d and hasattr(d, "online"):
-            return bool(d.online)
-    except Exception:
-        pass
 
-    try:
-        from .models import DriverProfile
-        p = DriverProfile.objects.filter(driver_id=driver_id).first()
-        if p and hasattr(p, "online"):
-            return bool(p.online)
-    except Exception:
-        pass
+class BusEventMixin:
+    """
+    Rendu des messages "bus.event" (RideVTC.utils.eventbus) selon le protocole
+    négocié à la connexion : v1 = frame générique + frame format direct (handler
+    historique du consumer), v2 = frame générique seule.
+    """
+    protocol = eventbus.PROTOCOL_LEGACY
 
-    return False
+    def _negotiate_protocol(self, qs: dict) -> None:
+        self.protocol = eventbus.negotiate_protocol(
+            qs, int(getattr(settings, "WS_PROTOCOL_DEFAULT", eventbus.PROTOCOL_LEGACY))
+        )
+
+    async def bus_event(self, message):
+        frame = {"event": message["event"], "payload": message.get("payload")}
+        if message.get("seq") is not None:
+            frame["seq"] = message["seq"]  # outbox : au moins une fois → le client ignore un seq déjà vu
+        await self.send_json(frame)
+        compat = message.get("compat")
+        if compat and self.protocol < eventbus.PROTOCOL_CURRENT:
+            handler = getattr(self, get_handler_name(compat), None)
+            if handler:
+                await handler(compat)
+
+    async def bus_batch(self, message):
+        for event in message.get("events") or []:
+            await self.bus_event(event)
 
 
 # 👇 CHAT: helper commun pour retrouver client & chauffeur d’une course
@@ -89,11 +105,12 @@ def _get_ride_partners(ride_id: int):
 # AppConsumer (clients: /ws/app/?role=customer&user_id=...)
 # ──────────────────────────────────────────────────────────────
 
-class AppConsumer(AsyncJsonWebsocketConsumer):
+class AppConsumer(BusEventMixin, AsyncJsonWebsocketConsumer):
     async def connect(self):
         self.groups_to_join = []
 
         qs = parse_qs(self.scope.get("query_string", b"").decode())
+        self._negotiate_protocol(qs)
         raw_role = (qs.get("role", [""])[0] or "").lower()
 
         role = {
@@ -108,7 +125,7 @@ class AppConsumer(AsyncJsonWebsocketConsumer):
         if role in ("client", "customer"):
             user_id = getattr(user, "id", None) or int(qs.get("user_id", ["0"])[0])
             if user_id:
-                g = f"user.{user_id}"  # ⚠️ point, pas deux-points
+                g = user_room(user_id)  # "user.<id>" (point, pas deux-points)
                 self.groups_to_join.append(g)
                 logger.info("[WS][App] customer join group=%s", g)
 
@@ -117,7 +134,7 @@ class AppConsumer(AsyncJsonWebsocketConsumer):
             await self.channel_layer.group_add(g, self.channel_name)
 
         await self.accept()
-        logger.info("[WS][App] CONNECTED role=%s groups=%s", role, self.groups_to_join)
+        logger.info("[WS][App] CONNECTED role=%s groups=%s proto=%s", role, self.groups_to_join, self.protocol)
 
     async def disconnect(self, code):
         for g in getattr(self, "groups_to_join", []):
@@ -230,41 +247,15 @@ class AppConsumer(AsyncJsonWebsocketConsumer):
             "ts": ts,
         }
 
-        # 1️⃣ envoyer au chauffeur (driver.<id>)
-        try:
-            await ch.group_send(
-                driver_room(driver_id),
-                {
-                    "type": "evt",
-                    "event": "ride.chat",
-                    "payload": payload,
-                },
-            )
-        except Exception as e:
-            logger.exception("AppConsumer ride.chat → driver_room failed: %s", e)
-
-        # 2️⃣ echo au client (user.<id>)
-        try:
-            await ch.group_send(
-                user_room(user_id),
-                {
-                    "type": "evt",
-                    "event": "ride.chat",
-                    "payload": payload,
-                },
-            )
-        except Exception as e:
-            logger.exception("AppConsumer ride.chat → user_room failed: %s", e)
+        # envoi au chauffeur (driver.<id>) + echo au client (user.<id>)
+        await eventbus.apublish(ch, "ride.chat", payload, [driver_room(driver_id), user_room(user_id)])
 
 
 # ──────────────────────────────────────────────────────────────
 # DriverConsumer (/ws/rides/driver/<driver_id>/?area=...&category=...)
 # ──────────────────────────────────────────────────────────────
 
-# registre anti-doublon: 1 socket active par driver (driver_id -> channel_name)
-CURRENT_DRIVER_SOCKETS: dict[str, str] = {}
-
-class DriverConsumer(AsyncJsonWebsocketConsumer):
+class DriverConsumer(BusEventMixin, AsyncJsonWebsocketConsumer):
     async def connect(self):
         # Param path : ⚠️ on considère maintenant que <driver_id> = user.id
         try:
@@ -274,8 +265,18 @@ class DriverConsumer(AsyncJsonWebsocketConsumer):
             await self.close()
             return
 
+        # Identité : le JWT (?token=…) doit correspondre au <driver_id> du chemin,
+        # sinon n’importe qui pourrait accepter des courses / émettre des positions pour ce chauffeur
+        user = self.scope.get("user")
+        if not getattr(user, "is_authenticated", False) or int(user.id) != self.user_id:
+            logger.warning("[WS] driver#%s connect refused: unauthenticated or id mismatch", self.user_id)
+            await self.close(code=4003)
+            return
+        self.authenticated = True
+
         # Query params
         q = parse_qs(self.scope.get("query_string", b"").decode())
+        self._negotiate_protocol(q)
         raw_area = (q.get("area", ["city-default"])[0] or "city-default")
         raw_category = (q.get("category", ["eco"])[0] or "eco")
 
@@ -287,17 +288,14 @@ class DriverConsumer(AsyncJsonWebsocketConsumer):
         self.group_pool   = pool_room(self.category, self.area)          # ex: "pool.eco.city-default"
         self.group_driver = driver_room(self.user_id)                    # ex: "driver.41"
 
-        # Anti-doublon: si une autre socket existe pour ce driver (user), on la "kick"
+        # Anti-doublon (registre partagé entre workers) : si une autre socket existe pour ce driver, on la "kick"
         try:
-            old = CURRENT_DRIVER_SOCKETS.get(str(self.user_id))
-            if old and old != self.channel_name:
-                try:
-                    await self.channel_layer.send(old, {"type": "kick", "reason": "duplicate"})
-                    logger.info("[WS] kick previous socket for driver#%s (duplicate)", self.user_id)
-                except Exception as e:
-                    logger.exception("kick previous socket failed: %s", e)
-        finally:
-            CURRENT_DRIVER_SOCKETS[str(self.user_id)] = self.channel_name
+            old = await sockets.aregister(self.user_id, self.channel_name)
+            if old:
+                await self.channel_layer.send(old, {"type": "kick", "reason": "duplicate"})
+                logger.info("[WS] kick previous socket for driver#%s (duplicate)", self.user_id)
+        except Exception as e:
+            logger.exception("register/kick previous socket failed: %s", e)
 
         logger.info(
             "[WS] driver#%s WSCONNECT area=%s cat=%s → groups=%s / %s",
@@ -308,6 +306,7 @@ class DriverConsumer(AsyncJsonWebsocketConsumer):
             await self.channel_layer.group_add(self.group_pool, self.channel_name)
             await self.channel_layer.group_add(self.group_driver, self.channel_name)
             await self.accept()
+            await _presence_touch(self.user_id, category=self.category, area=self.area)
             logger.info("[WS] driver#%s JOINED groups %s & %s", self.user_id, self.group_pool, self.group_driver)
         except Exception as e:
             logger.exception("DriverConsumer.connect error: %s", e)
@@ -326,9 +325,10 @@ class DriverConsumer(AsyncJsonWebsocketConsumer):
             logger.info("[WS] driver#%s LEFT groups (code=%s)", self.user_id, code)
         finally:
             try:
-                cur = CURRENT_DRIVER_SOCKETS.get(str(self.user_id))
-                if cur == self.channel_name:
-                    del CURRENT_DRIVER_SOCKETS[str(self.user_id)]
+                if await sockets.aunregister(self.user_id, self.channel_name):
+                    # plus de socket → plus joignable pour le dispatch, hors ligne
+                    await sync_to_async(remove_driver)(self.user_id)
+                    await sync_to_async(PRESENCE.go_offline)(self.user_id)
             except Exception:
                 pass
             logger.info("[WS] driver#%s DISCONNECT (%s)", self.user_id, code)
@@ -345,12 +345,21 @@ class DriverConsumer(AsyncJsonWebsocketConsumer):
         })
 
     async def receive_json(self, content, **kwargs):
+        if not getattr(self, "authenticated", False):
+            await self.close(code=4003)
+            return
         logger.info("[WS][Driver] recv from driver#%s → %s", self.user_id, content)
         t = content.get("type")
 
-        # ping → mise à jour présence (async Redis)
+        # ping → mise à jour présence (async Redis) + index spatial si lat/lng fournis
         if t == "ping":
-            await _presence_touch(int(self.user_id))
+            await _presence_touch(int(self.user_id), category=self.category, area=self.area)
+            await sockets.arefresh(self.user_id, self.channel_name)
+            if content.get("lat") is not None and content.get("lng") is not None:
+                await sync_to_async(update_driver_location)(
+                    int(self.user_id), content.get("lat"), content.get("lng"),
+                    category=self.category, area=self.area,
+                )
             await self.send_json({"type": "pong"})
             return
 
@@ -364,6 +373,18 @@ class DriverConsumer(AsyncJsonWebsocketConsumer):
             await self._handle_chat_from_driver(payload)
             return
 
+        # ✅ acceptation d’une course via la socket (évite un aller-retour HTTPS)
+        # formats: {"action": "accept", "ride_id": ...} (driver_ws_tester) ou {"type": "ride.accept", "rideId": ...}
+        if content.get("action") == "accept" or t == "ride.accept":
+            await self._handle_accept(content)
+            return
+
+        # 📍 flux de positions pendant la course (remplace POST /api/rides/<id>/location/)
+        # formats: {"type": "driver.location", "rideId", "lat", "lng"} ou {..., "fixes": [{lat, lng, ts}, ...]}
+        if t == "driver.location":
+            await self._handle_location(content)
+            return
+
         # chauffeur signale "arrivé"
         if t == "driver.arrived":
             # 1) Normalisation des champs d'entrée
@@ -404,7 +425,7 @@ class DriverConsumer(AsyncJsonWebsocketConsumer):
                 await self.send_json({"type": "ok", "event": "ride.arrived.ack", "rideId": ride_id})
                 return
 
-            client_groups = {user_room(user_id), f"user.{user_id}"}
+            client_groups = [user_room(user_id)]
             now_iso = timezone.now().isoformat()
 
             # payload générique (compat)
@@ -417,30 +438,21 @@ class DriverConsumer(AsyncJsonWebsocketConsumer):
                 "grace": 300,
             }
 
-            for g in client_groups:
-                # 1) format générique
-                await ch.group_send(
-                    g,
-                    {
-                        "type": "evt",
-                        "event": "ride.arrived",
-                        "payload": {
-                            **evt_payload,
-                            "loc": evt_payload["loc"] or {},  # compat
-                        },
-                    },
-                )
-                # 2) format direct
-                direct_msg = {
-                    "type": "ride.arrived",
-                    "requestId": ride_id,
-                    "driverId": int(self.user_id),
-                    "source": source,
-                    "grace": 300,
-                }
-                if lat is not None and lng is not None:
-                    direct_msg.update({"lat": lat, "lng": lng})
-                await ch.group_send(g, direct_msg)
+            # 1) format générique  2) format direct (sockets v1)
+            direct_msg = {
+                "type": "ride.arrived",
+                "requestId": ride_id,
+                "driverId": int(self.user_id),
+                "source": source,
+                "grace": 300,
+            }
+            if lat is not None and lng is not None:
+                direct_msg.update({"lat": lat, "lng": lng})
+            await eventbus.apublish(
+                ch, "ride.arrived",
+                {**evt_payload, "loc": evt_payload["loc"] or {}},  # compat
+                client_groups, compat=direct_msg,
+            )
 
             logger.info(
                 "[WS] broadcast ride.arrived → groups=%s requestId=%s driver#%s",
@@ -468,6 +480,79 @@ class DriverConsumer(AsyncJsonWebsocketConsumer):
             await self.send_json({"type": "ok", "event": "ride.arrived.ack", "rideId": ride_id})
             return
 
+    async def _handle_accept(self, data: dict):
+        ride_raw = data.get("ride_id") or data.get("rideId") or data.get("requestId")
+        try:
+            ride_id = int(ride_raw)
+        except (TypeError, ValueError):
+            await self.send_json({"type": "error", "event": "ride.accept.rejected", "message": "rideId invalid"})
+            return
+
+        try:
+            ok, result = await self._accept_ride(ride_id)
+        except Exception as e:
+            logger.exception("[WS] accept ride_id=%s by driver#%s failed: %s", ride_id, self.user_id, e)
+            ok, result = False, "accept failed"
+
+        if not ok:
+            await self.send_json({
+                "type": "error",
+                "event": "ride.accept.rejected",
+                "rideId": ride_id,
+                "message": result,
+            })
+            return
+
+        stop_dispatch(ride_id)
+        await self.send_json({"type": "ok", "event": "ride.accept.ack", "rideId": ride_id})
+        # ride.accepted part via l’outbox (même fan-out que RideViewSet.accept)
+        logger.info("[WS] accept (ws): ride_id=%s by driver#%s → queued client notification", ride_id, self.user_id)
+
+    async def _handle_location(self, data: dict):
+        # flux de positions : socket authentifiée (connect) + course attribuée à ce chauffeur
+        # (vérifié par publish_driver_location avant tout effet : index, trace, relais)
+        if not getattr(self, "authenticated", False):
+            await self.close(code=4003)
+            return
+        ride_raw = data.get("rideId") or data.get("requestId") or data.get("ride_id")
+        try:
+            ride_id = int(ride_raw)
+        except (TypeError, ValueError):
+            await self.send_json({"type": "error", "event": "driver.location.rejected", "message": "rideId invalid"})
+            return
+
+        fixes = parse_fixes(data)
+        if not fixes:
+            return
+        last = fixes[-1]  # le client n’a besoin que du point le plus récent
+
+        try:
+            messages = await database_sync_to_async(publish_driver_location)(
+                ride_id, int(self.user_id), last["lat"], last["lng"], _opt_float(last.get("heading")), fixes,
+            )
+        except LocationRejected as e:
+            # le chauffeur doit arrêter d’émettre pour cette course
+            await self.send_json({
+                "type": "error",
+                "event": "driver.location.rejected",
+                "rideId": ride_id,
+                "reason": e.reason,
+                "ride_status": e.status,
+            })
+            return
+        except (TypeError, ValueError, OverflowError) as e:
+            # trame malformée : on la rejette sans fermer la socket du chauffeur
+            logger.warning("[WS] invalid driver.location ride_id=%s driver#%s: %s", ride_id, self.user_id, e)
+            await self.send_json({
+                "type": "error", "event": "driver.location.rejected", "rideId": ride_id, "reason": "invalid",
+            })
+            return
+
+        try:
+            await eventbus.asend(self.channel_layer, messages)
+        except Exception as e:
+            logger.exception("WS relay ride.driver.location failed: %s", e)
+
     async def _handle_chat_from_driver(self, data: dict):
         """
         Reçoit un message du chauffeur, le push au client (user.<id>) + echo chauffeur.
@@ -516,38 +601,9 @@ class DriverConsumer(AsyncJsonWebsocketConsumer):
             "ts": ts,
         }
 
-        # 1️⃣ push au client (tous les groupes user.<id>)
-        client_groups = {user_room(user_id), f"user.{user_id}"}
-        logger.info(
-            "[CHAT][Driver] forward ride.chat ride_id=%s → user#%s groups=%s",
-            ride_id, user_id, list(client_groups)
-        )
-
-        for g in client_groups:
-            try:
-                await ch.group_send(
-                    g,
-                    {
-                        "type": "evt",
-                        "event": "ride.chat",
-                        "payload": base_payload,
-                    },
-                )
-            except Exception as e:
-                logger.exception("DriverConsumer ride.chat → group %s failed: %s", g, e)
-
-        # 2️⃣ echo côté chauffeur (driver_room)
-        try:
-            await ch.group_send(
-                driver_room(driver_id),
-                {
-                    "type": "evt",
-                    "event": "ride.chat",
-                    "payload": base_payload,
-                },
-            )
-        except Exception as e:
-            logger.exception("DriverConsumer ride.chat → driver_room failed: %s", e)
+        # 1️⃣ push au client (user.<id>) + 2️⃣ echo côté chauffeur (driver_room)
+        logger.info("[CHAT][Driver] forward ride.chat ride_id=%s → user#%s", ride_id, user_id)
+        await eventbus.apublish(ch, "ride.chat", base_payload, [user_room(user_id), driver_room(driver_id)])
 
         # 3️⃣ (optionnel) push notif au client
         if notify_user:
@@ -580,35 +636,39 @@ class DriverConsumer(AsyncJsonWebsocketConsumer):
         if not ride_id:
             return False, "ride_id missing"
 
+        # Arbitrage en cache (SET NX) : les perdants sont rejetés sans requête DB
+        if not claim_ride(ride_id, self.user_id):
+            return False, "Ride already accepted"
+
+        # claim libéré sur toute autre issue que le succès (introuvable, déjà prise, erreur)
+        accepted = False
         try:
-            r = Ride.objects.select_for_update().get(id=ride_id)
-        except Ride.DoesNotExist:
-            return False, "Ride not found"
+            with transaction.atomic():
+                try:
+                    r = Ride.objects.select_for_update().get(id=ride_id)
+                except Ride.DoesNotExist:
+                    return False, "Ride not found"
 
-        if r.status != "pending":
-            return False, f"Ride already {r.status}"
+                if r.status != "pending":
+                    return False, f"Ride already {r.status}"
 
-        # ⚠️ IMPORTANT : driver_id = user.id
-        try:
-            r.driver_id = int(self.user_id)
-        except Exception:
-            r.driver_id = None
-
-        r.status = "accepted"
-        r.accepted_at = timezone.now()
-        r.save(update_fields=["driver_id", "status", "accepted_at"])
-
-        return True, {
-            "user_id": r.user_id,
-            "category": getattr(r, "category", "eco"),
-            "pickup_location": getattr(r, "pickup_location", None),
-            "dropoff_location": getattr(r, "dropoff_location", None),
-            "pickup_lat": getattr(r, "pickup_lat", None),
-            "pickup_lng": getattr(r, "pickup_lng", None),
-            "dropoff_lat": getattr(r, "dropoff_lat", None),
-            "dropoff_lng": getattr(r, "dropoff_lng", None),
-            "price": str(getattr(r, "price", "")),
-        }
+                # ⚠️ IMPORTANT : driver_id = user.id
+                try:
+                    r.driver_id = int(self.user_id)
+                except Exception:
+                    r.driver_id = None
+
+                r.status = "accepted"
+                r.accepted_at = timezone.now()
+                r.save(update_fields=["driver_id", "status", "accepted_at"])
+                # enregistrés dans la transaction, diffusés après commit (accès r.driver → DB, hors event loop)
+                outbox.record(ride_accepted_messages(r))
+            accepted = True
+        finally:
+            if not accepted:
+                release_ride_claim(ride_id, self.user_id)
+        mark_busy(self.user_id)  # plus proposé aux nouvelles courses jusqu’à la fin de celle-ci
+        return True, None
 
     @database_sync_to_async
     def _mark_arrived_and_get_payload(self, ride_id: int, lat: float, lng: float, source: str):
@@ -623,13 +683,12 @@ class DriverConsumer(AsyncJsonWebsocketConsumer):
             r.arrived_at = timezone.now()
             r.save(update_fields=["arrived_at"])
 
-        if lat is not None and lng is not None:
-            try:
-                if hasattr(r, "driver_lat") and hasattr(r, "driver_lng"):
-                    r.driver_lat = lat
-                    r.driver_lng = lng
-                    r.save(update_fields=["driver_lat", "driver_lng"])
-            except Exception:
-                pass
+        # transition → la dernière position (buffer write-behind) est écrite tout de suite
+        try:
+            if lat is not None and lng is not None:
+                buffer_location(r.id, lat, lng)
+            flush_ride(r.id)
+        except Exception:
+            pass
 
         return True, {"user_id": r.user_id}
\ No newline at end of file
@@ -0,0 +1,327 @@
+# RideVTC/dispatch.py
+"""
+Envoi des offres de course (ride.requested) aux chauffeurs, par vagues.
+
+  - vague 1 : les N chauffeurs éligibles les plus proches du pickup (index
+    spatial), via leur groupe privé driver.<id> ;
+  - si personne n’accepte avant DISPATCH_WAVE_TTL_S → vague suivante, avec un
+    rayon et un N plus grands (sans re-notifier les chauffeurs déjà sollicités) ;
+  - vagues épuisées, ou pas de coords → repli sur l’ancien broadcast
+    pool.<cat>.<area>.
+
+DISPATCH_MODE = "batch" : les courses en attente sont accumulées pendant
+DISPATCH_BATCH_WINDOW_S puis affectées globalement (coût min = ETA d’approche
+locale ou distance, algorithme hongrois) aux chauffeurs disponibles ; chaque
+chauffeur retenu reçoit une offre ciblée. Une course restée sans chauffeur trop longtemps repasse en vagues.
+
+L’offre part avec les libellés bruts ; le géocodage (Google/Nominatim) est fait
+après commit, en tâche de fond (enrich_ride_offer), puis poussé en ride.updated.
+"""
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+from django.conf import settings
+
+from blaze_backend.background import every, schedule
+from .eta import eta_matrix
+from .models import Ride
+from .utils import eventbus
+from .utils.payloads import build_ride_offer_payload
+from .utils.assignment import UNREACHABLE, pickup_cost_matrix, solve_assignment
+from .utils.geoindex import drivers_within, nearest_drivers
+from .utils.rooms import driver_room, pool_room
+
+logger = logging.getLogger("rides")
+
+_ON_RIDE_STATUSES = ("accepted", "in_progress")
+
+
+def _wave_ttl_s() -> float:
+    return float(getattr(settings, "DISPATCH_WAVE_TTL_S", 15))
+
+def _dispatch_mode() -> str:
+    return str(getattr(settings, "DISPATCH_MODE", "waves")).lower()
+
+def _max_radius_km() -> float:
+    return float(getattr(settings, "DISPATCH_RADIUS_KM", 5.0))
+
+def _batch_window_s() -> float:
+    return float(getattr(settings, "DISPATCH_BATCH_WINDOW_S", 2.0))
+
+def _batch_max_rounds() -> int:
+    return int(getattr(settings, "DISPATCH_BATCH_MAX_ROUNDS", 5))
+
+def _batch_candidates() -> int:
+    return int(getattr(settings, "DISPATCH_BATCH_CANDIDATES", 20))
+
+def _batch_cost_mode() -> str:
+    return str(getattr(settings, "DISPATCH_BATCH_COST", "eta")).lower()
+
+def _max_waves() -> int:
+    return int(getattr(settings, "DISPATCH_MAX_WAVES", 4))
+
+def _wave_params(n: int) -> tuple[int, float]:
+    """(taille, rayon_km) de la vague n (0-indexée)."""
+    growth = float(getattr(settings, "DISPATCH_WAVE_GROWTH", 2.0))
+    size = int(getattr(settings, "DISPATCH_FIRST_WAVE_SIZE", 3))
+    radius = float(getattr(settings, "DISPATCH_FIRST_WAVE_RADIUS_KM", 2.0))
+    return max(1, int(round(size * growth ** n))), min(_max_radius_km(), radius * growth ** n)
+
+
+@dataclass
+class _WaveState:
+    ride_id: int
+    lat: Optional[float]
+    lng: Optional[float]
+    category: str
+    area: str
+    msg: dict
+    channel_layer: object
+    wave: int = 0
+    offered: Set[int] = field(default_factory=set)
+    groups: List[str] = field(default_factory=list)
+    broadcast: bool = False
+    # mode batch
+    rounds: int = 0
+    offer_driver: Optional[int] = None
+    offered_at: float = 0.0
+
+
+_LOCK = threading.Lock()
+_ACTIVE: Dict[int, _WaveState] = {}
+_BATCH: Dict[int, _WaveState] = {}
+
+
+def _send(st: _WaveState, groups: List[str]) -> None:
+    eventbus.send(st.channel_layer, [(g, st.msg) for g in groups])
+    st.groups.extend(g for g in groups if g not in st.groups)
+
+
+def _send_next_wave(st: _WaveState) -> bool:
+    """
+    Envoie la prochaine vague non vide. False si plus rien à faire.
+    Comme en mode batch, les chauffeurs déjà en course sont exclus (une requête par appel).
+    """
+    on_ride = _drivers_on_ride() if st.wave < _max_waves() else set()
+    while st.wave < _max_waves():
+        size, radius = _wave_params(st.wave)
+        st.wave += 1
+        targets = nearest_drivers(
+            st.lat, st.lng, st.category, k=size, radius_km=radius, exclude=st.offered | on_ride,
+        )
+        if not targets:
+            continue
+        st.offered.update(did for did, _ in targets)
+        _send(st, [driver_room(did) for did, _ in targets])
+        logger.info(
+            "[DISPATCH] ride_id=%s wave=%s radius=%.1fkm → %s",
+            st.ride_id, st.wave, radius, [(did, round(d, 2)) for did, d in targets],
+        )
+        return True
+
+    if not st.broadcast:
+        st.broadcast = True
+        room = pool_room(st.category, st.area)  # ex: "pool.eco.city-default"
+        _send(st, [room])
+        logger.info("[DISPATCH] ride_id=%s waves exhausted → broadcast %s", st.ride_id, room)
+        return True
+    return False
+
+
+def _on_wave_timeout(ride_id: int) -> None:
+    with _LOCK:
+        st = _ACTIVE.get(ride_id)
+    if st is None:
+        return
+
+    status = Ride.objects.filter(id=ride_id).values_list("status", flat=True).first()
+    if status != "pending" or st.broadcast or not _send_next_wave(st):
+        stop_dispatch(ride_id)
+        return
+    schedule(_wave_ttl_s(), _on_wave_timeout, ride_id)
+
+
+def _start_waves(st: _WaveState) -> None:
+    _send_next_wave(st)
+    if not st.broadcast:
+        with _LOCK:
+            _ACTIVE[st.ride_id] = st
+        schedule(_wave_ttl_s(), _on_wave_timeout, st.ride_id)
+
+
+# ─────────────────────────────────────────────────────────────
+# Mode batch : matching global toutes les DISPATCH_BATCH_WINDOW_S
+# ─────────────────────────────────────────────────────────────
+def _drivers_on_ride() -> Set[int]:
+    """Chauffeurs ayant une course acceptée / en cours (jamais candidats, même si l’index est en retard)."""
+    return set(
+        Ride.objects.filter(status__in=_ON_RIDE_STATUSES, driver_id__isnull=False)
+        .values_list("driver_id", flat=True)
+    )
+
+
+def _run_batch() -> None:
+    with _LOCK:
+        items = list(_BATCH.values())
+    if not items:
+        return
+
+    statuses = dict(
+        Ride.objects.filter(id__in=[st.ride_id for st in items]).values_list("id", "status")
+    )
+    now = time.time()
+    reserved: set = set()   # chauffeurs avec une offre batch en cours
+    ready: List[_WaveState] = []
+    for st in items:
+        if statuses.get(st.ride_id) != "pending":
+            stop_dispatch(st.ride_id)
+            continue
+        if st.offer_driver is not None:
+            if now - st.offered_at < _wave_ttl_s():
+                reserved.add(st.offer_driver)
+                continue
+            st.offer_driver = None  # pas de réponse → on retente avec un autre chauffeur
+        if st.rounds >= _batch_max_rounds():
+            with _LOCK:
+                _BATCH.pop(st.ride_id, None)
+            logger.info("[DISPATCH][batch] ride_id=%s unmatched after %s rounds → waves", st.ride_id, st.rounds)
+            _start_waves(st)
+            continue
+        ready.append(st)
+
+    if not ready:
+        return
+    # exclus de drivers_within : un chauffeur occupé ne prend pas la place d’un libre parmi les K candidats
+    reserved |= _drivers_on_ride()
+    by_cat: Dict[str, List[_WaveState]] = {}
+    for st in ready:
+        by_cat.setdefault(st.category, []).append(st)
+    for category, rides in by_cat.items():
+        _match_category(category, rides, reserved, now)
+
+
+def _match_category(category: str, rides: List[_WaveState], reserved: set, now: float) -> None:
+    drivers: Dict[int, tuple] = {}
+    for st in rides:
+        for pos, _ in drivers_within(
+            st.lat, st.lng, category,
+            k=_batch_candidates(), radius_km=_max_radius_km(), exclude=reserved,
+        ):
+            drivers[pos.driver_id] = (pos.lat, pos.lng)
+    if not drivers:
+        for st in rides:
+            st.rounds += 1
+        return
+
+    driver_ids = list(drivers)
+    ride_pts = [(st.lat, st.lng) for st in rides]
+    driver_pts = [drivers[d] for d in driver_ids]
+    cost = pickup_cost_matrix(ride_pts, driver_pts, _max_radius_km())
+    if _batch_cost_mode() == "eta":
+        # coût = temps d’approche estimé (chauffeur → pickup), modèle local sans appel externe
+        secs, _ = eta_matrix(driver_pts, ride_pts)
+        cost = [
+            [float(secs[j][i]) if cost[i][j] < UNREACHABLE else UNREACHABLE for j in range(len(driver_ids))]
+            for i in range(len(rides))
+        ]
+    for i, st in enumerate(rides):
+        for j, did in enumerate(driver_ids):
+            if did in st.offered:
+                cost[i][j] = UNREACHABLE
+
+    matched = set()
+    for i, j in solve_assignment(cost):
+        st, did = rides[i], driver_ids[j]
+        st.offer_driver, st.offered_at = did, now
+        st.offered.add(did)
+        reserved.add(did)
+        matched.add(i)
+        _send(st, [driver_room(did)])
+        logger.info("[DISPATCH][batch] ride_id=%s → driver#%s (cost=%.2f %s)", st.ride_id, did, float(cost[i][j]), _batch_cost_mode())
+    for i, st in enumerate(rides):
+        if i not in matched:
+            st.rounds += 1
+
+
+def _enqueue_batch(st: _WaveState) -> None:
+    with _LOCK:
+        _BATCH[st.ride_id] = st
+    every("dispatch-batch", _batch_window_s(), _run_batch)
+
+
+def offer_ride(channel_layer, ride, payload: dict, category: str, area: str) -> List[str]:
+    """
+    Lance le dispatch et retourne la liste des groupes déjà notifiés
+    (vide en mode batch : l’offre part au prochain tour de matching).
+    """
+    st = _WaveState(
+        ride_id=ride.id,
+        # coords du payload : inclut un éventuel plus code décodé localement
+        lat=payload.get("pickup", {}).get("lat", getattr(ride, "pickup_lat", None)),
+        lng=payload.get("pickup", {}).get("lng", getattr(ride, "pickup_lng", None)),
+        category=category,
+        area=area,
+        msg={"type": "ride.requested", "ride": payload},
+        channel_layer=channel_layer,
+    )
+    if st.lat is None or st.lng is None:
+        st.wave = _max_waves()  # pas de coords → broadcast direct
+    elif _dispatch_mode() == "batch":
+        _enqueue_batch(st)
+        return []
+
+    _start_waves(st)
+    return list(st.groups)
+
+
+def stop_dispatch(ride_id: int) -> None:
+    """Arrête le dispatch d’une course (acceptée, annulée, …)."""
+    with _LOCK:
+        _ACTIVE.pop(ride_id, None)
+        _BATCH.pop(ride_id, None)
+
+
+def offered_groups(ride_id: int) -> List[str]:
+    with _LOCK:
+        st = _ACTIVE.get(ride_id) or _BATCH.get(ride_id)
+        return list(st.groups) if st else []
+
+
+def update_offer(ride_id: int, payload: dict) -> List[str]:
+    """Remplace le payload des prochaines vagues ; retourne les groupes déjà notifiés."""
+    with _LOCK:
+        st = _ACTIVE.get(ride_id) or _BATCH.get(ride_id)
+        if st is None:
+            return []
+        st.msg = {"type": "ride.requested", "ride": payload}
+        return list(st.groups)
+
+
+def enrich_ride_offer(channel_layer, ride_id: int, category: str, area: str, language: str) -> None:
+    """
+    Tâche de fond (après commit) : géocode les libellés/coords de l’offre, complète
+    les coords manquantes en DB et pousse ride.updated aux chauffeurs déjà sollicités.
+    """
+    ride = Ride.objects.filter(id=ride_id).first()
+    if ride is None or ride.status != "pending":
+        return
+
+    raw = build_ride_offer_payload(ride, category=category, area=area, language=language, enrich=False)
+    payload = build_ride_offer_payload(ride, category=category, area=area, language=language, enrich=True)
+
+    fields = {}
+    for side in ("pickup", "dropoff"):
+        for axis in ("lat", "lng"):
+            if getattr(ride, f"{side}_{axis}") is None and payload[side][axis] is not None:
+                fields[f"{side}_{axis}"] = payload[side][axis]
+    if fields:
+        Ride.objects.filter(id=ride_id).update(**fields)
+    if payload == raw:
+        return
+
+    groups = update_offer(ride_id, payload)
+    eventbus.publish(channel_layer, "ride.updated", payload, groups)
+    logger.info("[DISPATCH] ride_id=%s labels enriched → ride.updated %s", ride_id, groups)
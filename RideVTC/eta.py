@@ -0,0 +1,236 @@
+# RideVTC/eta.py
+"""
+Estimation locale des temps de trajet (sans appel Google Directions).
+
+Modèle : vitesse typique par cellule de grille (ETA_CELL_DEG) × heure de la
+semaine, apprise des courses terminées et des DriverNavEvent (SpeedProfile,
+reconstruit par `manage.py rebuild_eta_model`). Un trajet est découpé le long
+du segment direct en tronçons d’une cellule ; temps = Σ longueur / vitesse de
+la cellule, la distance route ≈ haversine × ETA_DETOUR_FACTOR.
+
+  - eta(lat1, lng1, lat2, lng2)          → (secondes, km)
+  - eta_matrix(origines, destinations)   → (secondes[i][j], km[i][j]) (NumPy, vitesses
+    des cellules lues par recherche dichotomique vectorisée, sans boucle Python)
+  - build_profiles()                     → lignes SpeedProfile à partir de l’historique
+"""
+from __future__ import annotations
+
+import logging
+import math
+import statistics
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from .models import DriverNavEvent, Ride, SpeedProfile
+from .utils.assignment import haversine_matrix
+from .utils.geoindex import haversine_km
+
+logger = logging.getLogger("rides")
+
+GLOBAL_CELL = "*"
+
+
+def _cell_deg() -> float:
+    return float(getattr(settings, "ETA_CELL_DEG", 0.01))
+
+def _detour() -> float:
+    return float(getattr(settings, "ETA_DETOUR_FACTOR", 1.3))
+
+def _default_speed() -> float:
+    return float(getattr(settings, "ETA_DEFAULT_SPEED_KMH", 22.0))
+
+def _reload_s() -> float:
+    return float(getattr(settings, "ETA_RELOAD_S", 300))
+
+
+def cell_key(lat: float, lng: float) -> str:
+    d = _cell_deg()
+    return f"{math.floor(lat / d)}:{math.floor(lng / d)}"
+
+
+def hour_of_week(when: Optional[datetime] = None) -> int:
+    when = timezone.localtime(when or timezone.now())
+    return when.weekday() * 24 + when.hour
+
+
+# (i, j, heure) → int64 : i, j décalés de 2^20 (|lat|/ETA_CELL_DEG < 2^20), heure sur 8 bits
+_CELL_OFFSET = 1 << 20
+
+def _cell_code(i, j, how):
+    return ((i + _CELL_OFFSET) * (1 << 21) + (j + _CELL_OFFSET)) * 256 + how
+
+
+# ─────────────────────────────────────────────────────────────
+# Modèle en mémoire (rechargé depuis SpeedProfile toutes les ETA_RELOAD_S)
+# ─────────────────────────────────────────────────────────────
+class _Model:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.loaded_at = 0.0
+        self.cells: Dict[Tuple[str, int], float] = {}
+        self.global_: Dict[int, float] = {}
+        self.codes = np.empty(0, dtype=np.int64)    # _cell_code triés (lookup vectorisé)
+        self.speeds = np.empty(0, dtype=float)
+
+    def ensure_loaded(self) -> None:
+        if time.time() - self.loaded_at < _reload_s():
+            return
+        with self._lock:
+            if time.time() - self.loaded_at < _reload_s():
+                return
+            cells, glob = {}, {}
+            try:
+                for cell, how, speed in SpeedProfile.objects.values_list("cell", "hour_of_week", "speed_kmh"):
+                    if cell == GLOBAL_CELL:
+                        glob[how] = speed
+                    else:
+                        cells[(cell, how)] = speed
+            except Exception as e:
+                logger.warning("[ETA] profile load failed: %s", e)
+            codes, speeds = [], []
+            for (cell, how), speed in cells.items():
+                i, j = cell.split(":")
+                codes.append(_cell_code(int(i), int(j), how))
+                speeds.append(speed)
+            order = np.argsort(np.asarray(codes, dtype=np.int64))
+            self.codes = np.asarray(codes, dtype=np.int64)[order]
+            self.speeds = np.asarray(speeds, dtype=float)[order]
+            self.cells, self.global_ = cells, glob
+            self.loaded_at = time.time()
+
+    def speed(self, cell: str, how: int) -> float:
+        s = self.cells.get((cell, how))
+        if s is None:
+            s = self.global_.get(how, _default_speed())
+        return max(1.0, s)
+
+    def speed_array(self, lat, lng, how: int):
+        """Vitesses des cellules contenant chaque point (tableaux de même forme)."""
+        d = _cell_deg()
+        codes = _cell_code(
+            np.floor(np.asarray(lat, dtype=float) / d).astype(np.int64),
+            np.floor(np.asarray(lng, dtype=float) / d).astype(np.int64),
+            how,
+        )
+        fallback = self.global_.get(how, _default_speed())
+        if not len(self.codes):
+            return np.full(codes.shape, max(1.0, fallback))
+        idx = np.minimum(np.searchsorted(self.codes, codes), len(self.codes) - 1)
+        found = self.codes[idx] == codes
+        return np.maximum(1.0, np.where(found, self.speeds[idx], fallback))
+
+
+_MODEL = _Model()
+
+
+def eta(
+    lat1: float, lng1: float, lat2: float, lng2: float, when: Optional[datetime] = None,
+) -> Tuple[float, float]:
+    """(secondes, km route estimés) entre deux points."""
+    _MODEL.ensure_loaded()
+    how = hour_of_week(when)
+    direct_km = haversine_km(lat1, lng1, lat2, lng2)
+    road_km = direct_km * _detour()
+    cell_km = _cell_deg() * 111.195
+    n = max(1, int(math.ceil(direct_km / cell_km)))
+    seg_km = road_km / n
+    hours = 0.0
+    for k in range(n):
+        t = (k + 0.5) / n
+        hours += seg_km / _MODEL.speed(cell_key(lat1 + (lat2 - lat1) * t, lng1 + (lng2 - lng1) * t), how)
+    return hours * 3600.0, road_km
+
+
+def eta_matrix(
+    origins: Sequence[Tuple[float, float]],
+    destinations: Sequence[Tuple[float, float]],
+    when: Optional[datetime] = None,
+):
+    """
+    Matrice (secondes, km) origines × destinations, en un seul passage vectorisé :
+    vitesse d’une paire = moyenne harmonique des cellules origine / milieu / destination.
+    """
+    _MODEL.ensure_loaded()
+    how = hour_of_week(when)
+    o = np.asarray(origins, dtype=float).reshape(-1, 2)
+    d = np.asarray(destinations, dtype=float).reshape(-1, 2)
+    road = haversine_matrix(o[:, 0], o[:, 1], d[:, 0], d[:, 1]) * _detour()
+    s_o = _MODEL.speed_array(o[:, 0], o[:, 1], how)
+    s_d = _MODEL.speed_array(d[:, 0], d[:, 1], how)
+    s_m = _MODEL.speed_array((o[:, 0:1] + d[None, :, 0]) / 2, (o[:, 1:2] + d[None, :, 1]) / 2, how)
+    inv = (1.0 / s_o)[:, None] + 1.0 / s_m + (1.0 / s_d)[None, :]
+    return road / 3.0 * inv * 3600.0, road
+
+
+# ─────────────────────────────────────────────────────────────
+# Apprentissage (batch)
+# ─────────────────────────────────────────────────────────────
+def _ride_samples(since: datetime):
+    """
+    Courses terminées : vitesse moyenne pickup→dropoff, sur la même fenêtre que la
+    distance (started_at→completed_at, pauses déduites ; l’approche et l’attente
+    au pickup n’en font pas partie). Distance mesurée sur la trace si connue.
+    """
+    qs = (
+        Ride.objects.filter(status="completed", completed_at__gte=since, started_at__isnull=False)
+        .exclude(pickup_lat=None).exclude(dropoff_lat=None)
+        .values_list("pickup_lat", "pickup_lng", "dropoff_lat", "dropoff_lng",
+                     "distance_km", "measured_distance_km", "started_at", "completed_at", "total_pause_seconds")
+    )
+    for plat, plng, dlat, dlng, dist, measured, start, comp, pause in qs.iterator():
+        dist = measured or dist
+        seconds = (comp - start).total_seconds() - (pause or 0)
+        if seconds <= 60 or not dist:
+            continue
+        speed = dist / (seconds / 3600.0)
+        how = hour_of_week(start)
+        for t in (0.0, 0.5, 1.0):
+            yield cell_key(plat + (dlat - plat) * t, plng + (dlng - plng) * t), how, speed
+
+
+def _nav_samples(since: datetime):
+    """DriverNavEvent : vitesse GPS instantanée (m/s) au point de l’événement."""
+    qs = (
+        DriverNavEvent.objects.filter(created_at__gte=since, speed__gt=0)
+        .exclude(latitude=None).exclude(longitude=None)
+        .values_list("latitude", "longitude", "speed", "created_at")
+    )
+    for lat, lng, speed, ts in qs.iterator():
+        yield cell_key(float(lat), float(lng)), hour_of_week(ts), speed * 3.6
+
+
+def build_profiles(history_days: int = 60, prior_weight: float = 5.0) -> List[SpeedProfile]:
+    """
+    Médiane des vitesses par (cellule, heure de la semaine), rétrécie vers la
+    médiane globale de l’heure quand il y a peu d’échantillons.
+    """
+    lo = float(getattr(settings, "ETA_MIN_SPEED_KMH", 3.0))
+    hi = float(getattr(settings, "ETA_MAX_SPEED_KMH", 110.0))
+    since = timezone.now() - timedelta(days=history_days)
+
+    per_cell: Dict[Tuple[str, int], List[float]] = defaultdict(list)
+    per_how: Dict[int, List[float]] = defaultdict(list)
+    for source in (_ride_samples(since), _nav_samples(since)):
+        for cell, how, speed in source:
+            if lo <= speed <= hi:
+                per_cell[(cell, how)].append(speed)
+                per_how[how].append(speed)
+
+    glob = {how: statistics.median(v) for how, v in per_how.items()}
+    rows = [
+        SpeedProfile(cell=GLOBAL_CELL, hour_of_week=how, speed_kmh=s, samples=len(per_how[how]))
+        for how, s in glob.items()
+    ]
+    for (cell, how), speeds in per_cell.items():
+        n = len(speeds)
+        prior = glob.get(how, _default_speed())
+        speed = (n * statistics.median(speeds) + prior_weight * prior) / (n + prior_weight)
+        rows.append(SpeedProfile(cell=cell, hour_of_week=how, speed_kmh=speed, samples=n))
+    return rows
@@ -0,0 +1,22 @@
+# RideVTC/management/commands/rebuild_eta_model.py
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from RideVTC.eta import build_profiles
+from RideVTC.models import SpeedProfile
+
+class Command(BaseCommand):
+    help = "Reconstruit les profils de vitesse (cellule × heure de la semaine) utilisés par l’ETA local"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=getattr(settings, "ETA_HISTORY_DAYS", 60))
+        parser.add_argument("--prior-weight", type=float, default=getattr(settings, "ETA_PRIOR_WEIGHT", 5.0))
+
+    def handle(self, *args, **opts):
+        rows = build_profiles(history_days=opts["days"], prior_weight=opts["prior_weight"])
+        with transaction.atomic():
+            SpeedProfile.objects.all().delete()
+            SpeedProfile.objects.bulk_create(rows, batch_size=1000)
+        cells = len({r.cell for r in rows})
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(rows)} speed profiles over {cells} cells."))
@@ -0,0 +1,40 @@
+# RideVTC/management/commands/relay_outbox.py
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from RideVTC.utils.outbox import _interval_s, _tick, purge, relay
+
+logger = logging.getLogger("rides")
+
+class Command(BaseCommand):
+    help = "Diffuse les événements temps réel en attente dans l’outbox (et purge les anciens envoyés)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--purge", action="store_true", help="supprime aussi les événements envoyés expirés")
+        parser.add_argument(
+            "--loop", action="store_true",
+            help="worker dédié : relaie et purge toutes les OUTBOX_RELAY_INTERVAL_S (OUTBOX_RELAY_AUTOSTART=False)",
+        )
+
+    def handle(self, *args, **opts):
+        if opts["loop"]:
+            while True:
+                close_old_connections()
+                try:
+                    _tick()
+                except Exception:
+                    logger.exception("[OUTBOX] relay loop tick failed")
+                time.sleep(_interval_s())
+        total = 0
+        while True:
+            sent = relay()
+            total += sent
+            if not sent:
+                break
+        msg = f"Relayed {total} outbox event(s)."
+        if opts["purge"]:
+            msg += f" Purged {purge()} sent event(s)."
+        self.stdout.write(self.style.SUCCESS(msg))
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('RideVTC', '0015_drivernavevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpeedProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cell', models.CharField(max_length=32)),
+                ('hour_of_week', models.PositiveSmallIntegerField()),
+                ('speed_kmh', models.FloatField()),
+                ('samples', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('cell', 'hour_of_week'), name='uniq_speedprofile_cell_how')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('RideVTC', '0016_speedprofile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RideTrace',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('points', models.PositiveIntegerField(default=0)),
+                ('data', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('ride', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='trace', to='RideVTC.ride')),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('RideVTC', '0017_ridetrace'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ride',
+            name='measured_distance_km',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='ride',
+            name='measured_duration_s',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('RideVTC', '0018_ride_measured'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('group', models.CharField(max_length=100)),
+                ('event', models.CharField(max_length=64)),
+                ('message', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('claim', models.CharField(blank=True, default='', max_length=32)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['sent_at', 'id'], name='RideVTC_out_sent_at_3d3bfb_idx'), models.Index(fields=['claim'], name='RideVTC_out_claim_2a4df5_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-17 03:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('RideVTC', '0019_outboxevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ride',
+            name='started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
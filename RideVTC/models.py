@@ -62,6 +62,9 @@ class Ride(models.Model):
     dropoff_lat = models.FloatField(null=True, blank=True)
     dropoff_lng = models.FloatField(null=True, blank=True)
     distance_km = models.FloatField()
+    # mesurés côté serveur à `finish` depuis la trace GPS (RideVTC.utils.tripmeter)
+    measured_distance_km = models.FloatField(null=True, blank=True)
+    measured_duration_s = models.PositiveIntegerField(null=True, blank=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     final_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     pause_started_at = models.DateTimeField(null=True, blank=True)
@@ -70,6 +73,7 @@ class Ride(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     requested_at = models.DateTimeField(auto_now_add=True)
     accepted_at = models.DateTimeField(null=True, blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
     completed_at = models.DateTimeField(null=True, blank=True)
     driver_lat = models.FloatField(null=True, blank=True)
     driver_lng = models.FloatField(null=True, blank=True)
@@ -201,3 +205,63 @@ class DriverNavEvent(models.Model):
 
     def __str__(self):
         return f"{self.driver_id} {self.event_type} {self.request_id}"
+
+
+class SpeedProfile(models.Model):
+    """
+    Vitesse typique (km/h) par cellule de grille et heure de la semaine (0 = lundi 0h … 167).
+    cell = "i:j" (grille ETA_CELL_DEG) ou "*" pour le profil global de l’heure.
+    Reconstruit par `manage.py rebuild_eta_model`, lu par RideVTC.eta.
+    """
+    cell = models.CharField(max_length=32)
+    hour_of_week = models.PositiveSmallIntegerField()
+    speed_kmh = models.FloatField()
+    samples = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["cell", "hour_of_week"], name="uniq_speedprofile_cell_how"),
+        ]
+
+    def __str__(self):
+        return f"SpeedProfile({self.cell} h{self.hour_of_week} {self.speed_kmh:.1f} km/h n={self.samples})"
+
+
+class RideTrace(models.Model):
+    """
+    Trace GPS d’une course, une ligne par course : blob compact (deltas int32 en
+    micro-degrés + ms, cf. RideVTC.utils.trace), écrit une seule fois à `finish`.
+    """
+    ride = models.OneToOneField('Ride', on_delete=models.CASCADE, related_name='trace')
+    points = models.PositiveIntegerField(default=0)
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"RideTrace(ride={self.ride_id}, points={self.points}, {len(self.data or b'')} B)"
+
+
+class OutboxEvent(models.Model):
+    """
+    Événement temps réel enregistré dans la transaction qui le produit (outbox),
+    diffusé après commit par RideVTC.utils.outbox.relay. id = numéro de séquence
+    (monotone) transmis au client ("seq") pour dédupliquer les re-livraisons.
+    """
+    group = models.CharField(max_length=100)
+    event = models.CharField(max_length=64)
+    message = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    claim = models.CharField(max_length=32, blank=True, default="")
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["sent_at", "id"]),
+            models.Index(fields=["claim"]),
+        ]
+
+    def __str__(self):
+        return f"Outbox#{self.pk} {self.event} → {self.group} sent={self.sent_at is not None}"
@@ -1,18 +1,296 @@
-import asyncio
-import time
+# RideVTC/presence.py
+"""
+Service de présence chauffeur (source unique : sockets WS, pings, PATCH presence).
+
+  - par chauffeur : dernière activité (ts) + pool (pool_room(catégorie, zone)) ;
+  - par pool : ensemble trié (ts, driver_id) → "qui est en ligne dans le pool X
+    depuis moins de N s" = une bisection, O(log n + k) ;
+  - miroir partagé (cache Django, comme geoindex) pour les autres workers :
+        presence:drv:<id>     → (ts, pool) ; (ts, None) = passé hors ligne (go_offline),
+                                pour que les autres workers ne retombent pas sur une
+                                ligne DriverPresence pas encore écrite ;
+        presence:pool:<pool>  → {driver_id: ts}
+    NB: lecture-modification-écriture non atomique ; réparée au flush suivant ;
+  - touch() (ping WS) n’écrit qu’en mémoire : aucun aller-retour cache ni DB
+    sur la boucle d’événements, le chauffeur est seulement marqué "à écrire" ;
+  - un flusher (PRESENCE_FLUSH_INTERVAL_S, thread d’arrière-plan) expire les
+    entrées sans activité depuis PRESENCE_TIMEOUT_S, met à jour le miroir
+    partagé pour tous les chauffeurs touchés (un get_many + un set_many) et
+    écrit last_seen / is_online dans DriverPresence en un seul upsert groupé
+    → une écriture DB par intervalle au lieu d’une par ping ;
+  - Driver.is_online (app drivers, admin) n’est qu’un reflet : les transitions
+    en ligne / hors ligne y sont recopiées au même flush, personne d’autre ne l’écrit.
+"""
+import bisect
 import logging
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
 from django.core.cache import cache
+from django.db import transaction
+
+from blaze_backend import metrics
+from blaze_backend.background import every
+from .utils.rooms import pool_room
 
 logger = logging.getLogger(__name__)
 
-async def _presence_touch(driver_id: int):
+
+def _timeout_s() -> float:
+    return float(getattr(settings, "PRESENCE_TIMEOUT_S", 90))
+
+def _flush_interval_s() -> float:
+    return float(getattr(settings, "PRESENCE_FLUSH_INTERVAL_S", 5))
+
+def _drv_key(driver_id: int) -> str:
+    return f"presence:drv:{int(driver_id)}"
+
+def _pool_key(pool: str) -> str:
+    return f"presence:pool:{pool}"
+
+
+class _SortedPool:
+    """Chauffeurs d’un pool triés par dernière activité."""
+
+    def __init__(self):
+        self.entries: List[Tuple[float, int]] = []
+        self.ts: Dict[int, float] = {}
+
+    def put(self, driver_id: int, ts: float) -> None:
+        self.discard(driver_id)
+        bisect.insort(self.entries, (ts, driver_id))
+        self.ts[driver_id] = ts
+
+    def discard(self, driver_id: int) -> None:
+        old = self.ts.pop(driver_id, None)
+        if old is not None:
+            i = bisect.bisect_left(self.entries, (old, driver_id))
+            if i < len(self.entries) and self.entries[i] == (old, driver_id):
+                del self.entries[i]
+
+    def since(self, cutoff: float) -> List[int]:
+        return [d for _, d in self.entries[bisect.bisect_left(self.entries, (cutoff, -1)):]]
+
+    def expired(self, cutoff: float) -> List[int]:
+        return [d for _, d in self.entries[:bisect.bisect_left(self.entries, (cutoff, -1))]]
+
+
+class PresenceService:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seen: Dict[int, Tuple[float, str]] = {}      # driver_id → (ts, pool)
+        self._pools: Dict[str, _SortedPool] = {}
+        self._changes: Dict[int, Tuple[bool, float]] = {}  # à écrire dans DriverPresence
+        self._touched: Dict[int, Optional[str]] = {}       # à recopier dans le miroir → ancien pool éventuel
+        self._transitions: Dict[int, bool] = {}            # en ligne / hors ligne → Driver.is_online
+
+    # ── écriture ────────────────────────────────────────────
+    def touch(
+        self, driver_id: int, category: Optional[str] = None, area: Optional[str] = None,
+        now: Optional[float] = None,
+    ) -> None:
+        """Activité du chauffeur (connexion, ping, passage en ligne) — mémoire uniquement, non bloquant."""
+        driver_id, now = int(driver_id), (time.time() if now is None else now)
+        with self._lock:
+            prev = self._seen.get(driver_id)
+            if category or area or prev is None:
+                pool = pool_room(category or "eco", area or "city-default")
+            else:
+                pool = prev[1]
+            moved_from = self._touched.get(driver_id)
+            if prev is not None and prev[1] != pool:
+                self._pool(prev[1]).discard(driver_id)
+                moved_from = moved_from or prev[1]
+            self._pool(pool).put(driver_id, now)
+            self._seen[driver_id] = (now, pool)
+            self._touched[driver_id] = moved_from
+            self._changes[driver_id] = (True, now)
+            if prev is None:
+                self._transitions[driver_id] = True
+        every("presence-flush", _flush_interval_s(), self.flush)
+
+    def go_offline(self, driver_id: int) -> None:
+        driver_id = int(driver_id)
+        with self._lock:
+            prev = self._seen.pop(driver_id, None)
+            if prev is not None:
+                self._pool(prev[1]).discard(driver_id)
+            moved_from = self._touched.pop(driver_id, None)
+            self._changes[driver_id] = (False, prev[0] if prev else time.time())
+            self._transitions[driver_id] = False
+        if moved_from:
+            self._shared_sync({}, {driver_id: moved_from}, [])
+        self._shared_remove(driver_id, prev[1] if prev else None)
+        every("presence-flush", _flush_interval_s(), self.flush)
+
+    def _pool(self, pool: str) -> _SortedPool:
+        sp = self._pools.get(pool)
+        if sp is None:
+            sp = self._pools[pool] = _SortedPool()
+        return sp
+
+    # ── lecture ─────────────────────────────────────────────
+    def last_seen(self, driver_id: int) -> Optional[float]:
+        """Dernière activité connue (ce worker, puis miroir partagé, puis DriverPresence)."""
+        with self._lock:
+            local = self._seen.get(int(driver_id))
+            pending = self._changes.get(int(driver_id))
+        if local is not None:
+            return local[0]
+        if pending is not None and not pending[0]:
+            return None  # passé hors ligne ici, pas encore recopié (miroir / DB)
+        try:
+            shared = cache.get(_drv_key(driver_id))
+        except Exception:
+            shared = None
+        if shared is not None:
+            return shared[0] if shared[1] else None
+        from .models import DriverPresence
+        row = DriverPresence.objects.filter(driver_id=driver_id, is_online=True).values_list("last_seen", flat=True).first()
+        return row.timestamp() if row else None
+
+    def is_online(self, driver_id: int, timeout_s: Optional[float] = None) -> bool:
+        ts = self.last_seen(driver_id)
+        return ts is not None and time.time() - ts <= (_timeout_s() if timeout_s is None else timeout_s)
+
+    def online_in_pool(
+        self, category: str, area: str, within_s: Optional[float] = None, include_remote: bool = False,
+    ) -> List[int]:
+        """Chauffeurs actifs depuis moins de `within_s` dans le pool (bisection sur l’ensemble trié)."""
+        pool = pool_room(category, area)
+        cutoff = time.time() - (_timeout_s() if within_s is None else within_s)
+        with self._lock:
+            sp = self._pools.get(pool)
+            ids = sp.since(cutoff) if sp else []
+        if include_remote:
+            try:
+                remote = cache.get(_pool_key(pool)) or {}
+            except Exception:
+                remote = {}
+            seen = set(ids)
+            ids += [int(d) for d, ts in remote.items() if ts >= cutoff and int(d) not in seen]
+        return ids
+
+    # ── miroir partagé ──────────────────────────────────────
+    def _shared_sync(
+        self, touched: Dict[int, Tuple[float, str]], moved: Dict[int, str], expired: List[Tuple[int, str]],
+    ) -> None:
+        """Recopie un lot dans le miroir : un get_many des pools concernés, un set_many, un delete_many."""
+        ttl = int(_timeout_s() * 2)
+        pools = {pool for _, pool in touched.values()} | set(moved.values()) | {pool for _, pool in expired}
+        if not pools:
+            return
+        try:
+            found = cache.get_many([_pool_key(p) for p in pools])
+            members = {p: found.get(_pool_key(p)) or {} for p in pools}
+            dirty = set()
+            for driver_id, old_pool in moved.items():
+                if members[old_pool].pop(driver_id, None) is not None:
+                    dirty.add(old_pool)
+            for driver_id, pool in expired:
+                if members[pool].pop(driver_id, None) is not None:
+                    dirty.add(pool)
+            for driver_id, (ts, pool) in touched.items():
+                members[pool][driver_id] = ts
+                dirty.add(pool)
+            updates = {_pool_key(p): members[p] for p in dirty}
+            updates.update({_drv_key(d): seen for d, seen in touched.items()})
+            if updates:
+                cache.set_many(updates, timeout=ttl)
+            if expired:
+                cache.delete_many([_drv_key(d) for d, _ in expired])
+        except Exception as e:
+            logger.warning("[PRESENCE] shared sync failed (%s drivers): %s", len(touched) + len(expired), e)
+
+    def _shared_discard(self, pool: str, driver_id: int) -> None:
+        members = cache.get(_pool_key(pool)) or {}
+        if members.pop(driver_id, None) is not None:
+            cache.set(_pool_key(pool), members, timeout=int(_timeout_s() * 2))
+
+    def _shared_remove(self, driver_id: int, pool: Optional[str]) -> None:
+        try:
+            if pool is None:
+                shared = cache.get(_drv_key(driver_id))
+                pool = shared[1] if shared else None
+            if pool:
+                self._shared_discard(pool, driver_id)
+            cache.set(_drv_key(driver_id), (time.time(), None), timeout=int(_timeout_s() * 2))
+        except Exception as e:
+            logger.warning("[PRESENCE] shared remove failed driver#%s: %s", driver_id, e)
+
+    # ── flusher ─────────────────────────────────────────────
+    def flush(self, now: Optional[float] = None) -> int:
+        """
+        Expire les chauffeurs inactifs, recopie les chauffeurs touchés dans le miroir
+        partagé et écrit toutes les modifications dans DriverPresence (upsert groupé).
+        Retourne le nombre d’entrées expirées.
+        """
+        now = time.time() if now is None else now
+        cutoff = now - _timeout_s()
+        expired: List[Tuple[int, str]] = []
+        with self._lock:
+            for pool, sp in self._pools.items():
+                for driver_id in sp.expired(cutoff):
+                    sp.discard(driver_id)
+                    ts, _ = self._seen.pop(driver_id, (cutoff, pool))
+                    self._touched.pop(driver_id, None)
+                    self._changes[driver_id] = (False, ts)
+                    self._transitions[driver_id] = False
+                    expired.append((driver_id, pool))
+            touched = {d: self._seen[d] for d in self._touched if d in self._seen}
+            moved = {d: old for d, old in self._touched.items() if old and old != self._seen.get(d, (0, old))[1]}
+            self._touched = {}
+            changes, self._changes = self._changes, {}
+            transitions, self._transitions = self._transitions, {}
+        self._shared_sync(touched, moved, expired)
+        if expired:
+            metrics.incr("presence.expired", len(expired))
+        if changes:
+            try:
+                self._write_through(changes, transitions)
+            except Exception:
+                with self._lock:
+                    for driver_id, change in changes.items():
+                        self._changes.setdefault(driver_id, change)
+                    for driver_id, online in transitions.items():
+                        self._transitions.setdefault(driver_id, online)
+                raise
+        return len(expired)
+
+    @staticmethod
+    def _write_through(changes: Dict[int, Tuple[bool, float]], transitions: Dict[int, bool]) -> None:
+        from drivers.models import Driver
+        from .models import DriverPresence
+        rows = [
+            DriverPresence(
+                driver_id=driver_id, is_online=online,
+                last_seen=datetime.fromtimestamp(ts, tz=dt_timezone.utc),
+            )
+            for driver_id, (online, ts) in changes.items()
+        ]
+        with transaction.atomic():
+            DriverPresence.objects.bulk_create(
+                rows, batch_size=500,
+                update_conflicts=True, unique_fields=["driver"], update_fields=["is_online", "last_seen"],
+            )
+            # reflet Driver.is_online : seulement les transitions (≤ 2 UPDATE)
+            for online in (True, False):
+                ids = [d for d, o in transitions.items() if o is online]
+                if ids:
+                    Driver.objects.filter(user_id__in=ids).update(is_online=online)
+        metrics.incr("presence.persisted", len(rows))
+
+
+PRESENCE = PresenceService()
+
+
+async def _presence_touch(driver_id: int, category: Optional[str] = None, area: Optional[str] = None):
     """
     Marque un chauffeur comme actif (dernière activité).
-    Sert pour le tracking de présence WebSocket (ping/pong).
+    Sert pour le tracking de présence WebSocket (ping/pong) : écriture mémoire
+    seulement, le miroir cache et DriverPresence sont mis à jour par flush().
     """
-    key = f"driver:{driver_id}:last_seen"
-    ts = int(time.time())
-    cache.set(key, ts, timeout=600)  # expire après 10 minutes
-    logger.debug(f"[PRESENCE] touch driver#{driver_id} at {ts}")
-    # Optionnel : petit délai pour ne pas bloquer le loop
-    await asyncio.sleep(0)
\ No newline at end of file
+    PRESENCE.touch(driver_id, category=category, area=area)
@@ -2,6 +2,7 @@
 
 from rest_framework import serializers
 from .models import RideVehicle, Ride, DriverNavEvent
+import math
 import re
 
 PLUSCODE_RX = re.compile(r"^[23456789CFGHJMPQRVWX]+\+[\dA-Z]{2,}.*$", re.IGNORECASE)
@@ -79,6 +80,7 @@ class RideSerializer(serializers.ModelSerializer):
     class Meta:
         model = Ride
         fields = "__all__"
+        read_only_fields = ("measured_distance_km", "measured_duration_s", "started_at")
 
 
 class RideOutSerializer(serializers.ModelSerializer):
@@ -87,8 +89,14 @@ class RideOutSerializer(serializers.ModelSerializer):
         fields = ["id", "status"]
 
 class DriverLocationSerializer(serializers.Serializer):
-    lat = serializers.FloatField()
-    lng = serializers.FloatField()
+    lat = serializers.FloatField(min_value=-90, max_value=90)
+    lng = serializers.FloatField(min_value=-180, max_value=180)
+
+    def validate(self, attrs):
+        # "nan" passe les bornes (toute comparaison est fausse)
+        if not (math.isfinite(attrs["lat"]) and math.isfinite(attrs["lng"])):
+            raise serializers.ValidationError("lat/lng must be finite numbers")
+        return attrs
 
 class RateDriverSerializer(serializers.Serializer):
     rating = serializers.IntegerField(min_value=1, max_value=5)
@@ -1,3 +1,1165 @@
-from django.test import TestCase
+import itertools
+import math
+import random
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from RideVTC import dispatch
+from RideVTC.apps import _is_server_process
+from RideVTC.consumers import BusEventMixin, DriverConsumer
+from RideVTC.models import DriverPresence, OutboxEvent, Ride, RideTrace
+from RideVTC.presence import PresenceService, _presence_touch
+from RideVTC.utils import claims, eventbus, geocache, geoindex, outbox, payloads, pluscode, sockets, trace, tripmeter
+from RideVTC.utils.assignment import UNREACHABLE, solve_assignment
+from RideVTC.utils.locations import RelayFilter, _fix_ts_ms
+from drivers.models import Driver
+from users.models import CustomUser
+
+
+def _brute_force(cost):
+    """Coût minimal et nombre de paires atteignables, par énumération (petites matrices)."""
+    n, m = len(cost), len(cost[0])
+    best = None
+    if n <= m:
+        candidates = (list(zip(range(n), cols)) for cols in itertools.permutations(range(m), n))
+    else:
+        candidates = (list(zip(rows, range(m))) for rows in itertools.permutations(range(n), m))
+    for pairs in candidates:
+        kept = [(i, j) for i, j in pairs if cost[i][j] < UNREACHABLE]
+        key = (-len(kept), sum(cost[i][j] for i, j in kept))
+        if best is None or key < best:
+            best = key
+    return -best[0], best[1]
+
+
+class SolveAssignmentTests(SimpleTestCase):
+    def test_matches_brute_force_on_random_matrices(self):
+        rng = random.Random(42)
+        for _ in range(200):
+            n, m = rng.randint(1, 5), rng.randint(1, 5)
+            cost = [[rng.uniform(0, 10) for _ in range(m)] for _ in range(n)]
+            pairs = solve_assignment(cost)
+            self.assertEqual(len({i for i, _ in pairs}), len(pairs))
+            self.assertEqual(len({j for _, j in pairs}), len(pairs))
+            count, total = _brute_force(cost)
+            self.assertEqual(len(pairs), count)
+            self.assertAlmostEqual(sum(cost[i][j] for i, j in pairs), total, places=6)
+
+    def test_unreachable_pairs_are_dropped(self):
+        cost = [[1.0, UNREACHABLE], [UNREACHABLE, UNREACHABLE]]
+        self.assertEqual(solve_assignment(cost), [(0, 0)])
+
+    def test_prefers_global_optimum_over_greedy(self):
+        # glouton : (0,0)=1 puis (1,1)=100 → 101 ; optimum : (0,1)+(1,0) = 4
+        cost = [[1.0, 2.0], [2.0, 100.0]]
+        self.assertEqual(solve_assignment(cost), [(0, 1), (1, 0)])
+
+    def test_empty_matrix(self):
+        self.assertEqual(solve_assignment([]), [])
+
+
+class PlusCodeTests(SimpleTestCase):
+    def test_decode_full_codes(self):
+        # vecteurs de la spécification Open Location Code
+        lat, lng, h, w = pluscode.decode("7FG49Q00+")
+        self.assertAlmostEqual(lat, 20.375)
+        self.assertAlmostEqual(lng, 2.775)
+        self.assertAlmostEqual(h, 0.05)
+        lat, lng, _, _ = pluscode.decode("8FVC9G8F+6X")
+        self.assertAlmostEqual(lat, 47.3655625)
+        self.assertAlmostEqual(lng, 8.5249375)
+
+    def test_decode_rejects_short_code(self):
+        with self.assertRaises(ValueError):
+            pluscode.decode("CF88+22")
+
+    def test_recover_short_codes(self):
+        for full, short, ref in [
+            ("9C3W9QCJ+2VX", "CJ+2VX", (51.3701125, -1.217765625)),
+            ("8FJFW222+", "22+", (42.899, 9.012)),
+            ("796RXG22+", "22+", (14.95125, -23.5001)),
+        ]:
+            lat, lng = pluscode.recover_nearest(short, *ref)
+            elat, elng, _, _ = pluscode.decode(full)
+            self.assertAlmostEqual(lat, elat, places=9)
+            self.assertAlmostEqual(lng, elng, places=9)
+
+    def test_resolve_uses_locality_in_label(self):
+        lat, lng, locality = pluscode.resolve_plus_code("7QJJ+22, Port-Gentil")
+        elat, elng, _, _ = pluscode.decode("6FFC7QJJ+22")
+        self.assertEqual(locality, "port-gentil")
+        self.assertAlmostEqual(lat, elat, places=9)
+        self.assertAlmostEqual(lng, elng, places=9)
+
+    def test_resolve_defaults_to_libreville(self):
+        lat, lng, locality = pluscode.resolve_plus_code("CF88+22")
+        elat, elng, _, _ = pluscode.decode("6FGFCF88+22")
+        self.assertEqual(locality, "libreville")
+        self.assertAlmostEqual(lat, elat, places=9)
+        self.assertAlmostEqual(lng, elng, places=9)
+
+    def test_resolve_ignores_plain_addresses(self):
+        self.assertIsNone(pluscode.resolve_plus_code("Rue de la Paix"))
+        self.assertIsNone(pluscode.resolve_plus_code("CF88+22", default_locality=None))
+
+    def test_offer_label_decoded_without_network(self):
+        with mock.patch.object(payloads, "reverse_geocode") as rev, mock.patch.object(payloads, "geocode_label") as geo:
+            label, lat, lng = payloads._best_triplet("CF88+22", None, None, "fr")
+        self.assertEqual(label, "CF88+22, Libreville")
+        self.assertAlmostEqual(lat, pluscode.decode("6FGFCF88+22")[0], places=9)
+        rev.assert_not_called()
+        geo.assert_not_called()
+
+
+class TraceEncodingTests(SimpleTestCase):
+    def _points(self, n=500):
+        rng = random.Random(7)
+        lat, lng, t = 0.4162, 9.4673, 1_760_000_000_000
+        out = []
+        for _ in range(n):
+            lat += rng.uniform(-2e-4, 2e-4)
+            lng += rng.uniform(-2e-4, 2e-4)
+            t += rng.randint(500, 5000)
+            out.append((round(lat, 6), round(lng, 6), t))
+        return out
+
+    def test_round_trip_is_lossless_at_microdegrees(self):
+        points = self._points()
+        decoded = trace.decode(trace.encode(points))
+        self.assertEqual(len(decoded), len(points))
+        for (lat, lng, t), (elat, elng, et) in zip(decoded, points):
+            self.assertEqual(round(lat * 1e6), round(elat * 1e6))
+            self.assertEqual(round(lng * 1e6), round(elng * 1e6))
+            self.assertEqual(t, et)
+
+    def test_twelve_bytes_per_fix(self):
+        points = self._points(100)
+        self.assertEqual(len(trace.encode(points)), trace._HEADER.size + 12 * len(points))
+
+    def test_negative_deltas_and_hemispheres(self):
+        points = [(-0.7193, 8.7815, 1000), (0.0001, -0.0001, 2000), (-89.999999, 179.999999, 1500)]
+        self.assertEqual(
+            [(round(a, 6), round(b, 6), t) for a, b, t in trace.decode(trace.encode(points))], points,
+        )
+
+    def test_overflowing_delta_leaves_buffer_consistent(self):
+        buf = trace._TraceBuffer()
+        buf.append(0.4, 9.4, 1_760_000_000_000)
+        with self.assertRaises(ValueError):
+            buf.append(0.41, 9.41, 1000)
+        self.assertEqual((len(buf.dlat), len(buf.dlng), len(buf.dt)), (1, 1, 1))
+        buf.append(0.41, 9.41, 1_760_000_001_000)
+        self.assertEqual([p[2] for p in trace.decode(buf.encode())], [1_760_000_000_000, 1_760_000_001_000])
+
+    @override_settings(TRACE_MAX_PAST_S=3600, TRACE_MAX_FUTURE_S=60)
+    def test_append_fix_replaces_implausible_client_timestamps(self):
+        now_ms = 1_760_000_000_000
+        buffers = {}
+        with mock.patch.object(trace, "_BUFFERS", buffers), mock.patch.object(trace, "every"), \
+                mock.patch.object(trace.time, "time", return_value=now_ms / 1000):
+            trace.append_fix(1, 0.4, 9.4)                         # heure serveur
+            trace.append_fix(1, 0.401, 9.4, ts_ms=1)              # epoch 1970 → heure serveur
+            trace.append_fix(1, 0.402, 9.4, ts_ms=now_ms + 3_600_000)  # futur → heure serveur
+            trace.append_fix(1, 0.403, 9.4, ts_ms=now_ms - 10_000)     # plausible mais hors ordre
+            trace.append_fix(1, 0.404, 9.4, ts_ms=now_ms + 5_000)      # plausible, dans l’ordre
+        points = trace.decode(buffers[1].encode())
+        self.assertEqual([t for _, _, t in points], [now_ms] * 4 + [now_ms + 5_000])
+        self.assertEqual(len(points), 5)
+
+    def test_empty_and_foreign_blobs(self):
+        self.assertEqual(trace.decode(trace.encode([])), [])
+        with self.assertRaises(ValueError):
+            trace.decode(b"XXXX" + bytes(trace._HEADER.size))
+
+
+class TripmeterTests(SimpleTestCase):
+    # sur l’équateur, 0,001° de longitude ≈ 111,2 m ; un fix toutes les 10 s → ~40 km/h
+    STEP_KM = 2 * tripmeter._EARTH_KM * math.sin(math.radians(0.001) / 2)
+
+    def _path(self, n=11):
+        return [0.0] * n, [i * 0.001 for i in range(n)], [i * 10_000 for i in range(n)]
+
+    def test_distance_and_moving_time_on_known_path(self):
+        km, s = tripmeter.measure(*self._path())
+        self.assertAlmostEqual(km, 10 * self.STEP_KM, places=6)
+        self.assertAlmostEqual(s, 100.0)
+
+    def test_isolated_spike_is_removed(self):
+        lat, lng, t = self._path()
+        lat[5] = 0.05  # ~5,5 km hors trajet en 10 s
+        km, s = tripmeter.measure(lat, lng, t)
+        # le pic est retiré : le segment 4→6 (2 pas, 20 s) remplace 4→5→6
+        self.assertAlmostEqual(km, 10 * self.STEP_KM, places=6)
+        self.assertAlmostEqual(s, 100.0)
+
+    def test_stops_and_out_of_order_fixes_are_ignored(self):
+        lat, lng, t = self._path()
+        # 60 s d’arrêt au point 5, puis un fix dupliqué / hors ordre
+        lat = lat[:6] + [0.0] * 6 + lat[6:]
+        lng = lng[:6] + [lng[5]] * 6 + lng[6:]
+        t = t[:6] + [t[5] + k * 10_000 for k in range(1, 7)] + [x + 60_000 for x in t[6:]]
+        lat.insert(4, 0.0)
+        lng.insert(4, lng[2])
+        t.insert(4, t[3] - 1)
+        km, s = tripmeter.measure(lat, lng, t)
+        self.assertAlmostEqual(km, 10 * self.STEP_KM, places=6)
+        self.assertAlmostEqual(s, 100.0)
+
+    def test_measure_blob_matches_measure(self):
+        lat, lng, t = self._path()
+        t = [1_760_000_000_000 + x for x in t]
+        blob = trace.encode(list(zip(lat, lng, t)))
+        self.assertEqual(tripmeter.measure_blob(blob), tripmeter.measure(lat, lng, t))
+        self.assertEqual(tripmeter.measure_blob(None), (0.0, 0.0))
+        self.assertEqual(tripmeter.measure([0.0], [0.0], [0]), (0.0, 0.0))
+
+
+@override_settings(
+    LOCATION_RELAY_MIN_INTERVAL_MS=1000,
+    LOCATION_RELAY_MAX_SILENCE_MS=10000,
+    LOCATION_RELAY_MIN_DISTANCE_M=5.0,
+    LOCATION_RELAY_MIN_HEADING_DEG=15.0,
+)
+class RelayFilterTests(SimpleTestCase):
+    # 0,0001° de latitude ≈ 11 m
+    def setUp(self):
+        self.f = RelayFilter()
+        self.assertTrue(self.f.should_relay(1, 7, 0.4, 9.4, heading=0.0, now=100.0))
+
+    def test_min_interval(self):
+        self.assertFalse(self.f.should_relay(1, 7, 0.401, 9.4, heading=0.0, now=100.5))
+        self.assertTrue(self.f.should_relay(1, 7, 0.401, 9.4, heading=0.0, now=101.0))
+
+    def test_small_move_without_turn_is_suppressed(self):
+        self.assertFalse(self.f.should_relay(1, 7, 0.40002, 9.4, heading=5.0, now=102.0))
+        self.assertTrue(self.f.should_relay(1, 7, 0.4001, 9.4, heading=0.0, now=103.0))
+
+    def test_turn_in_place_is_relayed(self):
+        self.assertTrue(self.f.should_relay(1, 7, 0.4, 9.4, heading=90.0, now=102.0))
+        # écart d’angle mesuré sur le plus court chemin (350° → 5° = 15°)
+        self.assertTrue(self.f.should_relay(1, 7, 0.4, 9.4, heading=350.0, now=104.0))
+        self.assertFalse(self.f.should_relay(1, 7, 0.4, 9.4, heading=0.0, now=106.0))
+
+    def test_max_silence_forces_relay(self):
+        self.assertFalse(self.f.should_relay(1, 7, 0.4, 9.4, heading=0.0, now=105.0))
+        self.assertTrue(self.f.should_relay(1, 7, 0.4, 9.4, heading=0.0, now=110.0))
+
+    def test_state_is_per_ride_and_driver(self):
+        self.assertTrue(self.f.should_relay(2, 7, 0.4, 9.4, heading=0.0, now=100.1))
+        self.assertTrue(self.f.should_relay(1, 8, 0.4, 9.4, heading=0.0, now=100.1))
+
+    def test_forget_ride(self):
+        self.f.forget_ride(1)
+        self.assertTrue(self.f.should_relay(1, 7, 0.4, 9.4, heading=0.0, now=100.1))
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "geoidx-tests"}},
+)
+class GeoIndexWorkersTests(SimpleTestCase):
+    """Deux workers ASGI : chacun son index local, un seul miroir partagé (cache)."""
+
+    def setUp(self):
+        cache.clear()
+        self.worker_a = geoindex.GridIndex(geoindex._cell_deg())
+        self.worker_b = geoindex.GridIndex(geoindex._cell_deg())
+
+    def on(self, worker):
+        return mock.patch.object(geoindex, "_INDEX", worker)
+
+    def nearest(self, worker):
+        with self.on(worker):
+            return [did for did, _ in geoindex.nearest_drivers(0.4, 9.4, "eco", k=5)]
+
+    def test_busy_on_other_worker_is_not_offered(self):
+        with self.on(self.worker_a):
+            geoindex.update_driver_location(1, 0.4, 9.4, category="eco", area="lbv")
+            geoindex.update_driver_location(2, 0.401, 9.401, category="eco", area="lbv")
+        self.assertEqual(self.nearest(self.worker_a), [1, 2])
+        self.assertEqual(self.nearest(self.worker_b), [1, 2])
+
+        with self.on(self.worker_b):
+            geoindex.mark_busy(1)
+        # l’entrée locale du worker A ne suffit plus : le miroir partagé fait foi
+        self.assertEqual(self.nearest(self.worker_a), [2])
+        self.assertIsNone(self.worker_a.get(1))
+        # ses pings pendant la course ne le réindexent pas
+        with self.on(self.worker_a):
+            geoindex.update_driver_location(1, 0.4, 9.4)
+        self.assertEqual(self.nearest(self.worker_a), [2])
+
+    def test_offline_on_other_worker_is_not_offered(self):
+        with self.on(self.worker_a):
+            geoindex.update_driver_location(1, 0.4, 9.4, category="eco", area="lbv")
+        with self.on(self.worker_b):
+            geoindex.remove_driver(1)
+        self.assertEqual(self.nearest(self.worker_a), [])
+
+    def test_busy_marker_wins_over_stale_shared_cell(self):
+        with self.on(self.worker_a):
+            geoindex.update_driver_location(1, 0.4, 9.4, category="eco", area="lbv")
+        # écriture concurrente perdue : la cellule partagée le liste encore
+        cache.set(geoindex._busy_cache_key(1), ("eco", "lbv"))
+        self.assertEqual(self.nearest(self.worker_a), [])
+
+    def test_local_index_used_when_cache_is_down(self):
+        with self.on(self.worker_a):
+            geoindex.update_driver_location(1, 0.4, 9.4, category="eco", area="lbv")
+        with mock.patch.object(geoindex, "_shared_cells", return_value=None):
+            self.assertEqual(self.nearest(self.worker_a), [1])
+
+    def test_mark_free_reindexes_online_driver(self):
+        with self.on(self.worker_a):
+            geoindex.update_driver_location(1, 0.4, 9.4, category="comfort", area="lbv")
+            geoindex.mark_busy(1)
+        with self.on(self.worker_b), mock.patch.object(geoindex.PRESENCE, "is_online", return_value=True):
+            geoindex.mark_free(1, 0.4, 9.4)
+        with self.on(self.worker_a):
+            self.assertEqual([d for d, _ in geoindex.nearest_drivers(0.4, 9.4, "comfort")], [1])
+
+
+def _make_ride(status="in_progress", driver=True, **extra):
+    n = CustomUser.objects.count()
+    user = CustomUser.objects.create(email=f"client{n}@test.io", phone_number=f"+2410{n:05d}")
+    drv = CustomUser.objects.create(email=f"driver{n}@test.io", phone_number=f"+2411{n:05d}") if driver else None
+    return Ride.objects.create(
+        user=user, driver=drv, status=status, pickup_location="A", dropoff_location="B",
+        distance_km=1, price=1000, **extra,
+    )
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "trace-tests"}},
+)
+class TraceMergeTests(TestCase):
+    """finish sur le worker A pendant que le worker B n’a pas encore recopié ses derniers fixes."""
+
+    def setUp(self):
+        cache.clear()
+        self.ride = _make_ride()
+        self.t0 = int(time.time() * 1000) - 120_000
+
+    def worker(self, buffers, token):
+        return mock.patch.multiple(trace, _BUFFERS=buffers, _TOKEN=token, every=mock.DEFAULT)
+
+    def test_late_fixes_from_another_worker_are_merged(self):
+        a, b = {}, {}
+        with self.worker(a, "worker-a"):
+            for i in range(5):
+                trace.append_fix(self.ride.id, 0.0, i * 0.001, self.t0 + i * 10_000)
+        with self.worker(b, "worker-b"):
+            for i in range(5, 8):
+                trace.append_fix(self.ride.id, 0.0, i * 0.001, self.t0 + i * 10_000)
+        with self.worker(a, "worker-a"), mock.patch.object(trace, "schedule") as sched:
+            stored, points = trace.persist_trace(self.ride.id)
+        self.assertEqual((stored.points, len(points)), (5, 5))
+        delay, fn, *args = sched.call_args[0]
+        self.assertGreaterEqual(delay, trace._remerge_delay_s())
+
+        with self.worker(b, "worker-b"):
+            trace.spill()  # prochain flush du worker B
+        with self.worker(a, "worker-a"):
+            self.assertEqual(fn(*args), 3)
+
+        self.assertEqual(RideTrace.objects.get(ride=self.ride).points, 8)
+        self.ride.refresh_from_db()
+        km, moving_s = tripmeter.measure([0.0] * 8, [i * 0.001 for i in range(8)], [i * 10_000 for i in range(8)])
+        self.assertAlmostEqual(self.ride.measured_distance_km, round(km, 3))
+        self.assertEqual(self.ride.measured_duration_s, int(moving_s))
+        self.assertIsNone(cache.get(trace._parts_key(self.ride.id)))
+
+    def test_remerge_without_new_fixes_keeps_measure(self):
+        a = {}
+        with self.worker(a, "worker-a"):
+            trace.append_fix(self.ride.id, 0.0, 0.0, self.t0)
+            trace.append_fix(self.ride.id, 0.0, 0.001, self.t0 + 10_000)
+            with mock.patch.object(trace, "schedule"):
+                trace.persist_trace(self.ride.id)
+            self.assertEqual(trace.remerge_trace(self.ride.id, 2), 0)
+        self.ride.refresh_from_db()
+        self.assertIsNone(self.ride.measured_distance_km)
+        self.assertEqual(RideTrace.objects.get(ride=self.ride).points, 2)
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "location-tests"}},
+)
+class DriverLocationInputTests(TestCase):
+    """Fix malformé (ts inf/nan/hors fenêtre, coordonnées non finies) : rejeté ou ignoré, jamais une 500."""
+
+    def setUp(self):
+        cache.clear()
+        self.ride = _make_ride()
+        self.driver = self.ride.driver
+        self.buffers = {}
+        for patcher in (
+            mock.patch.multiple(trace, _BUFFERS=self.buffers, every=mock.DEFAULT),
+            mock.patch("RideVTC.presence.every"),   # pas de thread de flush pendant les tests
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def trace_times(self):
+        return [t for _, _, t in trace.decode(self.buffers[self.ride.id].encode())]
+
+    def test_fix_ts_ms(self):
+        now_ms = int(time.time() * 1000)
+        self.assertEqual(_fix_ts_ms({"ts": now_ms}), now_ms)
+        self.assertEqual(_fix_ts_ms({"ts": now_ms / 1000}), now_ms)
+        for bad in ("inf", "-inf", "nan", float("inf"), "1e400", 1, -5, "abc", None, {}):
+            self.assertIsNone(_fix_ts_ms({"ts": bad}), bad)
+        self.assertIsNone(_fix_ts_ms({}))
+
+    def test_rest_bad_ts_falls_back_to_server_time(self):
+        c = APIClient()
+        c.force_authenticate(self.driver)
+        before = int(time.time() * 1000)
+        for ts in ("inf", "nan", "1e400", 1):
+            r = c.post(f"/api/rides/{self.ride.id}/location/", {"lat": 0.4, "lng": 9.4, "ts": ts}, format="json")
+            self.assertEqual(r.status_code, 200, ts)
+        times = self.trace_times()
+        self.assertEqual(len(times), 4)
+        self.assertTrue(all(t >= before for t in times))
+
+    def test_rest_rejects_non_finite_coordinates_and_bad_ids(self):
+        c = APIClient()
+        c.force_authenticate(self.driver)
+        for lat in ("nan", "inf", 91):
+            r = c.post(f"/api/rides/{self.ride.id}/location/", {"lat": lat, "lng": 9.4}, format="json")
+            self.assertEqual(r.status_code, 400, lat)
+        self.assertEqual(c.post("/api/rides/abc/location/", {"lat": 0.4, "lng": 9.4}, format="json").status_code, 404)
+        self.assertNotIn(self.ride.id, self.buffers)
+
+    def test_ws_bad_ts_keeps_socket_open(self):
+        async_to_sync(self._ws_bad_ts)()
+        self.assertEqual(len(self.trace_times()), 3)
+
+    async def _ws_bad_ts(self):
+        from blaze_backend.asgi import application
+
+        token = AccessToken.for_user(self.driver)
+        ws = WebsocketCommunicator(application, f"/ws/rides/driver/{self.driver.id}/?token={token}")
+        connected, _ = await ws.connect()
+        self.assertTrue(connected)
+        try:
+            await ws.send_json_to({"type": "driver.location", "rideId": self.ride.id, "fixes": [
+                {"lat": 0.4, "lng": 9.4, "ts": "inf"},
+                {"lat": 0.4001, "lng": 9.4, "ts": "nan"},
+                {"lat": 0.4002, "lng": 9.4, "ts": 1e300},
+            ]})
+            await ws.send_json_to({"type": "ping"})
+            while True:
+                msg = await ws.receive_json_from(timeout=5)
+                self.assertNotEqual(msg.get("event"), "driver.location.rejected", msg)
+                if msg.get("type") == "pong":
+                    break
+        finally:
+            await ws.disconnect()
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "claim-tests"}},
+)
+class RideClaimTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.ride = _make_ride(status="pending", driver=False)
+        self.d1 = CustomUser.objects.create(email="d1@claim.io", phone_number="+241200001")
+        self.d2 = CustomUser.objects.create(email="d2@claim.io", phone_number="+241200002")
+
+    def accept(self, driver, pk):
+        c = APIClient()
+        c.force_authenticate(driver)
+        return c.post(f"/api/rides/{pk}/accept/")
+
+    def test_only_one_concurrent_claim_wins(self):
+        barrier = threading.Barrier(16)
+        results = []
+
+        def claim(driver_id):
+            barrier.wait()
+            results.append((driver_id, claims.claim_ride(self.ride.id, driver_id)))
+
+        threads = [threading.Thread(target=claim, args=(100 + i,)) for i in range(16)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        winners = [d for d, ok in results if ok]
+        self.assertEqual(len(winners), 1)
+        # retry du gagnant accepté, les autres toujours refusés
+        self.assertTrue(claims.claim_ride(self.ride.id, winners[0]))
+        self.assertFalse(claims.claim_ride(self.ride.id, winners[0] + 1000))
+
+    def test_release_only_by_holder(self):
+        self.assertTrue(claims.claim_ride(self.ride.id, self.d1.id))
+        claims.release_ride_claim(self.ride.id, self.d2.id)
+        self.assertFalse(claims.claim_ride(self.ride.id, self.d2.id))
+        claims.release_ride_claim(self.ride.id, self.d1.id)
+        self.assertTrue(claims.claim_ride(self.ride.id, self.d2.id))
+
+    def test_accept_bad_or_missing_ride_is_404(self):
+        self.assertEqual(self.accept(self.d1, "abc").status_code, 404)
+        self.assertEqual(self.accept(self.d1, 999999).status_code, 404)
+        self.assertIsNone(cache.get(claims._claim_key(999999)))
+
+    def test_accept_releases_claim_when_not_pending(self):
+        Ride.objects.filter(id=self.ride.id).update(status="cancelled")
+        self.assertEqual(self.accept(self.d1, self.ride.id).status_code, 409)
+        self.assertIsNone(cache.get(claims._claim_key(self.ride.id)))
+
+    def test_accept_releases_claim_on_error(self):
+        with mock.patch("RideVTC.views.outbox.record", side_effect=RuntimeError("boom")):
+            with self.assertRaises(RuntimeError):
+                self.accept(self.d1, self.ride.id)
+        self.assertIsNone(cache.get(claims._claim_key(self.ride.id)))
+        # la course reste acceptable par un autre chauffeur
+        self.assertEqual(self.accept(self.d2, self.ride.id).status_code, 200)
+        self.ride.refresh_from_db()
+        self.assertEqual((self.ride.status, self.ride.driver_id), ("accepted", self.d2.id))
+        self.assertEqual(self.accept(self.d1, self.ride.id).status_code, 409)
+
+    def test_ws_accept_releases_claim_when_not_found_or_taken(self):
+        consumer = DriverConsumer()
+        consumer.user_id = self.d1.id
+        self.assertEqual(async_to_sync(consumer._accept_ride)(999999), (False, "Ride not found"))
+        self.assertIsNone(cache.get(claims._claim_key(999999)))
+        Ride.objects.filter(id=self.ride.id).update(status="cancelled")
+        self.assertEqual(async_to_sync(consumer._accept_ride)(self.ride.id), (False, "Ride already cancelled"))
+        self.assertIsNone(cache.get(claims._claim_key(self.ride.id)))
+        Ride.objects.filter(id=self.ride.id).update(status="pending")
+        self.assertEqual(async_to_sync(consumer._accept_ride)(self.ride.id), (True, None))
+        self.assertEqual(cache.get(claims._claim_key(self.ride.id)), self.d1.id)
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "dispatch-tests"}},
+    DISPATCH_MODE="waves",
+    DISPATCH_FIRST_WAVE_SIZE=1,
+    DISPATCH_FIRST_WAVE_RADIUS_KM=1.0,
+    DISPATCH_WAVE_GROWTH=2.0,
+    DISPATCH_MAX_WAVES=3,
+    DISPATCH_RADIUS_KM=5.0,
+)
+class DispatchTestBase(TestCase):
+    """Index, minuterie et bus remplacés : schedule() enregistre, eventbus.send collecte les groupes."""
+    PICKUP = (0.4, 9.4)
+
+    def setUp(self):
+        cache.clear()
+        self.sent = []
+        self.timers = []
+        for target, attr, value in [
+            (geoindex, "_INDEX", geoindex.GridIndex(geoindex._cell_deg())),
+            (dispatch, "_ACTIVE", {}),
+            (dispatch, "_BATCH", {}),
+        ]:
+            patcher = mock.patch.object(target, attr, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for name, side_effect in [
+            ("schedule", lambda delay, fn, *args: self.timers.append((delay, fn, args))),
+            ("every", lambda *a: None),
+        ]:
+            patcher = mock.patch.object(dispatch, name, side_effect=side_effect)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(dispatch.eventbus, "send",
+                                    side_effect=lambda ch, msgs: self.sent.append([g for g, _ in msgs]) or [])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.ride = _make_ride(status="pending", driver=False, pickup_lat=self.PICKUP[0], pickup_lng=self.PICKUP[1])
+
+    def driver_at(self, dlat, category="eco"):
+        n = CustomUser.objects.count()
+        d = CustomUser.objects.create(email=f"drv{n}@dispatch.io", phone_number=f"+2413{n:05d}")
+        geoindex.update_driver_location(d.id, self.PICKUP[0] + dlat, self.PICKUP[1], category=category, area="lbv")
+        return d.id
+
+    def offer(self, ride=None):
+        ride = ride or self.ride
+        payload = {"pickup": {"lat": ride.pickup_lat, "lng": ride.pickup_lng}}
+        return dispatch.offer_ride(object(), ride, payload, "eco", "lbv")
+
+    def fire_timer(self):
+        delay, fn, args = self.timers.pop(0)
+        fn(*args)
+
+
+class WaveDispatchTests(DispatchTestBase):
+    def test_waves_expand_then_fall_back_to_pool_broadcast(self):
+        # ~0,33 / 0,9 / 1,3 / 3,3 km du pickup
+        a, b, c, d = (self.driver_at(x) for x in (0.003, 0.008, 0.012, 0.03))
+        self.assertEqual(self.offer(), [f"driver.{a}"])
+        self.assertEqual(len(self.timers), 1)
+
+        self.fire_timer()   # vague 2 : 2 chauffeurs ≤ 2 km, sans re-notifier a
+        self.assertEqual(self.sent[-1], [f"driver.{b}", f"driver.{c}"])
+        self.fire_timer()   # vague 3 : ≤ 4 km
+        self.assertEqual(self.sent[-1], [f"driver.{d}"])
+        self.fire_timer()   # vagues épuisées → pool
+        self.assertEqual(self.sent[-1], ["pool.eco.lbv"])
+        self.fire_timer()   # dernier délai après le broadcast → fin du dispatch
+        self.assertEqual(len(self.sent), 4)
+        self.assertEqual(self.timers, [])
+        self.assertEqual(dispatch.offered_groups(self.ride.id), [])
+
+    def test_empty_waves_are_skipped(self):
+        far = self.driver_at(0.03)
+        self.offer()
+        self.assertEqual(self.sent, [[f"driver.{far}"]])
+
+    def test_no_driver_broadcasts_to_pool(self):
+        self.assertEqual(self.offer(), ["pool.eco.lbv"])
+        self.assertEqual(self.timers, [])
+
+    def test_timeout_stops_once_ride_is_taken(self):
+        self.driver_at(0.003)
+        self.offer()
+        Ride.objects.filter(id=self.ride.id).update(status="accepted")
+        self.fire_timer()
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(self.timers, [])
+        self.assertEqual(dispatch.offered_groups(self.ride.id), [])
+
+    def test_driver_on_active_ride_is_never_offered(self):
+        busy = self.driver_at(0.001)   # index en retard : toujours indexé
+        free = self.driver_at(0.003)
+        Ride.objects.filter(id=_make_ride(status="in_progress").id).update(driver_id=busy)
+        self.assertEqual(self.offer(), [f"driver.{free}"])
+        self.fire_timer()
+        self.fire_timer()
+        self.assertNotIn(f"driver.{busy}", sum(self.sent, []))
+
+
+class RelayAutostartTests(SimpleTestCase):
+    def test_server_entry_points(self):
+        for argv in (
+            ["/usr/bin/daphne", "blaze_backend.asgi:application"],
+            ["/venv/bin/uvicorn", "blaze_backend.asgi:application"],
+            ["/venv/lib/python3.11/site-packages/uvicorn/__main__.py", "blaze_backend.asgi:application"],
+            ["/venv/bin/gunicorn", "-k", "uvicorn.workers.UvicornWorker", "blaze_backend.asgi:application"],
+            ["manage.py", "runserver", "--noreload"],
+        ):
+            self.assertTrue(_is_server_process(argv), argv)
+
+    def test_everything_else_is_not_a_server(self):
+        for argv in (
+            ["manage.py", "migrate"],
+            ["/venv/bin/django-admin", "migrate"],
+            ["/venv/bin/pytest", "-q"],
+            ["/venv/bin/celery", "-A", "blaze_backend", "worker"],
+            ["-c"],
+            ["scripts/backfill.py"],
+            [],
+        ):
+            self.assertFalse(_is_server_process(argv), argv)
+
+    def test_runserver_autoreload_parent_is_not_a_server(self):
+        with mock.patch.dict("os.environ", {}, clear=False) as env:
+            env.pop("RUN_MAIN", None)
+            self.assertFalse(_is_server_process(["manage.py", "runserver"]))
+            env["RUN_MAIN"] = "true"
+            self.assertTrue(_is_server_process(["manage.py", "runserver"]))
+
+
+class _FakeLayer:
+    """Channel layer minimal : enregistre send / group_send, échoue pour les groupes de `fail`."""
+
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.sent, self.group_sent = [], []
+
+    async def send(self, channel, msg):
+        self.sent.append((channel, msg))
+
+    async def group_send(self, group, msg):
+        if group in self.fail:
+            raise RuntimeError("layer down")
+        self.group_sent.append((group, msg))
+
+
+class _RenderProbe(BusEventMixin):
+    def __init__(self, protocol):
+        self.protocol = protocol
+        self.frames = []
+
+    async def send_json(self, content):
+        self.frames.append(content)
+
+    async def ride_arrived(self, event):  # handler historique "format direct"
+        self.frames.append({"direct": event})
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "bus-tests"}},
+    DRIVER_SOCKET_DIRECT_SEND=True,
+)
+class EventBusTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_messages_dedupes_audiences(self):
+        batch = eventbus.messages("ride.started", {"requestId": 1}, ["user.1", None, "user.1", "driver.2"])
+        self.assertEqual([g for g, _ in batch], ["user.1", "driver.2"])
+        self.assertIs(batch[0][1], batch[1][1])
+        self.assertNotIn("compat", batch[0][1])
+
+    def test_dedupe_only_removes_exact_duplicates(self):
+        a = eventbus.messages("ride.driver.location", {"lat": 1.0, "lng": 2.0}, ["user.1"])[0]
+        b = eventbus.messages("ride.driver.location", {"lat": 1.5, "lng": 2.0}, ["user.1"])[0]
+        same_as_a = ("user.1", {"payload": {"lng": 2.0, "lat": 1.0}, "event": "ride.driver.location", "type": "bus.event"})
+        other_group = ("user.2", a[1])
+        self.assertEqual(eventbus.dedupe([a, b, same_as_a, other_group, a]), [a, b, other_group])
+
+    def test_send_routes_driver_rooms_to_registered_socket(self):
+        cache.set(sockets._key(7), "chan-7")
+        layer = _FakeLayer()
+        failed = eventbus.send(layer, eventbus.messages("ride.requested", {"id": 3}, ["driver.7", "driver.8", "user.1"]))
+        self.assertEqual(failed, [])
+        self.assertEqual([c for c, _ in layer.sent], ["chan-7"])
+        self.assertEqual([g for g, _ in layer.group_sent], ["driver.8", "user.1"])
+
+    def test_send_reports_failed_groups(self):
+        layer = _FakeLayer(fail={"user.1"})
+        batch = eventbus.messages("ride.cancelled", {"requestId": 1}, ["user.1", "user.2"])
+        self.assertEqual(eventbus.send(layer, batch), ["user.1"])
+        self.assertEqual([g for g, _ in layer.group_sent], ["user.2"])
+        self.assertEqual(eventbus.send(None, batch), [])
+
+    def test_negotiate_protocol(self):
+        for query, default, expected in [
+            ({}, 1, 1), ({}, 2, 2), ({"proto": ["2"]}, 1, 2), ({"proto": ["v2"]}, 1, 2),
+            ({"proto": ["9"]}, 1, 2), ({"proto": ["0"]}, 2, 1), ({"proto": ["x"]}, 2, 2),
+        ]:
+            self.assertEqual(eventbus.negotiate_protocol(query, default), expected, query)
+
+    def render(self, protocol, message):
+        probe = _RenderProbe(protocol)
+        async_to_sync(probe.bus_event if message["type"] == eventbus.BUS_TYPE else probe.bus_batch)(message)
+        return probe.frames
+
+    def test_v1_renders_generic_then_direct_frame(self):
+        compat = {"type": "ride.arrived", "requestId": 4}
+        (_, msg), = eventbus.messages("ride.arrived", {"requestId": 4}, ["user.1"], compat=compat)
+        self.assertEqual(self.render(eventbus.PROTOCOL_LEGACY, msg), [
+            {"event": "ride.arrived", "payload": {"requestId": 4}},
+            {"direct": compat},
+        ])
+
+    def test_v2_renders_generic_frame_only(self):
+        compat = {"type": "ride.arrived", "requestId": 4}
+        (_, msg), = eventbus.messages("ride.arrived", {"requestId": 4}, ["user.1"], compat=compat)
+        self.assertEqual(self.render(eventbus.PROTOCOL_CURRENT, msg), [
+            {"event": "ride.arrived", "payload": {"requestId": 4}},
+        ])
+
+    def test_batch_renders_each_event_with_seq(self):
+        (_, first), = eventbus.messages("ride.accepted", {"requestId": 1}, ["user.1"])
+        (_, second), = eventbus.messages("ride.started", {"requestId": 1}, ["user.1"])
+        batch = {"type": eventbus.BATCH_TYPE, "events": [{**first, "seq": 10}, {**second, "seq": 11}]}
+        self.assertEqual(self.render(eventbus.PROTOCOL_CURRENT, batch), [
+            {"event": "ride.accepted", "payload": {"requestId": 1}, "seq": 10},
+            {"event": "ride.started", "payload": {"requestId": 1}, "seq": 11},
+        ])
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "outbox-tests"}},
+    OUTBOX_LEASE_S=30, OUTBOX_BATCH_SIZE=500, OUTBOX_RETENTION_S=3600,
+)
+class OutboxTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def record(self, *events):
+        batch = []
+        for event, group in events:
+            batch += eventbus.messages(event, {"requestId": 1, "event": event}, [group])
+        with mock.patch.object(outbox, "submit") as submit, self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                rows = outbox.record(batch)
+        return rows, submit
+
+    def test_record_dedupes_and_relays_after_commit(self):
+        rows, submit = self.record(("ride.accepted", "user.1"), ("ride.accepted", "user.1"), ("ride.accepted", "driver.2"))
+        self.assertEqual([r.group for r in rows], ["user.1", "driver.2"])
+        submit.assert_called_once_with(outbox.relay)
+
+    def test_rolled_back_transaction_records_nothing(self):
+        with mock.patch.object(outbox, "submit") as submit, self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                outbox.record(eventbus.messages("ride.accepted", {}, ["user.1"]))
+                raise RuntimeError
+        self.assertFalse(OutboxEvent.objects.exists())
+        submit.assert_not_called()
+
+    def test_relay_batches_per_group_with_seq(self):
+        rows, _ = self.record(("ride.accepted", "user.1"), ("ride.started", "user.1"), ("ride.accepted", "user.2"))
+        layer = _FakeLayer()
+        self.assertEqual(outbox.relay(layer), 3)
+        sent = dict(layer.group_sent)
+        self.assertEqual(sent["user.1"]["type"], eventbus.BATCH_TYPE)
+        self.assertEqual([e["seq"] for e in sent["user.1"]["events"]], [rows[0].id, rows[1].id])
+        self.assertEqual([e["event"] for e in sent["user.1"]["events"]], ["ride.accepted", "ride.started"])
+        self.assertEqual((sent["user.2"]["type"], sent["user.2"]["seq"]), (eventbus.BUS_TYPE, rows[2].id))
+        self.assertFalse(OutboxEvent.objects.filter(sent_at__isnull=True).exists())
+        self.assertEqual(outbox.relay(layer), 0)   # rien ne repart
+
+    def test_failed_group_is_retried_after_lease(self):
+        self.record(("ride.accepted", "user.1"), ("ride.accepted", "user.2"))
+        self.assertEqual(outbox.relay(_FakeLayer(fail={"user.1"})), 1)
+        pending = OutboxEvent.objects.get(sent_at__isnull=True)
+        self.assertEqual((pending.group, pending.attempts), ("user.1", 1))
+
+        # bail en cours : un autre relais ne reprend pas la ligne
+        layer = _FakeLayer()
+        self.assertEqual(outbox.relay(layer), 0)
+        self.assertEqual(layer.group_sent, [])
+
+        OutboxEvent.objects.filter(id=pending.id).update(claimed_at=timezone.now() - timedelta(seconds=31))
+        self.assertEqual(outbox.relay(layer), 1)
+        self.assertEqual([(g, m["seq"]) for g, m in layer.group_sent], [("user.1", pending.id)])
+        pending.refresh_from_db()
+        self.assertEqual(pending.attempts, 2)
+        self.assertIsNotNone(pending.sent_at)
+
+    def test_relay_respects_limit(self):
+        self.record(*[("ride.updated", f"user.{i}") for i in range(5)])
+        self.assertEqual(outbox.relay(_FakeLayer(), limit=2), 2)
+        self.assertEqual(OutboxEvent.objects.filter(sent_at__isnull=True).count(), 3)
+
+    def test_purge_deletes_old_sent_rows_only(self):
+        self.record(("ride.accepted", "user.1"), ("ride.accepted", "user.2"), ("ride.accepted", "user.3"))
+        old, recent, unsent = OutboxEvent.objects.order_by("id")
+        OutboxEvent.objects.filter(id=old.id).update(sent_at=timezone.now() - timedelta(hours=2))
+        OutboxEvent.objects.filter(id=recent.id).update(sent_at=timezone.now())
+        self.assertEqual(outbox.purge(), 1)
+        self.assertEqual(list(OutboxEvent.objects.order_by("id").values_list("id", flat=True)), [recent.id, unsent.id])
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "socket-tests"}},
+)
+class DriverSocketRegistryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch("RideVTC.presence.every")  # pas de thread de flush pendant les tests
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_register_refresh_unregister(self):
+        run = async_to_sync
+        self.assertIsNone(run(sockets.aregister)(5, "chan-a"))
+        self.assertIsNone(run(sockets.aregister)(5, "chan-a"))           # même socket : rien à expulser
+        self.assertEqual(run(sockets.aregister)(5, "chan-b"), "chan-a")  # nouvelle socket → ancienne à expulser
+        self.assertFalse(run(sockets.aunregister)(5, "chan-a"))          # l’ancienne ne retire pas la nouvelle
+        self.assertEqual(sockets.live_channel(5), "chan-b")
+
+        cache.delete(sockets._key(5))                                    # entrée expirée (ping tardif)
+        run(sockets.arefresh)(5, "chan-b")
+        self.assertEqual(sockets.live_channel(5), "chan-b")
+        cache.set(sockets._key(5), "chan-c")
+        run(sockets.arefresh)(5, "chan-b")                               # place prise : pas d’écrasement
+        self.assertEqual(sockets.live_channel(5), "chan-c")
+
+        self.assertEqual(run(sockets.alive_channels)([5, 6]), {5: "chan-c"})
+        self.assertTrue(run(sockets.aunregister)(5, "chan-c"))
+        self.assertEqual(run(sockets.alive_channels)([5]), {})
+
+    def test_driver_id_of(self):
+        self.assertEqual(sockets.driver_id_of("driver.42"), 42)
+        for group in ("user.42", "driver.x", "pool.eco.lbv", "", None):
+            self.assertIsNone(sockets.driver_id_of(group))
+
+    def test_second_connection_kicks_the_first(self):
+        driver = CustomUser.objects.create(email="kick@test.io", phone_number="+241400001")
+        async_to_sync(self._kick)(driver)
+        self.assertIsNone(sockets.live_channel(driver.id))
+
+    async def _kick(self, driver):
+        from blaze_backend.asgi import application
+
+        path = f"/ws/rides/driver/{driver.id}/?token={AccessToken.for_user(driver)}"
+        first = WebsocketCommunicator(application, path)
+        self.assertTrue((await first.connect())[0])
+        first_channel = sockets.live_channel(driver.id)
+
+        # l’expulsion passe par channel_layer.send(<channel enregistré>) : valable quel que soit le worker
+        second = WebsocketCommunicator(application, path)
+        self.assertTrue((await second.connect())[0])
+        self.assertEqual(await first.receive_output(timeout=5), {"type": "websocket.close", "code": 4001})
+        second_channel = sockets.live_channel(driver.id)
+        self.assertNotEqual(second_channel, first_channel)
+
+        await first.disconnect(code=4001)
+        self.assertEqual(sockets.live_channel(driver.id), second_channel)
+        await second.send_json_to({"type": "ping"})
+        self.assertEqual(await second.receive_json_from(timeout=5), {"type": "pong"})
+        await second.disconnect()
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "presence-tests"}},
+    PRESENCE_TIMEOUT_S=90,
+)
+class PresenceServiceTests(TestCase):
+    """Deux instances = deux workers partageant le miroir (cache) et la base."""
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch("RideVTC.presence.every")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.worker_a, self.worker_b = PresenceService(), PresenceService()
+        self.now = time.time()
+        for i in (1, 2, 3):
+            CustomUser.objects.create(id=i, email=f"p{i}@presence.io", phone_number=f"+24150000{i}")
+
+    def test_pools_and_moves(self):
+        p = self.worker_a
+        p.touch(1, "eco", "lbv", now=self.now - 10)
+        p.touch(2, "eco", "lbv", now=self.now - 100)
+        p.touch(3, "vip", "lbv", now=self.now)
+        self.assertEqual(p.online_in_pool("eco", "lbv"), [1])
+        self.assertEqual(sorted(p.online_in_pool("eco", "lbv", within_s=200)), [1, 2])
+        p.touch(1, "vip", "lbv", now=self.now)          # changement de pool
+        self.assertEqual(p.online_in_pool("eco", "lbv"), [])
+        self.assertEqual(sorted(p.online_in_pool("vip", "lbv")), [1, 3])
+        p.touch(3, now=self.now)                        # ping sans catégorie : pool conservé
+        self.assertEqual(sorted(p.online_in_pool("vip", "lbv")), [1, 3])
+
+    def test_shared_mirror_seen_by_other_worker(self):
+        self.worker_a.touch(1, "eco", "lbv")
+        self.assertEqual(self.worker_b.online_in_pool("eco", "lbv", include_remote=True), [])  # pas encore flushé
+        self.worker_a.flush()
+        self.assertEqual(self.worker_b.online_in_pool("eco", "lbv", include_remote=True), [1])
+        self.assertTrue(self.worker_b.is_online(1))
+        self.worker_a.touch(1, "vip", "lbv")
+        self.worker_a.flush()
+        self.assertEqual(self.worker_b.online_in_pool("eco", "lbv", include_remote=True), [])
+        self.assertEqual(self.worker_b.online_in_pool("vip", "lbv", include_remote=True), [1])
+
+    def test_expiry(self):
+        p = self.worker_a
+        p.touch(1, "eco", "lbv", now=self.now - 200)
+        p.touch(2, "eco", "lbv", now=self.now)
+        self.assertEqual(p.flush(now=self.now), 1)
+        self.assertFalse(p.is_online(1))
+        self.assertTrue(p.is_online(2))
+        self.assertEqual(self.worker_b.online_in_pool("eco", "lbv", include_remote=True), [2])
+        self.assertEqual(
+            dict(DriverPresence.objects.values_list("driver_id", "is_online")), {1: False, 2: True},
+        )
+
+    def test_go_offline_is_immediate(self):
+        self.worker_a.touch(1, "eco", "lbv")
+        self.worker_a.flush()
+        self.worker_a.go_offline(1)
+        self.assertFalse(self.worker_a.is_online(1))   # avant le flush : pas de repli sur DB / miroir
+        self.assertFalse(self.worker_b.is_online(1))   # miroir déjà nettoyé
+        self.worker_a.flush()
+        self.assertFalse(DriverPresence.objects.get(driver_id=1).is_online)
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "heartbeat-tests"}},
+    PRESENCE_TIMEOUT_S=90,
+)
+class PresenceHeartbeatTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch("RideVTC.presence.every")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.presence = PresenceService()
+        self.users = [
+            CustomUser.objects.create(email=f"hb{i}@presence.io", phone_number=f"+24160000{i}") for i in range(20)
+        ]
+        self.drivers = [
+            Driver.objects.create(user=u, full_name="x", phone="1", vehicle_plate="AB") for u in self.users[:2]
+        ]
+
+    def test_ping_does_no_cache_or_db_io(self):
+        with mock.patch("RideVTC.presence.cache") as c, CaptureQueriesContext(connection) as q, \
+                mock.patch("RideVTC.presence.PRESENCE", self.presence):
+            for _ in range(50):
+                async_to_sync(_presence_touch)(self.users[0].id, "eco", "lbv")
+        self.assertEqual(c.method_calls, [])
+        self.assertEqual(len(q), 0)
+        self.assertTrue(self.presence.is_online(self.users[0].id))
+
+    def test_flush_is_one_batched_upsert(self):
+        for _ in range(5):
+            for u in self.users:
+                self.presence.touch(u.id, "eco", "lbv")
+        with CaptureQueriesContext(connection) as q:
+            self.presence.flush()
+        writes = [x["sql"] for x in q if not x["sql"].startswith(("SAVEPOINT", "RELEASE"))]
+        # 1 upsert DriverPresence + 1 UPDATE Driver.is_online (transitions hors ligne → en ligne)
+        self.assertEqual(len(writes), 2, writes)
+        self.assertEqual(DriverPresence.objects.filter(is_online=True).count(), 20)
+        self.assertEqual(Driver.objects.filter(is_online=True).count(), 2)
+
+        # pings suivants : upsert seul, pas de transition à recopier
+        self.presence.touch(self.users[0].id)
+        with CaptureQueriesContext(connection) as q:
+            self.presence.flush()
+        self.assertEqual(len([x for x in q if "drivers_driver" in x["sql"]]), 0)
+        self.assertEqual(self.presence.flush(), 0)   # rien en attente : aucune écriture
+
+    def test_offline_transition_mirrored_to_driver(self):
+        d = self.users[0].id
+        self.presence.touch(d, "eco", "lbv")
+        self.presence.flush()
+        self.presence.go_offline(d)
+        self.presence.flush()
+        self.assertFalse(Driver.objects.get(user_id=d).is_online)
+        self.assertFalse(DriverPresence.objects.get(driver_id=d).is_online)
+
+    def test_failed_write_is_retried_at_next_flush(self):
+        d = self.users[0].id
+        self.presence.touch(d, "eco", "lbv")
+        with mock.patch.object(PresenceService, "_write_through", side_effect=RuntimeError("db down")):
+            with self.assertRaises(RuntimeError):
+                self.presence.flush()
+        self.assertFalse(DriverPresence.objects.exists())
+        self.presence.flush()
+        self.assertTrue(DriverPresence.objects.get(driver_id=d).is_online)
+        self.assertTrue(Driver.objects.get(user_id=d).is_online)
+
+
+@override_settings(DISPATCH_MODE="batch", DISPATCH_BATCH_COST="distance", DISPATCH_BATCH_MAX_ROUNDS=2,
+                   DISPATCH_WAVE_TTL_S=15)
+class BatchDispatchTests(DispatchTestBase):
+    def other_ride(self, dlat):
+        return _make_ride(status="pending", driver=False,
+                          pickup_lat=self.PICKUP[0] + dlat, pickup_lng=self.PICKUP[1])
+
+    def offers(self):
+        return sum(self.sent, [])
+
+    def expire_offers(self):
+        for st in dispatch._BATCH.values():
+            st.offered_at -= 60
+
+    def test_global_assignment_one_offer_per_driver(self):
+        # glouton : course 1 → a (0,55 km) puis course 2 → b (3,3 km) ; optimum : 1,1 + 1,7 km
+        ride2 = self.other_ride(0.02)
+        a = self.driver_at(0.005)
+        b = self.driver_at(-0.01)
+        self.assertEqual(self.offer(), [])
+        self.offer(ride2)
+        dispatch._run_batch()
+        self.assertEqual(sorted(self.offers()), sorted([f"driver.{a}", f"driver.{b}"]))
+        self.assertEqual(dispatch._BATCH[self.ride.id].offer_driver, b)
+        self.assertEqual(dispatch._BATCH[ride2.id].offer_driver, a)
+
+    def test_pending_offer_reserves_driver_then_rematch_excludes_it(self):
+        a = self.driver_at(0.003)
+        c = self.driver_at(0.02)
+        self.offer()
+        dispatch._run_batch()
+        self.assertEqual(self.offers(), [f"driver.{a}"])
+        dispatch._run_batch()                    # offre encore valable : ni nouvel envoi ni autre chauffeur
+        self.assertEqual(self.offers(), [f"driver.{a}"])
+
+        self.expire_offers()
+        dispatch._run_batch()                    # sans réponse → autre chauffeur, jamais a de nouveau
+        self.assertEqual(self.offers(), [f"driver.{a}", f"driver.{c}"])
+
+    def test_reserved_driver_not_offered_to_another_ride(self):
+        a = self.driver_at(0.003)
+        self.offer()
+        dispatch._run_batch()
+        ride2 = self.other_ride(0.001)
+        self.offer(ride2)
+        dispatch._run_batch()
+        self.assertEqual(self.offers(), [f"driver.{a}"])
+        self.assertEqual(dispatch._BATCH[ride2.id].rounds, 1)
+
+    def test_driver_on_active_ride_is_excluded(self):
+        busy = self.driver_at(0.001)
+        free = self.driver_at(0.01)
+        Ride.objects.filter(id=_make_ride(status="accepted").id).update(driver_id=busy)
+        self.offer()
+        dispatch._run_batch()
+        self.assertEqual(self.offers(), [f"driver.{free}"])
+
+    def test_unmatched_ride_falls_back_to_waves(self):
+        self.offer()
+        dispatch._run_batch()
+        dispatch._run_batch()
+        self.assertEqual(self.sent, [])
+        dispatch._run_batch()                    # DISPATCH_BATCH_MAX_ROUNDS atteint → vagues (→ pool, index vide)
+        self.assertEqual(self.offers(), ["pool.eco.lbv"])
+        self.assertNotIn(self.ride.id, dispatch._BATCH)
+
+    def test_taken_ride_leaves_the_batch(self):
+        self.driver_at(0.003)
+        self.offer()
+        Ride.objects.filter(id=self.ride.id).update(status="cancelled")
+        dispatch._run_batch()
+        self.assertEqual(self.sent, [])
+        self.assertNotIn(self.ride.id, dispatch._BATCH)
+
+
+class SingleFlightTests(SimpleTestCase):
+    def run_concurrently(self, fn, n=5):
+        """n appels concurrents sur la même clé ; le leader ne rend la main qu’une fois les n-1 autres en attente."""
+        flight = geocache.SingleFlight("test")
+        waiting = threading.Semaphore(0)
+        results, calls = [], []
+
+        def leader_fn():
+            calls.append(1)
+            for _ in range(n - 1):
+                self.assertTrue(waiting.acquire(timeout=5))
+            return fn()
+
+        def worker():
+            try:
+                results.append(flight.do("k", leader_fn))
+            except Exception as e:
+                results.append(e)
+
+        with mock.patch.object(geocache.metrics, "incr", side_effect=lambda name: waiting.release()):
+            threads = [threading.Thread(target=worker) for _ in range(n)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join(5)
+        return flight, results, calls
+
+    def test_concurrent_callers_share_one_call(self):
+        flight, results, calls = self.run_concurrently(lambda: {"address": "Akanda"})
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{"address": "Akanda"}] * 5)
+        self.assertIs(results[0], results[-1])
+        self.assertEqual(flight.do("k", lambda: "next"), "next")   # clé libérée après le vol
+
+    def test_error_is_raised_to_every_waiter(self):
+        def boom():
+            raise RuntimeError("upstream down")
+
+        flight, results, calls = self.run_concurrently(boom)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(isinstance(r, RuntimeError) for r in results))
+        self.assertEqual(flight.do("k", lambda: "retry"), "retry")
+
+    def test_distinct_keys_do_not_wait_on_each_other(self):
+        flight = geocache.SingleFlight("test")
+        self.assertEqual([flight.do(k, lambda k=k: k * 2) for k in (1, 2)], [2, 4])
@@ -0,0 +1,101 @@
+# RideVTC/utils/assignment.py
+"""
+Affectation courses ↔ chauffeurs à coût minimal (matching global).
+
+  - haversine_matrix : matrice de distances (km) vectorisée NumPy
+  - solve_assignment : algorithme hongrois (Kuhn-Munkres, potentiels + chemins
+    augmentants), boucle interne vectorisée sur les colonnes → O(n²·m)
+"""
+from __future__ import annotations
+
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+_EARTH_KM = 6371.0088
+
+# coût "interdit" (hors rayon) : fini pour éviter les NaN dans les potentiels
+UNREACHABLE = 1e9
+
+
+def haversine_matrix(
+    lat1: Sequence[float], lng1: Sequence[float],
+    lat2: Sequence[float], lng2: Sequence[float],
+):
+    """Distances (km) entre chaque point 1 (lignes) et chaque point 2 (colonnes)."""
+    p1 = np.radians(np.asarray(lat1, dtype=float))[:, None]
+    l1 = np.radians(np.asarray(lng1, dtype=float))[:, None]
+    p2 = np.radians(np.asarray(lat2, dtype=float))[None, :]
+    l2 = np.radians(np.asarray(lng2, dtype=float))[None, :]
+    a = np.sin((p2 - p1) / 2) ** 2 + np.cos(p1) * np.cos(p2) * np.sin((l2 - l1) / 2) ** 2
+    return 2 * _EARTH_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def pickup_cost_matrix(rides: Sequence[Tuple[float, float]], drivers: Sequence[Tuple[float, float]], max_km: float):
+    """Coût = distance pickup ↔ chauffeur (km) ; au-delà de max_km → UNREACHABLE."""
+    dist = haversine_matrix(
+        [r[0] for r in rides], [r[1] for r in rides],
+        [d[0] for d in drivers], [d[1] for d in drivers],
+    )
+    return np.where(dist <= max_km, dist, UNREACHABLE)
+
+
+def _hungarian(cost) -> List[Tuple[int, int]]:
+    """Cas n ≤ m. Retourne [(ligne, colonne)] couvrant toutes les lignes."""
+    n, m = cost.shape
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    p = np.zeros(m + 1, dtype=np.int64)    # p[j] = ligne (1-indexée) affectée à la colonne j
+    way = np.zeros(m + 1, dtype=np.int64)
+
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = ~used[1:]
+            cur = cost[i0 - 1] - u[i0] - v[1:]
+            better = free & (cur < minv[1:])
+            minv[1:][better] = cur[better]
+            way[1:][better] = j0
+
+            masked = np.where(free, minv[1:], np.inf)
+            j1 = int(np.argmin(masked)) + 1
+            delta = masked[j1 - 1]
+
+            used_cols = np.nonzero(used)[0]
+            u[p[used_cols]] += delta
+            v[used_cols] -= delta
+            minv[1:][free] -= delta
+
+            j0 = j1
+            if p[j0] == 0:
+                break
+        # remontée du chemin augmentant
+        while True:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+            if j0 == 0:
+                break
+
+    return [(int(p[j]) - 1, j - 1) for j in range(1, m + 1) if p[j] != 0]
+
+
+def solve_assignment(cost) -> List[Tuple[int, int]]:
+    """
+    Affectation de coût total minimal sur une matrice rectangulaire (lignes = courses,
+    colonnes = chauffeurs). Les paires à coût ≥ UNREACHABLE sont écartées.
+    """
+    cost = np.asarray(cost, dtype=float)
+    if cost.size == 0:
+        return []
+    n, m = cost.shape
+    if n <= m:
+        pairs = _hungarian(cost)
+    else:
+        pairs = [(i, j) for j, i in _hungarian(cost.T)]
+    return sorted((i, j) for i, j in pairs if cost[i, j] < UNREACHABLE)
@@ -0,0 +1,31 @@
+# RideVTC/utils/claims.py
+"""
+Arbitrage "premier qui accepte gagne" sans verrou DB.
+
+cache.add() est un SET NX atomique (Redis) : un seul chauffeur obtient
+ride:<id>:claim, les autres sont rejetés sans toucher la base. Seul le
+gagnant exécute ensuite la transaction (select_for_update non contesté).
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+
+def _claim_key(ride_id) -> str:
+    return f"ride:{int(ride_id)}:claim"
+
+
+def claim_ride(ride_id, driver_id) -> bool:
+    """True si ce chauffeur détient le claim (nouveau, ou retry du même chauffeur)."""
+    key = _claim_key(ride_id)
+    driver_id = int(driver_id)
+    ttl = int(getattr(settings, "RIDE_CLAIM_TTL_S", 120))
+    if cache.add(key, driver_id, timeout=ttl):
+        return True
+    return cache.get(key) == driver_id
+
+
+def release_ride_claim(ride_id, driver_id) -> None:
+    """Libère le claim si la transaction du gagnant a échoué."""
+    key = _claim_key(ride_id)
+    if cache.get(key) == int(driver_id):
+        cache.delete(key)
@@ -0,0 +1,123 @@
+# RideVTC/utils/eventbus.py
+"""
+Bus d’événements temps réel (channel layer → sockets).
+
+Un événement = (event, payload, audiences[, compat]) :
+  - les groupes sont dédupliqués (user_room(id) == "user.<id>" : un seul envoi) ;
+    dans un lot, seuls les doublons exacts (groupe + message identiques) sont retirés ;
+  - un seul message channel layer par groupe : {"type": "bus.event", event, payload, compat?} ;
+  - chaque consumer choisit le rendu selon le protocole négocié à la connexion
+    (?proto=… , défaut WS_PROTOCOL_DEFAULT) :
+        v1 → frame générique {event, payload} + frame "format direct" si compat fourni
+             (rendue par le handler historique du consumer, ex. ride_arrived) ;
+        v2 → frame générique uniquement ;
+  - un lot de messages part en un seul aller-retour async (asyncio.gather),
+    au lieu d’un async_to_sync(group_send) par envoi ;
+  - groupes driver.<id> : channel_layer.send direct vers la socket enregistrée
+    (utils.sockets, une seule lecture cache pour le lot) au lieu d’un group_send
+    (DRIVER_SOCKET_DIRECT_SEND).
+
+  messages(event, payload, audiences, compat=None) → [(groupe, message)]
+  send(channel_layer, messages)   /  asend(...)     → envoi d’un lot (→ groupes en échec)
+  publish(channel_layer, event, payload, audiences, compat=None) / apublish(...)
+"""
+import asyncio
+import json
+import logging
+from typing import Iterable, List, Optional, Tuple
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+
+from blaze_backend import metrics
+from . import sockets
+
+logger = logging.getLogger("rides")
+
+BUS_TYPE = "bus.event"
+BATCH_TYPE = "bus.batch"   # {"type": "bus.batch", "events": [bus.event, ...]} (relais outbox)
+PROTOCOL_LEGACY = 1
+PROTOCOL_CURRENT = 2
+
+Message = Tuple[str, dict]
+
+
+def messages(
+    event: str, payload: dict, audiences: Iterable[Optional[str]], compat: Optional[dict] = None,
+) -> List[Message]:
+    """
+    `compat` : message "format direct" historique ({"type": "ride.arrived", ...}),
+    rendu seulement pour les sockets en protocole v1.
+    """
+    msg = {"type": BUS_TYPE, "event": event, "payload": payload}
+    if compat:
+        msg["compat"] = compat
+    return [(g, msg) for g in dict.fromkeys(a for a in audiences if a)]
+
+
+def dedupe(batch: Iterable[Message]) -> List[Message]:
+    """Retire les doublons exacts (même groupe, même message) ; deux messages distincts du même type restent."""
+    seen, out = set(), []
+    for group, msg in batch:
+        key = (group, json.dumps(msg, sort_keys=True, separators=(",", ":"), default=str))
+        if key in seen:
+            continue
+        seen.add(key)
+        out.append((group, msg))
+    return out
+
+
+async def asend(channel_layer, batch: Iterable[Message]) -> List[str]:
+    batch = dedupe(batch)
+    if not batch or channel_layer is None:
+        return []
+    channels = {}
+    if getattr(settings, "DRIVER_SOCKET_DIRECT_SEND", True):
+        drivers = {g: sockets.driver_id_of(g) for g, _ in batch}
+        try:
+            live = await sockets.alive_channels({d for d in drivers.values() if d is not None})
+        except Exception as e:
+            logger.warning("[BUS] socket registry lookup failed: %s", e)
+            live = {}
+        channels = {g: live[d] for g, d in drivers.items() if d in live}
+    results = await asyncio.gather(
+        *(
+            channel_layer.send(channels[group], msg) if group in channels else channel_layer.group_send(group, msg)
+            for group, msg in batch
+        ),
+        return_exceptions=True,
+    )
+    metrics.incr("eventbus.direct_send", len(channels))
+    metrics.incr("eventbus.group_send", len(batch) - len(channels))
+    failed = []
+    for (group, msg), res in zip(batch, results):
+        if isinstance(res, Exception):
+            metrics.incr("eventbus.errors")
+            logger.error("[BUS] group_send %s → %s failed: %s", msg.get("event") or msg.get("type"), group, res)
+            failed.append(group)
+    return failed
+
+
+def send(channel_layer, batch: Iterable[Message]) -> List[str]:
+    """Version sync (vues DRF) : tout le lot en un seul async_to_sync."""
+    batch = list(batch)
+    if not batch or channel_layer is None:
+        return []
+    return async_to_sync(asend)(channel_layer, batch)
+
+
+async def apublish(channel_layer, event: str, payload: dict, audiences, compat: Optional[dict] = None) -> None:
+    await asend(channel_layer, messages(event, payload, audiences, compat))
+
+
+def publish(channel_layer, event: str, payload: dict, audiences, compat: Optional[dict] = None) -> None:
+    send(channel_layer, messages(event, payload, audiences, compat))
+
+
+def negotiate_protocol(query: dict, default: int) -> int:
+    """`query` = parse_qs(query_string) ; ?proto=2 (ou v2) → 2, sinon le défaut."""
+    raw = (query.get("proto", [""])[0] or "").strip().lower().lstrip("v")
+    try:
+        return max(PROTOCOL_LEGACY, min(PROTOCOL_CURRENT, int(raw)))
+    except ValueError:
+        return default
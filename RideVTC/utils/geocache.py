@@ -0,0 +1,139 @@
+# RideVTC/utils/geocache.py
+"""
+Cache de géocodage à deux niveaux :
+  - L1 : LRU en mémoire (par process), taille bornée (GEOCODE_L1_MAX) ;
+  - L2 : cache Django (Redis en prod), partagé par tous les workers ASGI.
+
+Les résultats négatifs (aucune adresse trouvée) sont aussi mis en cache, avec
+un TTL plus court (GEOCODE_NEGATIVE_TTL_S). Compteurs : geocache.<nom>.{l1_hit,l2_hit,miss}.
+
+SingleFlight : sur un miss, les appels concurrents pour la même clé (rafale de
+courses depuis l’aéroport…) attendent l’unique requête en vol au lieu de
+déclencher chacun leur appel Google/Nominatim.
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from blaze_backend import metrics
+
+logger = logging.getLogger("rides")
+
+MISS = object()
+
+
+def _ttl_s() -> int:
+    return int(getattr(settings, "GEOCODE_CACHE_TTL_S", 86400))
+
+def _negative_ttl_s() -> int:
+    return int(getattr(settings, "GEOCODE_NEGATIVE_TTL_S", 300))
+
+def _l1_max() -> int:
+    return int(getattr(settings, "GEOCODE_L1_MAX", 2048))
+
+def snap_decimals() -> int:
+    return int(getattr(settings, "GEOCODE_SNAP_DECIMALS", 4))  # 4 → ~11 m
+
+
+class GeoCache:
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._l1: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+    def _l2_key(self, key: Hashable) -> str:
+        digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        return f"geocache:{self.name}:{digest}"
+
+    def _l1_put(self, key: Hashable, exp: float, value: Any) -> None:
+        with self._lock:
+            self._l1[key] = (exp, value)
+            self._l1.move_to_end(key)
+            while len(self._l1) > _l1_max():
+                self._l1.popitem(last=False)
+
+    def get(self, key: Hashable) -> Any:
+        """Valeur en cache (None possible = résultat négatif), ou MISS."""
+        now = time.time()
+        with self._lock:
+            rec = self._l1.get(key)
+            if rec is not None:
+                if rec[0] > now:
+                    self._l1.move_to_end(key)
+                    metrics.incr(f"geocache.{self.name}.l1_hit")
+                    return rec[1]
+                self._l1.pop(key, None)
+
+        try:
+            rec = cache.get(self._l2_key(key))
+        except Exception as e:
+            logger.warning("[GEOCACHE] L2 read failed: %s", e)
+            rec = None
+        if rec is not None:
+            exp, value = rec
+            self._l1_put(key, exp, value)
+            metrics.incr(f"geocache.{self.name}.l2_hit")
+            return value
+
+        metrics.incr(f"geocache.{self.name}.miss")
+        return MISS
+
+    def set(self, key: Hashable, value: Any) -> None:
+        ttl = _ttl_s() if value is not None else _negative_ttl_s()
+        exp = time.time() + ttl
+        self._l1_put(key, exp, value)
+        try:
+            cache.set(self._l2_key(key), (exp, value), timeout=ttl)
+        except Exception as e:
+            logger.warning("[GEOCACHE] L2 write failed: %s", e)
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Un seul appel en vol par clé (par process) ; les suivants partagent son résultat."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            metrics.incr(f"singleflight.{self.name}.shared")
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
@@ -0,0 +1,404 @@
+# RideVTC/utils/geoindex.py
+"""
+Index spatial des chauffeurs en ligne (grille lat/lng fixe).
+
+Deux niveaux :
+  - un index en mémoire (par process), interrogé en premier ;
+  - un miroir dans le cache Django (Redis en prod) partagé par tous les workers ASGI.
+
+Une requête "K plus proches" parcourt les cellules en anneaux autour du point
+de prise en charge : le coût dépend du nombre de cellules visitées, pas du
+nombre total de chauffeurs connectés.
+
+Seuls les chauffeurs disponibles sont indexés : à l’acceptation d’une course le
+chauffeur est retiré et marqué occupé (mark_busy) — ses pings ne le réindexent
+plus — jusqu’à la fin ou l’annulation de la course (mark_free).
+"""
+from __future__ import annotations
+
+import logging
+import math
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from ..presence import PRESENCE
+
+logger = logging.getLogger("rides")
+
+_EARTH_KM = 6371.0088
+_KM_PER_DEG = 111.195
+
+
+def _cell_deg() -> float:
+    return float(getattr(settings, "GEOINDEX_CELL_DEG", 0.01))  # ~1,1 km
+
+def _ttl_s() -> int:
+    return int(getattr(settings, "GEOINDEX_TTL_S", 120))
+
+def _default_k() -> int:
+    return int(getattr(settings, "DISPATCH_NEAREST_K", 8))
+
+def _default_radius_km() -> float:
+    return float(getattr(settings, "DISPATCH_RADIUS_KM", 5.0))
+
+def _busy_ttl_s() -> int:
+    return int(getattr(settings, "GEOINDEX_BUSY_TTL_S", 4 * 3600))
+
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lng2 - lng1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * _EARTH_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+@dataclass
+class DriverPos:
+    driver_id: int          # ⚠️ user.id (comme driver_room)
+    lat: float
+    lng: float
+    category: str
+    area: str
+    ts: float
+
+    def as_tuple(self) -> tuple:
+        return (self.lat, self.lng, self.area, self.ts)
+
+
+CellKey = Tuple[str, int, int]  # (category, i, j)
+
+
+class GridIndex:
+    """Index en mémoire : cellule → ids chauffeurs, id → dernière position."""
+
+    def __init__(self, cell_deg: float):
+        self.cell_deg = cell_deg
+        self._lock = threading.RLock()
+        self._cells: Dict[CellKey, Set[int]] = {}
+        self._drivers: Dict[int, DriverPos] = {}
+
+    def cell_of(self, lat: float, lng: float) -> Tuple[int, int]:
+        return (math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg))
+
+    def get(self, driver_id: int) -> Optional[DriverPos]:
+        with self._lock:
+            return self._drivers.get(driver_id)
+
+    def upsert(self, pos: DriverPos) -> Tuple[Optional[CellKey], CellKey]:
+        """Insère/déplace un chauffeur. Retourne (ancienne cellule, nouvelle cellule)."""
+        new_key: CellKey = (pos.category, *self.cell_of(pos.lat, pos.lng))
+        with self._lock:
+            old = self._drivers.get(pos.driver_id)
+            old_key = None
+            if old is not None:
+                old_key = (old.category, *self.cell_of(old.lat, old.lng))
+                if old_key != new_key:
+                    self._discard(old_key, pos.driver_id)
+            self._cells.setdefault(new_key, set()).add(pos.driver_id)
+            self._drivers[pos.driver_id] = pos
+        return old_key, new_key
+
+    def remove(self, driver_id: int) -> Optional[CellKey]:
+        with self._lock:
+            old = self._drivers.pop(driver_id, None)
+            if old is None:
+                return None
+            key = (old.category, *self.cell_of(old.lat, old.lng))
+            self._discard(key, driver_id)
+            return key
+
+    def _discard(self, key: CellKey, driver_id: int) -> None:
+        members = self._cells.get(key)
+        if members is not None:
+            members.discard(driver_id)
+            if not members:
+                self._cells.pop(key, None)
+
+    def cell_members(self, key: CellKey) -> List[DriverPos]:
+        with self._lock:
+            ids = self._cells.get(key) or ()
+            return [self._drivers[d] for d in ids if d in self._drivers]
+
+
+_INDEX = GridIndex(_cell_deg())
+
+
+# ─────────────────────────────────────────────────────────────
+# Miroir partagé (cache Django)
+#   geoidx:cell:<cat>:<i>:<j> → {driver_id: (lat, lng, area, ts)}
+#   geoidx:drv:<driver_id>    → (cat, i, j)
+# NB: lecture-modification-écriture non atomique ; une écriture perdue est
+#     réparée au ping suivant (les entrées sont rafraîchies en continu).
+# ─────────────────────────────────────────────────────────────
+def _cell_cache_key(key: CellKey) -> str:
+    cat, i, j = key
+    return f"geoidx:cell:{cat}:{i}:{j}"
+
+def _drv_cache_key(driver_id: int) -> str:
+    return f"geoidx:drv:{int(driver_id)}"
+
+def _busy_cache_key(driver_id: int) -> str:
+    return f"geoidx:busy:{int(driver_id)}"
+
+def _shared_put(pos: DriverPos, old_key: Optional[CellKey], new_key: CellKey) -> None:
+    ttl = _ttl_s()
+    try:
+        prev_key = old_key
+        if prev_key is None:
+            prev = cache.get(_drv_cache_key(pos.driver_id))
+            prev_key = tuple(prev) if prev else None
+        if prev_key and prev_key != new_key:
+            _shared_discard(prev_key, pos.driver_id)
+        ck = _cell_cache_key(new_key)
+        members = cache.get(ck) or {}
+        members[pos.driver_id] = pos.as_tuple()
+        cache.set(ck, members, timeout=ttl)
+        cache.set(_drv_cache_key(pos.driver_id), new_key, timeout=ttl)
+    except Exception as e:
+        logger.warning("[GEOIDX] shared put failed driver#%s: %s", pos.driver_id, e)
+
+def _shared_discard(key: CellKey, driver_id: int) -> None:
+    ck = _cell_cache_key(key)
+    members = cache.get(ck) or {}
+    if members.pop(driver_id, None) is not None:
+        if members:
+            cache.set(ck, members, timeout=_ttl_s())
+        else:
+            cache.delete(ck)
+
+def _shared_remove(driver_id: int, key: Optional[CellKey]) -> None:
+    try:
+        if key is None:
+            prev = cache.get(_drv_cache_key(driver_id))
+            key = tuple(prev) if prev else None
+        if key:
+            _shared_discard(key, driver_id)
+        cache.delete(_drv_cache_key(driver_id))
+    except Exception as e:
+        logger.warning("[GEOIDX] shared remove failed driver#%s: %s", driver_id, e)
+
+def _shared_cells(keys: List[CellKey]) -> Optional[Dict[int, DriverPos]]:
+    """Membres partagés des cellules ; None si le cache est injoignable (repli sur l’index local)."""
+    out: Dict[int, DriverPos] = {}
+    if not keys:
+        return out
+    try:
+        found = cache.get_many([_cell_cache_key(k) for k in keys])
+    except Exception as e:
+        logger.warning("[GEOIDX] shared read failed: %s", e)
+        return None
+    for k in keys:
+        members = found.get(_cell_cache_key(k)) or {}
+        for did, (lat, lng, area, ts) in members.items():
+            out[int(did)] = DriverPos(int(did), lat, lng, k[0], area, ts)
+    return out
+
+
+# ─────────────────────────────────────────────────────────────
+# API publique
+# ─────────────────────────────────────────────────────────────
+def update_driver_location(
+    driver_id: int,
+    lat: Optional[float],
+    lng: Optional[float],
+    category: Optional[str] = None,
+    area: Optional[str] = None,
+) -> None:
+    """
+    Enregistre la dernière position connue d’un chauffeur en ligne.
+    Si category/area sont absents, on garde ceux déjà indexés (ex: action `location`).
+    Sans effet pour un chauffeur occupé (course en cours, cf. mark_busy).
+    """
+    if lat is None or lng is None:
+        return
+    try:
+        driver_id = int(driver_id)
+        lat, lng = float(lat), float(lng)
+    except (TypeError, ValueError):
+        return
+    if is_busy(driver_id):
+        return
+
+    prev = _INDEX.get(driver_id)
+    if category is None:
+        if prev is None:
+            shared = cache.get(_drv_cache_key(driver_id))
+            if not shared:
+                # chauffeur jamais déclaré en ligne → on ne l’indexe pas
+                return
+            category = shared[0]
+        else:
+            category = prev.category
+    if area is None:
+        area = prev.area if prev else "city-default"
+
+    pos = DriverPos(driver_id, lat, lng, (category or "eco").lower(), area, time.time())
+    old_key, new_key = _INDEX.upsert(pos)
+    _shared_put(pos, old_key, new_key)
+
+
+def remove_driver(driver_id: int) -> None:
+    """Retire un chauffeur de l’index (hors-ligne / socket fermée)."""
+    try:
+        driver_id = int(driver_id)
+    except (TypeError, ValueError):
+        return
+    key = _INDEX.remove(driver_id)
+    _shared_remove(driver_id, key)
+
+
+def is_busy(driver_id: int) -> bool:
+    try:
+        return cache.get(_busy_cache_key(driver_id)) is not None
+    except Exception:
+        return False
+
+
+def busy_among(driver_ids: Iterable[int]) -> Set[int]:
+    """Sous-ensemble des chauffeurs marqués occupés (un seul get_many)."""
+    ids = {int(d) for d in driver_ids}
+    if not ids:
+        return set()
+    try:
+        found = cache.get_many([_busy_cache_key(d) for d in ids])
+    except Exception as e:
+        logger.warning("[GEOIDX] busy read failed: %s", e)
+        return set()
+    return {d for d in ids if _busy_cache_key(d) in found}
+
+
+def mark_busy(driver_id: int) -> None:
+    """Course acceptée : le chauffeur sort de l’index et n’y revient pas avant mark_free."""
+    try:
+        driver_id = int(driver_id)
+    except (TypeError, ValueError):
+        return
+    pos = _INDEX.get(driver_id)
+    if pos is not None:
+        pool = (pos.category, pos.area)
+    else:
+        shared = cache.get(_drv_cache_key(driver_id))
+        pool = (shared[0], "city-default") if shared else ("eco", "city-default")
+    try:
+        # catégorie / zone gardées pour la réindexation à la fin de la course
+        cache.set(_busy_cache_key(driver_id), pool, timeout=_busy_ttl_s())
+    except Exception as e:
+        logger.warning("[GEOIDX] mark busy failed driver#%s: %s", driver_id, e)
+    remove_driver(driver_id)
+
+
+def mark_free(driver_id: Optional[int], lat: Optional[float] = None, lng: Optional[float] = None) -> None:
+    """
+    Course terminée / annulée : le chauffeur redevient disponible. S’il est encore
+    en ligne et qu’une position est connue, il est réindexé tout de suite ; sinon
+    au prochain ping avec position.
+    """
+    if not driver_id:
+        return
+    driver_id = int(driver_id)
+    try:
+        pool = cache.get(_busy_cache_key(driver_id))
+        cache.delete(_busy_cache_key(driver_id))
+    except Exception as e:
+        logger.warning("[GEOIDX] mark free failed driver#%s: %s", driver_id, e)
+        return
+    if pool and lat is not None and lng is not None:
+        if PRESENCE.is_online(driver_id):
+            update_driver_location(driver_id, lat, lng, category=pool[0], area=pool[1])
+
+
+def _ring(ci: int, cj: int, r: int) -> Iterable[Tuple[int, int]]:
+    if r == 0:
+        yield (ci, cj)
+        return
+    for dj in range(-r, r + 1):
+        yield (ci - r, cj + dj)
+        yield (ci + r, cj + dj)
+    for di in range(-r + 1, r):
+        yield (ci + di, cj - r)
+        yield (ci + di, cj + r)
+
+
+def drivers_within(
+    lat: Optional[float],
+    lng: Optional[float],
+    category: str,
+    k: Optional[int] = None,
+    radius_km: Optional[float] = None,
+    exclude: Iterable[int] = (),
+) -> List[Tuple[DriverPos, float]]:
+    """
+    Retourne jusqu’à K chauffeurs [(position, distance_km)] triés par distance,
+    dans un rayon donné. Parcours en anneaux de cellules : O(cellules visitées).
+
+    Le miroir partagé fait foi : un chauffeur présent dans l’index local mais absent
+    de la cellule partagée a été retiré par un autre worker (occupé / hors ligne) et
+    n’est pas proposé. Les marqueurs "occupé" sont revérifiés sur le résultat final.
+    """
+    if lat is None or lng is None:
+        return []
+    k = k or _default_k()
+    radius_km = radius_km if radius_km is not None else _default_radius_km()
+    category = (category or "eco").lower()
+    excluded = {int(x) for x in exclude}
+    stale_before = time.time() - _ttl_s()
+
+    ci, cj = _INDEX.cell_of(lat, lng)
+    # plus petite dimension d’une cellule (en km) à cette latitude
+    cell_km = _INDEX.cell_deg * _KM_PER_DEG * max(0.05, math.cos(math.radians(lat)))
+    max_rings = int(math.ceil(radius_km / cell_km)) + 1
+
+    found: Dict[int, Tuple[DriverPos, float]] = {}
+    for r in range(0, max_rings + 1):
+        keys = [(category, i, j) for (i, j) in _ring(ci, cj, r)]
+        candidates = _shared_cells(keys)
+        shared_ok = candidates is not None
+        if not shared_ok:
+            candidates = {}
+        for key in keys:
+            for pos in _INDEX.cell_members(key):
+                cur = candidates.get(pos.driver_id)
+                if cur is None:
+                    if shared_ok:
+                        # retiré (ou déplacé) par un autre worker : l’entrée locale est périmée
+                        _INDEX.remove(pos.driver_id)
+                        continue
+                    candidates[pos.driver_id] = pos
+                elif pos.ts >= cur.ts:
+                    candidates[pos.driver_id] = pos
+        for did, pos in candidates.items():
+            if did in excluded or pos.ts < stale_before:
+                continue
+            d = haversine_km(lat, lng, pos.lat, pos.lng)
+            if d <= radius_km:
+                found[did] = (pos, d)
+        # tout chauffeur non encore vu est à ≥ r * cell_km
+        if len(found) >= k:
+            kth = sorted(d for _, d in found.values())[k - 1]
+            if kth <= r * cell_km:
+                break
+
+    for did in busy_among(found):
+        del found[did]
+    return sorted(found.values(), key=lambda x: x[1])[:k]
+
+
+def nearest_drivers(
+    lat: Optional[float],
+    lng: Optional[float],
+    category: str,
+    k: Optional[int] = None,
+    radius_km: Optional[float] = None,
+    exclude: Iterable[int] = (),
+) -> List[Tuple[int, float]]:
+    """Comme drivers_within, mais ne retourne que [(driver_id, distance_km)]."""
+    return [
+        (pos.driver_id, d)
+        for pos, d in drivers_within(lat, lng, category, k=k, radius_km=radius_km, exclude=exclude)
+    ]
@@ -0,0 +1,186 @@
+# RideVTC/utils/locations.py
+"""
+Position du chauffeur pendant une course → client (ride.driver.location).
+
+Logique partagée entre l’endpoint REST POST /api/rides/<id>/location/ et le
+message WS `driver.location` du DriverConsumer (identité authentifiée par le
+JWT à la connexion). Le chauffeur doit être celui de la course : sinon le fix
+est rejeté avant toute écriture (index spatial, trace, buffer, relais).
+
+Filtre de relais (par course × chauffeur, en mémoire) : un fix n’est relayé au
+client que s’il arrive ≥ LOCATION_RELAY_MIN_INTERVAL_MS après le dernier relayé
+ET s’il a bougé ≥ LOCATION_RELAY_MIN_DISTANCE_M ou tourné ≥ LOCATION_RELAY_MIN_HEADING_DEG.
+Un fix est toujours relayé après LOCATION_RELAY_MAX_SILENCE_MS sans relais.
+La position est enregistrée (buffer) même quand le relais est supprimé ; une
+fois la course démarrée (in_progress), chaque fix reçu (y compris ceux d’un lot
+WS) est ajouté à la trace — l’approche vers le pickup n’entre pas dans la mesure.
+"""
+import logging
+import math
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+from blaze_backend import metrics
+
+from ..models import Ride
+from .geoindex import haversine_km
+from .locbuffer import buffer_location
+from . import eventbus
+from .rooms import user_room
+from .trace import append_fix, plausible_ts_ms
+
+logger = logging.getLogger("rides")
+
+ENDED_STATUSES = {"cancelled", "completed", "finished"}
+
+
+class LocationRejected(Exception):
+    """reason ∈ {"not_found", "forbidden", "ride_ended"} ; status = statut de la course si connu."""
+
+    def __init__(self, reason: str, status: Optional[str] = None):
+        super().__init__(reason)
+        self.reason = reason
+        self.status = status
+
+
+def parse_fixes(content: dict) -> List[dict]:
+    """
+    Normalise un message WS : {"lat", "lng", ...} ou {"fixes": [{"lat", "lng", "ts"?, ...}, ...]}.
+    Les points invalides sont ignorés ; l’ordre d’envoi est conservé.
+    """
+    raw = content.get("fixes")
+    if not isinstance(raw, list):
+        raw = [content]
+    fixes = []
+    for f in raw:
+        if not isinstance(f, dict):
+            continue
+        try:
+            lat, lng = float(f["lat"]), float(f["lng"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if -90 <= lat <= 90 and -180 <= lng <= 180:
+            fixes.append({**f, "lat": lat, "lng": lng})
+    return fixes
+
+
+def _fix_ts_ms(fix: dict) -> Optional[int]:
+    """
+    Horodatage client d’un fix ("ts" en ms ou en s depuis l’epoch) ; None si absent,
+    non numérique, non fini (inf/nan) ou hors de la fenêtre plausible (heure serveur alors).
+    """
+    try:
+        ts = float(fix["ts"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not math.isfinite(ts) or ts <= 0:
+        return None
+    ts_ms = int(ts if ts > 1e11 else ts * 1000)
+    return ts_ms if plausible_ts_ms(ts_ms) else None
+
+
+def _bearing_deg(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dl = math.radians(lng2 - lng1)
+    x = math.sin(dl) * math.cos(p2)
+    y = math.cos(p1) * math.sin(p2) - math.sin(p1) * math.cos(p2) * math.cos(dl)
+    return (math.degrees(math.atan2(x, y)) + 360.0) % 360.0
+
+
+class RelayFilter:
+    """Dernier fix relayé par (course, chauffeur) → décide si un nouveau fix mérite un envoi."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last: Dict[Tuple[int, int], Tuple[float, float, float, Optional[float]]] = {}
+
+    def should_relay(
+        self, ride_id: int, driver_id: int, lat: float, lng: float,
+        heading: Optional[float] = None, now: Optional[float] = None,
+    ) -> bool:
+        now = time.time() if now is None else now
+        min_interval = float(getattr(settings, "LOCATION_RELAY_MIN_INTERVAL_MS", 1000)) / 1000.0
+        max_silence = float(getattr(settings, "LOCATION_RELAY_MAX_SILENCE_MS", 10000)) / 1000.0
+        min_dist_m = float(getattr(settings, "LOCATION_RELAY_MIN_DISTANCE_M", 5.0))
+        min_turn = float(getattr(settings, "LOCATION_RELAY_MIN_HEADING_DEG", 15.0))
+
+        key = (int(ride_id), int(driver_id))
+        with self._lock:
+            prev = self._last.get(key)
+            if prev is not None:
+                plat, plng, pts, pheading = prev
+                elapsed = now - pts
+                if elapsed < min_interval:
+                    metrics.incr("locfilter.suppressed.interval")
+                    return False
+                if elapsed < max_silence:
+                    moved_m = haversine_km(plat, plng, lat, lng) * 1000.0
+                    if heading is None and moved_m > 0:
+                        heading = _bearing_deg(plat, plng, lat, lng)
+                    turned = (
+                        abs((heading - pheading + 180.0) % 360.0 - 180.0)
+                        if heading is not None and pheading is not None else 0.0
+                    )
+                    if moved_m < min_dist_m and turned < min_turn:
+                        metrics.incr("locfilter.suppressed.distance_heading")
+                        return False
+            self._last[key] = (lat, lng, now, heading)
+            if len(self._last) > 1000:
+                # courses abandonnées sans fin explicite : on purge les états > 1 h
+                for k in [k for k, v in self._last.items() if now - v[2] > 3600]:
+                    del self._last[k]
+        metrics.incr("locfilter.relayed")
+        return True
+
+    def forget_ride(self, ride_id: int) -> None:
+        with self._lock:
+            for key in [k for k in self._last if k[0] == int(ride_id)]:
+                del self._last[key]
+
+
+RELAY_FILTER = RelayFilter()
+
+
+def publish_driver_location(
+    ride_id: int, driver_id: int, lat: float, lng: float, heading: Optional[float] = None,
+    fixes: Optional[List[dict]] = None,
+) -> List[Tuple[str, dict]]:
+    """
+    `fixes` : lot complet (parse_fixes) dont (lat, lng) est le dernier point — tous
+    vont dans la trace si la course est en cours ; par défaut la trace ne reçoit que (lat, lng).
+    Enregistre la position du chauffeur sur la course et retourne les messages
+    (groupe, message) à diffuser au client — liste vide si le filtre de relais
+    juge le fix redondant. Lève LocationRejected sinon.
+    Sync (ORM) : à appeler via database_sync_to_async depuis un consumer.
+    """
+    row = Ride.objects.filter(id=ride_id).values_list("user_id", "driver_id", "status").first()
+    if row is None:
+        raise LocationRejected("not_found")
+    user_id, ride_driver_id, ride_status = row
+    if ride_driver_id is None or int(ride_driver_id) != int(driver_id):
+        raise LocationRejected("forbidden", ride_status)
+    if ride_status in ENDED_STATUSES:
+        logger.info("[LOC] reject location ride_id=%s status=%s", ride_id, ride_status)
+        RELAY_FILTER.forget_ride(ride_id)
+        raise LocationRejected("ride_ended", ride_status)
+
+    if ride_status == "in_progress":
+        for f in fixes or [{"lat": lat, "lng": lng}]:
+            append_fix(ride_id, f["lat"], f["lng"], _fix_ts_ms(f))
+    buffer_location(ride_id, lat, lng)  # write-behind : pas d’UPDATE par fix
+    # pas d’update_driver_location : un chauffeur en course n’est pas dans l’index de dispatch
+
+    if not RELAY_FILTER.should_relay(ride_id, driver_id, lat, lng, heading):
+        return []
+
+    payload = {
+        "type": "ride.driver.location",
+        "requestId": ride_id,
+        "lat": lat,
+        "lng": lng,
+        "leg": "to_pickup" if ride_status == "accepted" else "to_dropoff",
+    }
+    return eventbus.messages("ride.driver.location", payload, [user_room(user_id)])
@@ -0,0 +1,91 @@
+# RideVTC/utils/locbuffer.py
+"""
+Buffer "write-behind" des positions chauffeur pendant une course.
+
+  - chaque fix → cache Django (ride:<id>:drvloc, partagé entre workers : lecture
+    la plus fraîche) + table "dirty" locale au process ;
+  - un flusher périodique (LOCATION_FLUSH_INTERVAL_S) persiste les dernières
+    positions en un seul bulk_update sur RideVTC_ride ;
+  - flush_ride(id) force l’écriture lors des transitions (arrivé, début, fin, annulation).
+
+Au lieu d’un UPDATE par fix GPS : au plus un UPDATE groupé toutes les quelques secondes.
+"""
+import logging
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from blaze_backend import metrics
+from blaze_backend.background import every
+from ..models import Ride
+
+logger = logging.getLogger("rides")
+
+_LOCK = threading.Lock()
+_DIRTY: Dict[int, Tuple[float, float, float]] = {}   # ride_id → (lat, lng, ts)
+
+
+def _flush_interval_s() -> float:
+    return float(getattr(settings, "LOCATION_FLUSH_INTERVAL_S", 5.0))
+
+def _ttl_s() -> int:
+    return int(getattr(settings, "LOCATION_BUFFER_TTL_S", 600))
+
+def _key(ride_id: int) -> str:
+    return f"ride:{int(ride_id)}:drvloc"
+
+
+def buffer_location(ride_id: int, lat: float, lng: float) -> None:
+    rec = (float(lat), float(lng), time.time())
+    with _LOCK:
+        _DIRTY[int(ride_id)] = rec
+    try:
+        cache.set(_key(ride_id), rec, timeout=_ttl_s())
+    except Exception as e:
+        logger.warning("[LOCBUF] cache write failed ride_id=%s: %s", ride_id, e)
+    every("location-flush", _flush_interval_s(), flush_locations)
+
+
+def latest_location(ride_id: int) -> Optional[Tuple[float, float, float]]:
+    """(lat, lng, ts) le plus récent connu (tous workers confondus), ou None."""
+    try:
+        rec = cache.get(_key(ride_id))
+    except Exception:
+        rec = None
+    if rec is None:
+        with _LOCK:
+            rec = _DIRTY.get(int(ride_id))
+    return rec
+
+
+def flush_locations() -> int:
+    """Persiste toutes les positions en attente (un seul bulk_update)."""
+    with _LOCK:
+        if not _DIRTY:
+            return 0
+        pending = dict(_DIRTY)
+        _DIRTY.clear()
+    rows = [Ride(id=rid, driver_lat=lat, driver_lng=lng) for rid, (lat, lng, _) in pending.items()]
+    try:
+        Ride.objects.bulk_update(rows, ["driver_lat", "driver_lng"], batch_size=500)
+    except Exception:
+        # on remet en attente ce qui n’a pas été écrit (sans écraser un fix plus récent)
+        with _LOCK:
+            for rid, rec in pending.items():
+                _DIRTY.setdefault(rid, rec)
+        raise
+    metrics.incr("locbuffer.flushed_rows", len(rows))
+    return len(rows)
+
+
+def flush_ride(ride_id: int) -> Optional[Tuple[float, float, float]]:
+    """Écrit tout de suite la dernière position d’une course (transition d’état)."""
+    with _LOCK:
+        local = _DIRTY.pop(int(ride_id), None)
+    rec = latest_location(ride_id) or local
+    if rec is not None:
+        Ride.objects.filter(id=ride_id).update(driver_lat=rec[0], driver_lng=rec[1])
+    return rec
@@ -0,0 +1,111 @@
+# RideVTC/utils/outbox.py
+"""
+Outbox transactionnelle des événements temps réel.
+
+  - record(messages) : dans la transaction qui modifie la course, enregistre les
+    messages du bus (eventbus.messages) en OutboxEvent — aucun envoi réseau pendant
+    que les verrous sont tenus, rien n’est émis si la transaction est annulée ;
+  - après commit, relay() réclame les lignes en attente (bail OUTBOX_LEASE_S),
+    les regroupe par groupe (un seul message "bus.batch" par groupe) et les
+    marque envoyées ; les échecs sont repris par le relais périodique
+    (OUTBOX_RELAY_INTERVAL_S, démarré par start_relay() au lancement du serveur,
+    cf. RidevtcConfig.ready) → livraison au moins une fois, "seq" = id pour
+    que le client ignore les doublons ;
+  - purge() supprime les lignes envoyées depuis plus de OUTBOX_RETENTION_S.
+"""
+import logging
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+from typing import Iterable, List, Optional
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from blaze_backend import metrics
+from blaze_backend.background import every, submit
+from ..models import OutboxEvent
+from . import eventbus
+
+logger = logging.getLogger("rides")
+
+
+def _lease_s() -> float:
+    return float(getattr(settings, "OUTBOX_LEASE_S", 30))
+
+def _interval_s() -> float:
+    return float(getattr(settings, "OUTBOX_RELAY_INTERVAL_S", 5.0))
+
+def _batch_size() -> int:
+    return int(getattr(settings, "OUTBOX_BATCH_SIZE", 500))
+
+
+def record(batch: Iterable[eventbus.Message]) -> List[OutboxEvent]:
+    rows = OutboxEvent.objects.bulk_create([
+        OutboxEvent(group=group, event=msg.get("event") or msg.get("type", ""), message=msg)
+        for group, msg in eventbus.dedupe(batch)
+    ])
+    if rows:
+        transaction.on_commit(lambda: submit(relay))
+    return rows
+
+
+def start_relay() -> None:
+    """Relais périodique (idempotent) : reprend les envois échoués ou restés en attente."""
+    every("outbox-relay", _interval_s(), _tick)
+
+
+def _pending(lease_cutoff):
+    return OutboxEvent.objects.filter(sent_at__isnull=True).filter(
+        Q(claimed_at__isnull=True) | Q(claimed_at__lt=lease_cutoff)
+    )
+
+
+def relay(channel_layer=None, limit: Optional[int] = None) -> int:
+    """Diffuse les événements en attente ; retourne le nombre marqué envoyé."""
+    channel_layer = channel_layer or get_channel_layer()
+    if channel_layer is None:
+        return 0
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=_lease_s())
+    ids = list(_pending(cutoff).order_by("id").values_list("id", flat=True)[: limit or _batch_size()])
+    if not ids:
+        return 0
+
+    # réclamation atomique ligne à ligne : un autre worker ne reprend que les lignes non réclamées
+    token = uuid.uuid4().hex
+    _pending(cutoff).filter(id__in=ids).update(claim=token, claimed_at=now, attempts=F("attempts") + 1)
+    rows = list(OutboxEvent.objects.filter(claim=token).order_by("id").values_list("id", "group", "message"))
+    if not rows:
+        return 0
+
+    per_group = defaultdict(list)
+    for seq, group, msg in rows:
+        per_group[group].append({**msg, "seq": seq})
+    failed = eventbus.send(channel_layer, [
+        (group, msgs[0] if len(msgs) == 1 else {"type": eventbus.BATCH_TYPE, "events": msgs})
+        for group, msgs in per_group.items()
+    ])
+    sent = OutboxEvent.objects.filter(claim=token).exclude(group__in=failed).update(sent_at=timezone.now())
+    metrics.incr("outbox.sent", sent)
+    if failed:
+        metrics.incr("outbox.failed", len(rows) - sent)
+        logger.warning("[OUTBOX] %s event(s) not delivered, retry after lease groups=%s", len(rows) - sent, failed)
+    return sent
+
+
+def purge(retention_s: Optional[float] = None) -> int:
+    retention_s = float(getattr(settings, "OUTBOX_RETENTION_S", 86400) if retention_s is None else retention_s)
+    deleted, _ = OutboxEvent.objects.filter(
+        sent_at__lt=timezone.now() - timedelta(seconds=retention_s)
+    ).delete()
+    return deleted
+
+
+def _tick() -> None:
+    while relay() >= _batch_size():
+        pass
+    purge()
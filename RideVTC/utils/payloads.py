@@ -1,50 +1,30 @@
 # RideVTC/utils/payloads.py
 from __future__ import annotations
-import time
 import re
-import requests
-from typing import Optional, Dict, Any, Tuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Optional, Dict, Any, Tuple, Callable
 from django.conf import settings
 
+from blaze_backend import metrics, outbound
+
+from .geocache import MISS, GeoCache, SingleFlight, snap_decimals
+from .pluscode import resolve_plus_code
+
 # ─────────────────────────────────────────────────────────────
-# Mini caches (clé normalisée)
+# Caches (LRU local + cache Django partagé, clés "snappées")
 # ─────────────────────────────────────────────────────────────
-_REV_TTL = 3600  # 1h
-_GEO_TTL = 3600  # 1h
-_REV_CACHE: Dict[tuple, tuple[float, Optional[str]]] = {}
-_GEO_CACHE: Dict[str, tuple[float, Optional[Tuple[float, float, str]]]] = {}
+_REV_CACHE = GeoCache("rev")
+_GEO_CACHE = GeoCache("geo")
+_REV_FLIGHT = SingleFlight("rev")
+_GEO_FLIGHT = SingleFlight("geo")
 
 def _rev_key(lat: float, lng: float, lang: str) -> tuple:
-    return (round(lat, 5), round(lng, 5), (lang or "fr")[:5])
-
-def _geo_key(label: str, lang: str) -> str:
-    return f"{(label or '').strip().lower()}|{(lang or 'fr')[:5]}"
-
-def _cache_get_rev(lat: float, lng: float, lang: str) -> Optional[str]:
-    k = _rev_key(lat, lng, lang)
-    rec = _REV_CACHE.get(k)
-    if not rec: return None
-    exp, val = rec
-    if time.time() > exp:
-        _REV_CACHE.pop(k, None)
-        return None
-    return val
-
-def _cache_set_rev(lat: float, lng: float, lang: str, val: Optional[str]) -> None:
-    _REV_CACHE[_rev_key(lat, lng, lang)] = (time.time() + _REV_TTL, val)
-
-def _cache_get_geo(label: str, lang: str) -> Optional[Tuple[float, float, str]]:
-    k = _geo_key(label, lang)
-    rec = _GEO_CACHE.get(k)
-    if not rec: return None
-    exp, val = rec
-    if time.time() > exp:
-        _GEO_CACHE.pop(k, None)
-        return None
-    return val
+    # grille GEOCODE_SNAP_DECIMALS : des pickups voisins partagent l’entrée
+    nd = snap_decimals()
+    return (round(lat, nd), round(lng, nd), (lang or "fr")[:5])
 
-def _cache_set_geo(label: str, lang: str, val: Optional[Tuple[float, float, str]]) -> None:
-    _GEO_CACHE[_geo_key(label, lang)] = (time.time() + _GEO_TTL, val)
+def _geo_key(label: str, lang: str) -> tuple:
+    return (" ".join((label or "").lower().split()), (lang or "fr")[:5])
 
 # ─────────────────────────────────────────────────────────────
 # Heuristiques
@@ -83,10 +63,11 @@ def _rev_google(lat: float, lng: float, lang: str) -> Optional[str]:
     key = getattr(settings, "GOOGLE_MAPS_API_KEY", None)
     if not key: return None
     try:
-        r = requests.get(
+        r = outbound.get(
+            "google",
             "https://maps.googleapis.com/maps/api/geocode/json",
             params={"latlng": f"{lat},{lng}", "language": lang or "fr", "key": key},
-            timeout=5,
+            timeout=(3, 5),
         )
         r.raise_for_status()
         js = r.json()
@@ -98,11 +79,12 @@ def _rev_google(lat: float, lng: float, lang: str) -> Optional[str]:
 
 def _rev_nominatim(lat: float, lng: float, lang: str) -> Optional[str]:
     try:
-        r = requests.get(
+        r = outbound.get(
+            "nominatim",
             "https://nominatim.openstreetmap.org/reverse",
             params={"format": "jsonv2", "lat": f"{lat}", "lon": f"{lng}", "accept-language": lang or "fr", "addressdetails": 1},
             headers={"User-Agent": "RideVTC/1.0 (reverse-geocode)"},
-            timeout=6,
+            timeout=(3, 6),
         )
         r.raise_for_status()
         js = r.json()
@@ -120,10 +102,10 @@ def _geocode_google(label: str, lang: str) -> Optional[Tuple[float, float, str]]
     key = getattr(settings, "GOOGLE_MAPS_API_KEY", None)
     if not key: return None
     try:
-        r = requests.get(
+        r = outbound.get(
+            "google",
             "https://maps.googleapis.com/maps/api/geocode/json",
             params={"address": label, "language": lang or "fr", "key": key},
-            timeout=6,
         )
         r.raise_for_status()
         js = r.json()
@@ -139,11 +121,11 @@ def _geocode_google(label: str, lang: str) -> Optional[Tuple[float, float, str]]
 
 def _geocode_nominatim(label: str, lang: str) -> Optional[Tuple[float, float, str]]:
     try:
-        r = requests.get(
+        r = outbound.get(
+            "nominatim",
             "https://nominatim.openstreetmap.org/search",
             params={"format": "json", "q": label, "limit": 1, "accept-language": lang or "fr"},
             headers={"User-Agent": "RideVTC/1.0 (geocode)"},
-            timeout=7,
         )
         r.raise_for_status()
         arr = r.json()
@@ -157,35 +139,118 @@ def _geocode_nominatim(label: str, lang: str) -> Optional[Tuple[float, float, st
         pass
     return None
 
+# ─────────────────────────────────────────────────────────────
+# Appels "hedgés" : le fournisseur secondaire part après GEOCODE_HEDGE_DELAY_S
+# si le primaire n’a pas répondu ; la première réponse utile gagne.
+# ─────────────────────────────────────────────────────────────
+_HEDGE_POOL = ThreadPoolExecutor(
+    max_workers=int(getattr(settings, "GEOCODE_HEDGE_WORKERS", 8)),
+    thread_name_prefix="geo-hedge",
+)
+
+def _timed_call(metric: str, fn: Callable, *args):
+    with metrics.timed(metric):
+        return fn(*args)
+
+def _hedged(kind: str, providers: list[tuple[str, Callable]], *args):
+    """
+    providers = [(nom, fn), ...] par ordre de préférence.
+    GEOCODE_HEDGE_DELAY_S < 0 → ancien comportement séquentiel.
+    NB: un appel HTTP déjà parti ne peut pas être interrompu ; le perdant
+    termine en arrière-plan (borné par son timeout) et son résultat est ignoré.
+    """
+    delay = float(getattr(settings, "GEOCODE_HEDGE_DELAY_S", 0.3))
+    if delay < 0:
+        for name, fn in providers:
+            res = _timed_call(f"geocode.{kind}.{name}.ms", fn, *args)
+            if res:
+                return res
+        return None
+
+    pending = {}
+    queue = list(providers)
+    while queue or pending:
+        if queue:
+            name, fn = queue.pop(0)
+            pending[_HEDGE_POOL.submit(_timed_call, f"geocode.{kind}.{name}.ms", fn, *args)] = name
+        done, _ = wait(list(pending), timeout=delay if queue else None, return_when=FIRST_COMPLETED)
+        for fut in done:
+            name = pending.pop(fut)
+            try:
+                res = fut.result()
+            except Exception:
+                res = None
+            if res:
+                for other in pending:
+                    other.cancel()
+                metrics.incr(f"geocode.{kind}.win.{name}")
+                return res
+    metrics.incr(f"geocode.{kind}.none")
+    return None
+
 def reverse_geocode(lat: Optional[float], lng: Optional[float], lang: str = "fr") -> Optional[str]:
     if lat is None or lng is None: return None
-    cached = _cache_get_rev(lat, lng, lang)
-    if cached is not None: return cached
-    addr = _rev_google(lat, lng, lang) or _rev_nominatim(lat, lng, lang)
-    _cache_set_rev(lat, lng, lang, addr)
-    return addr
+    key = _rev_key(lat, lng, lang)
+    cached = _REV_CACHE.get(key)
+    if cached is not MISS: return cached
+
+    def _lookup() -> Optional[str]:
+        addr = _hedged("rev", [("google", _rev_google), ("nominatim", _rev_nominatim)], lat, lng, lang)
+        _REV_CACHE.set(key, addr)
+        return addr
+    return _REV_FLIGHT.do(key, _lookup)
 
 def geocode_label(label: str, lang: str = "fr") -> Optional[Tuple[float, float, str]]:
     if not label: return None
-    c = _cache_get_geo(label, lang)
-    if c is not None: return c
-    # Google d’abord (gère très bien les plus codes), sinon Nominatim
-    res = _geocode_google(label, lang) or _geocode_nominatim(label, lang)
-    _cache_set_geo(label, lang, res)
-    return res
+    key = _geo_key(label, lang)
+    c = _GEO_CACHE.get(key)
+    if c is not MISS: return c
+
+    def _lookup() -> Optional[Tuple[float, float, str]]:
+        # Google d’abord (gère très bien les plus codes), sinon Nominatim
+        res = _hedged("geo", [("google", _geocode_google), ("nominatim", _geocode_nominatim)], label, lang)
+        _GEO_CACHE.set(key, res)
+        return res
+    return _GEO_FLIGHT.do(key, _lookup)
 
 # ─────────────────────────────────────────────────────────────
 # Construction du payload chauffeur (avec enrichissement)
 # ─────────────────────────────────────────────────────────────
+def _local_plus_code(label: Optional[str]) -> Optional[Tuple[float, float, str]]:
+    """Plus code décodé hors-ligne → (lat, lng, "code, Localité"), sinon None."""
+    if not looks_like_plus_code(label):
+        return None
+    local = resolve_plus_code(label, getattr(settings, "PLUSCODE_DEFAULT_LOCALITY", "libreville") or None)
+    if not local:
+        return None
+    lat, lng, locality = local
+    lab = label.strip()
+    if locality and len(lab.split()) == 1 and "," not in lab:
+        lab = f"{lab}, {locality.title()}"  # code seul → localité de référence utilisée
+    return lat, lng, lab
+
+def _local_coords(label: Optional[str], lat: Optional[float], lng: Optional[float]) -> Tuple[Optional[float], Optional[float]]:
+    local = _local_plus_code(label)
+    if local:
+        return local[0], local[1]
+    return lat, lng
+
 def _best_triplet(label: Optional[str], lat: Optional[float], lng: Optional[float], lang: str) -> Tuple[Optional[str], Optional[float], Optional[float]]:
     """
     Renvoie (label, lat, lng) optimal :
       - si label est “mauvais” et lat/lng présents → reverse
+      - si label est un plus code décodable localement → "code, Localité" + coords, sans réseau
+        (coords décodées si absentes)
       - si label est “mauvais” et lat/lng absents → GEOCODE du label (plus code, adresse textuelle)
       - sinon conserve tel quel
     """
     lab = (label or "").strip()
     if _is_bad_label(lab):
+        local = _local_plus_code(lab)
+        if local:
+            # plus code → décodé localement, aucun appel de géocodage (ni reverse)
+            llat, llng, llab = local
+            return (llab, lat if lat is not None else llat, lng if lng is not None else llng)
         if lat is not None and lng is not None:
             addr = reverse_geocode(lat, lng, lang)
             return (addr or lab, lat, lng)
@@ -204,12 +269,14 @@ def _best_triplet(label: Optional[str], lat: Optional[float], lng: Optional[floa
             return (lab, glat, glng)
     return (lab, lat, lng)
 
-def build_ride_offer_payload(ride, category: str = "eco", area: str = "city-default", language: str = "fr") -> Dict[str, Any]:
+def build_ride_offer_payload(ride, category: str = "eco", area: str = "city-default", language: str = "fr", enrich: bool = True) -> Dict[str, Any]:
     """
     Construit le payload 'ride.requested' le plus lisible possible :
       - essaie d’avoir label *et* coords pour pickup/dropoff
       - convertit les plus codes en adresses réelles si possible
       - évite “Votre position actuelle” en remplaçant par une vraie adresse quand on a des coords
+    enrich=False → libellés bruts, aucun appel réseau (chemin critique de create) ;
+    seuls les plus codes sont décodés localement en coords.
     """
     lang = (language or "fr").split(",")[0].strip()[:5] or "fr"
 
@@ -221,8 +288,16 @@ def build_ride_offer_payload(ride, category: str = "eco", area: str = "city-defa
     p_label_src = getattr(ride, "pickup_location", None)
     d_label_src = getattr(ride, "dropoff_location", None)
 
-    p_label, p_lat, p_lng = _best_triplet(p_label_src, p_lat, p_lng, lang)
-    d_label, d_lat, d_lng = _best_triplet(d_label_src, d_lat, d_lng, lang)
+    if enrich:
+        p_label, p_lat, p_lng = _best_triplet(p_label_src, p_lat, p_lng, lang)
+        d_label, d_lat, d_lng = _best_triplet(d_label_src, d_lat, d_lng, lang)
+    else:
+        p_label, d_label = (p_label_src or "").strip(), (d_label_src or "").strip()
+        # seul enrichissement gardé ici : plus code → coords, calcul local (µs)
+        if p_lat is None or p_lng is None:
+            p_lat, p_lng = _local_coords(p_label, p_lat, p_lng)
+        if d_lat is None or d_lng is None:
+            d_lat, d_lng = _local_coords(d_label, d_lat, d_lng)
 
     payload = {
         "id": getattr(ride, "id", None),
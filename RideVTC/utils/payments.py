@@ -10,6 +10,8 @@ from typing import Tuple, Optional
 import requests
 from django.conf import settings
 
+from blaze_backend import outbound
+
 from RideVTC.models import Payment
 
 
@@ -90,7 +92,7 @@ class AirtelAfricaClient:
             "client_secret": self.client_secret,
             "grant_type": "client_credentials",
         }
-        r = requests.post(url, headers=headers, data=json.dumps(payload), timeout=30)
+        r = outbound.post("airtel", url, headers=headers, data=json.dumps(payload), timeout=(5, 30))
         r.raise_for_status()
         data = r.json() if r.content else {}
         return data.get("access_token") or data.get("accessToken") or ""
@@ -131,7 +133,7 @@ class AirtelAfricaClient:
         }
 
         try:
-            r = requests.post(url, headers=headers, data=json.dumps(payload), timeout=45)
+            r = outbound.post("airtel", url, headers=headers, data=json.dumps(payload))
             if r.status_code not in (200, 201, 202):
                 msg = f"HTTP {r.status_code}"
                 try:
@@ -18,4 +18,163 @@ PLACEHOLDER_CANDIDATES = {
 def looks_like_placeholder(s: str | None) -> bool:
     if not s:
         return True
-    return s.strip().lower() in PLACEHOLDER_CANDIDATES
\ No newline at end of file
+    return s.strip().lower() in PLACEHOLDER_CANDIDATES
+
+# ─────────────────────────────────────────────────────────────
+# Décodage Open Location Code (plus codes) hors-ligne
+#   - code complet ("6FG22222+22")  → centre de la cellule, calcul pur
+#   - code court ("5GQ3+XF Libreville") → récupéré autour d’une localité
+#     de référence (table GABON_LOCALITIES ci-dessous)
+# ─────────────────────────────────────────────────────────────
+import unicodedata
+
+_OLC_ALPHABET = "23456789CFGHJMPQRVWX"
+_OLC_SEPARATOR = "+"
+_OLC_SEPARATOR_POS = 8
+_OLC_PAIR_LEN = 10
+_OLC_GRID_ROWS, _OLC_GRID_COLS = 5, 4
+
+_CODE_IN_LABEL_RE = re.compile(
+    r'^\s*([23456789CFGHJMPQRVWX0]{2,8}\+[23456789CFGHJMPQRVWX]*)\s*[,;-]?\s*(.*)$', re.I
+)
+
+# Localités de référence (lat, lng) pour les codes courts
+GABON_LOCALITIES = {
+    "libreville": (0.4162, 9.4673),
+    "port-gentil": (-0.7193, 8.7815),
+    "franceville": (-1.6333, 13.5833),
+    "oyem": (1.5995, 11.5793),
+    "moanda": (-1.5667, 13.2000),
+    "lambarene": (-0.7001, 10.2406),
+    "mouila": (-1.8685, 11.0559),
+    "tchibanga": (-2.9331, 11.0079),
+    "koulamoutou": (-1.1303, 12.4740),
+    "makokou": (0.5738, 12.8642),
+    "bitam": (2.0833, 11.5000),
+    "owendo": (0.2910, 9.5040),
+    "akanda": (0.5300, 9.4200),
+    "ntoum": (0.3905, 9.7610),
+}
+
+
+def _strip_accents(s: str) -> str:
+    return "".join(c for c in unicodedata.normalize("NFKD", s) if not unicodedata.combining(c))
+
+
+def _is_valid_code(code: str) -> bool:
+    sep = code.find(_OLC_SEPARATOR)
+    if sep < 0 or sep != code.rfind(_OLC_SEPARATOR) or sep > _OLC_SEPARATOR_POS or sep % 2:
+        return False
+    if "0" in code:
+        # padding uniquement pour les codes complets, avant le séparateur, jusqu’à lui
+        pad = code.find("0")
+        if sep < _OLC_SEPARATOR_POS or pad == 0 or pad % 2 or code[pad:sep].strip("0") or code[sep + 1:]:
+            return False
+    if len(code) - sep - 1 == 1:
+        return False
+    return all(c in _OLC_ALPHABET for c in code.replace(_OLC_SEPARATOR, "").replace("0", ""))
+
+
+def is_full_code(code: str) -> bool:
+    code = (code or "").strip().upper()
+    return _is_valid_code(code) and code.find(_OLC_SEPARATOR) == _OLC_SEPARATOR_POS
+
+
+def is_short_code(code: str) -> bool:
+    code = (code or "").strip().upper()
+    return _is_valid_code(code) and code.find(_OLC_SEPARATOR) < _OLC_SEPARATOR_POS
+
+
+def decode(code: str) -> tuple[float, float, float, float]:
+    """Code complet → (lat_centre, lng_centre, hauteur_deg, largeur_deg)."""
+    code = code.strip().upper()
+    if not is_full_code(code):
+        raise ValueError(f"not a full plus code: {code!r}")
+    digits = code.replace(_OLC_SEPARATOR, "").rstrip("0")
+
+    lat, lng = -90.0, -180.0
+    res = 20.0
+    for i in range(0, min(len(digits), _OLC_PAIR_LEN), 2):
+        lat += _OLC_ALPHABET.index(digits[i]) * res
+        lng += _OLC_ALPHABET.index(digits[i + 1]) * res
+        lat_res = lng_res = res
+        res /= 20.0
+    for c in digits[_OLC_PAIR_LEN:]:
+        row, col = divmod(_OLC_ALPHABET.index(c), _OLC_GRID_COLS)
+        lat_res /= _OLC_GRID_ROWS
+        lng_res /= _OLC_GRID_COLS
+        lat += row * lat_res
+        lng += col * lng_res
+    return lat + lat_res / 2, lng + lng_res / 2, lat_res, lng_res
+
+
+def _encode_prefix(lat: float, lng: float, n: int) -> str:
+    """Les n premiers caractères (n pair ≤ 8) du code d’un point."""
+    lat = min(max(lat, -90.0), 90.0 - 1e-9) + 90.0
+    lng = ((lng + 180.0) % 360.0)
+    out, res = [], 20.0
+    for _ in range(n // 2):
+        a, b = int(lat // res), int(lng // res)
+        out += [_OLC_ALPHABET[a], _OLC_ALPHABET[b]]
+        lat -= a * res
+        lng -= b * res
+        res /= 20.0
+    return "".join(out)
+
+
+def recover_nearest(short: str, ref_lat: float, ref_lng: float) -> tuple[float, float]:
+    """Code court → (lat, lng) de la cellule la plus proche du point de référence."""
+    short = short.strip().upper()
+    if is_full_code(short):
+        return decode(short)[:2]
+    if not is_short_code(short):
+        raise ValueError(f"not a plus code: {short!r}")
+    pad = _OLC_SEPARATOR_POS - short.find(_OLC_SEPARATOR)
+    resolution = 20.0 ** (2 - pad / 2)
+    half = resolution / 2.0
+
+    lat, lng, _, _ = decode(_encode_prefix(ref_lat, ref_lng, pad) + short)
+    if ref_lat + half < lat and lat - resolution >= -90:
+        lat -= resolution
+    elif ref_lat - half > lat and lat + resolution <= 90:
+        lat += resolution
+    if ref_lng + half < lng:
+        lng -= resolution
+    elif ref_lng - half > lng:
+        lng += resolution
+    return lat, ((lng + 180.0) % 360.0) - 180.0
+
+
+def _find_locality(text: str):
+    t = _strip_accents(text or "").lower()
+    for name, ref in GABON_LOCALITIES.items():
+        if re.search(rf"(^|[^a-z]){re.escape(name)}([^a-z]|$)", t):
+            return name, ref
+    return None, None
+
+
+def resolve_plus_code(label: str | None, default_locality: str | None = "libreville") -> tuple[float, float, str | None] | None:
+    """
+    Résout localement un libellé de type plus code, sans réseau.
+    Retourne (lat, lng, localité) ou None si le libellé n’est pas exploitable.
+    Code court sans localité reconnue → default_locality.
+    """
+    m = _CODE_IN_LABEL_RE.match(label or "")
+    if not m:
+        return None
+    code, rest = m.group(1).upper(), m.group(2)
+    try:
+        if is_full_code(code):
+            lat, lng, _, _ = decode(code)
+            return lat, lng, _find_locality(rest)[0]
+        if not is_short_code(code):
+            return None
+        name, ref = _find_locality(rest)
+        if ref is None and default_locality:
+            name, ref = default_locality, GABON_LOCALITIES.get(default_locality)
+        if ref is None:
+            return None
+        lat, lng = recover_nearest(code, *ref)
+        return lat, lng, name
+    except ValueError:
+        return None
@@ -1,14 +1,61 @@
 # RideVTC/utils/realtime.py
 import logging
-from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
 
+from . import eventbus
+from .rooms import user_room, driver_room
+
 log = logging.getLogger(__name__)
 layer = get_channel_layer()
 
 def emit_to_group(group: str, event: str, payload: dict):
     log.info("EMIT %s → %s : %s", event, group, payload)
-    async_to_sync(layer.group_send)(
-        group,
-        {"type": "evt", "event": event, "payload": payload},
-    )
\ No newline at end of file
+    eventbus.publish(layer, event, payload, [group])
+
+
+def ride_accepted_messages(ride) -> list[tuple[str, dict]]:
+    """
+    Messages (groupe, message) à diffuser quand une course est acceptée.
+    Partagé entre RideViewSet.accept (REST) et DriverConsumer (WS).
+    """
+    client_group = user_room(ride.user_id)
+    payload = {
+        "requestId": ride.id,
+        "driver": {
+            "id": ride.driver_id,
+            "email": getattr(ride.driver, "email", None),
+            "phone_number": getattr(ride.driver, "phone_number", None),
+        },
+        "ride": {
+            "id": ride.id,
+            "pickup": {
+                "label": ride.pickup_location,
+                "lat": getattr(ride, "pickup_lat", None),
+                "lng": getattr(ride, "pickup_lng", None),
+            },
+            "dropoff": {
+                "label": ride.dropoff_location,
+                "lat": getattr(ride, "dropoff_lat", None),
+                "lng": getattr(ride, "dropoff_lng", None),
+            },
+            "price": str(ride.price),
+            "status": ride.status,
+
+            # ✅ ajouts lisibles pour le client aussi
+            "pickup_label": (ride.pickup_location or None),
+            "dropoff_label": (ride.dropoff_location or None),
+            "price_text": f"{int(ride.price)} FCFA" if ride.price is not None else "—",
+        },
+    }
+    # format générique + format direct (sockets protocole v1 : certains front écoutent msg.type)
+    direct_msg = {
+        "type": "ride.accepted",
+        "requestId": ride.id,
+        "driver": payload["driver"],
+        "ride": payload["ride"],
+    }
+    return [
+        *eventbus.messages("ride.accepted", payload, [client_group], compat=direct_msg),
+        # (facultatif) notifier aussi le chauffeur affecté (canal privé)
+        *eventbus.messages("ride.assigned", {"requestId": ride.id}, [driver_room(ride.driver_id)]),
+    ]
@@ -0,0 +1,70 @@
+# RideVTC/utils/sockets.py
+"""
+Registre des sockets chauffeur, partagé entre workers (cache Django → Redis en prod).
+
+  driver:<id>:socket → channel_name de la socket DriverConsumer active,
+  TTL DRIVER_SOCKET_TTL_S rafraîchi à chaque ping : une entrée laissée par un
+  worker tombé expire d’elle-même.
+
+  - aregister / arefresh / aunregister : cycle de vie (consumer)
+  - live_channel(id) / alive_channels(ids) : channel actif d’un chauffeur
+    → channel_layer.send direct, sans résolution de groupe (cf. eventbus)
+"""
+import logging
+import re
+from typing import Dict, Iterable, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger("rides")
+
+_DRIVER_ROOM = re.compile(r"^driver\.(\d+)$")
+
+
+def _ttl_s() -> int:
+    return int(getattr(settings, "DRIVER_SOCKET_TTL_S", 120))
+
+def _key(driver_id) -> str:
+    return f"driver:{int(driver_id)}:socket"
+
+
+def driver_id_of(group: str) -> Optional[int]:
+    """"driver.<id>" (driver_room) → id, sinon None."""
+    m = _DRIVER_ROOM.match(group or "")
+    return int(m.group(1)) if m else None
+
+
+async def aregister(driver_id: int, channel_name: str) -> Optional[str]:
+    """Enregistre la socket ; retourne la précédente si c’en était une autre (à expulser)."""
+    old = await cache.aget(_key(driver_id))
+    await cache.aset(_key(driver_id), channel_name, timeout=_ttl_s())
+    return old if old and old != channel_name else None
+
+
+async def arefresh(driver_id: int, channel_name: str) -> None:
+    """Heartbeat : prolonge le TTL de l’entrée (recréée si elle a expiré et que la place est libre)."""
+    if not await cache.atouch(_key(driver_id), timeout=_ttl_s()):
+        # entrée expirée (ping tardif) → on la recrée si personne n’a pris la place
+        await cache.aadd(_key(driver_id), channel_name, timeout=_ttl_s())
+
+
+async def aunregister(driver_id: int, channel_name: str) -> bool:
+    """Retire la socket si c’est la socket active ; True si le chauffeur n’a plus de socket."""
+    if await cache.aget(_key(driver_id)) != channel_name:
+        return False
+    await cache.adelete(_key(driver_id))
+    return True
+
+
+def live_channel(driver_id: int) -> Optional[str]:
+    return cache.get(_key(driver_id))
+
+
+async def alive_channels(driver_ids: Iterable[int]) -> Dict[int, str]:
+    """{driver_id: channel_name} pour les chauffeurs ayant une socket enregistrée (un seul aller-retour cache)."""
+    ids = list(driver_ids)
+    if not ids:
+        return {}
+    found = await cache.aget_many([_key(d) for d in ids])
+    return {d: found[_key(d)] for d in ids if _key(d) in found}
@@ -0,0 +1,258 @@
+# RideVTC/utils/trace.py
+"""
+Trace GPS compacte d’une course.
+
+Pendant la course (in_progress, du start au finish), chaque fix est ajouté à un buffer array('i') par process :
+latitude/longitude en micro-degrés et temps en ms, tous trois encodés en
+deltas int32 par rapport au point précédent (12 octets par fix). Le buffer de
+chaque process est recopié dans le cache partagé toutes les
+LOCATION_FLUSH_INTERVAL_S (même cadence que locbuffer) ; à `finish`, les
+morceaux de tous les workers sont fusionnés et persistés en un seul blob (RideTrace).
+Les derniers fixes reçus par un autre worker ne sont recopiés qu’à son prochain
+spill : une seconde fusion (remerge_trace, 2 × LOCATION_FLUSH_INTERVAL_S après
+finish) les ajoute et corrige measured_distance_km / measured_duration_s. La
+réponse et l’événement ride.finished reflètent la fusion faite à finish.
+
+Format du blob (little-endian) :
+    en-tête "<4sqI" = (b"RTR1", t0_ms, n)
+    puis 3 × n int32 : dlat_e6[n], dlng_e6[n], dt_ms[n]   (premier point : valeurs absolues,
+                                                          dt_ms[0] = 0 ; t0_ms = epoch du premier point)
+
+Horodatage : le "ts" client n’est gardé que s’il est plausible (fenêtre
+TRACE_MAX_PAST_S / TRACE_MAX_FUTURE_S autour de l’heure serveur) et ne remonte pas
+avant le point précédent ; sinon heure serveur. Un delta hors int32 est refusé
+avant toute écriture : les trois colonnes gardent toujours la même longueur.
+"""
+import logging
+import os
+import struct
+import sys
+import threading
+import time
+import uuid
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from blaze_backend.background import every, schedule
+
+logger = logging.getLogger("rides")
+
+_MAGIC = b"RTR1"
+_HEADER = struct.Struct("<4sqI")
+_PART_TTL_S = 6 * 3600
+_TOKEN = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"   # identifie ce worker dans le cache
+
+Point = Tuple[float, float, int]   # (lat, lng, t_ms epoch)
+
+_I32_MIN, _I32_MAX = -2 ** 31, 2 ** 31 - 1
+
+
+class _TraceBuffer:
+    """Deltas int32 d’une course dans ce process."""
+    __slots__ = ("dlat", "dlng", "dt", "last", "t0", "touched", "dirty")
+
+    def __init__(self):
+        self.dlat, self.dlng, self.dt = array("i"), array("i"), array("i")
+        self.last: Optional[Tuple[int, int, int]] = None
+        self.t0 = 0
+        self.touched = time.time()
+        self.dirty = False
+
+    def append(self, lat: float, lng: float, t_ms: int) -> None:
+        """ValueError si un delta ne tient pas en int32 (buffer inchangé)."""
+        ilat, ilng = int(round(lat * 1e6)), int(round(lng * 1e6))
+        if self.last is None:
+            deltas = (ilat, ilng, 0)
+        else:
+            plat, plng, pt = self.last
+            deltas = (ilat - plat, ilng - plng, t_ms - pt)
+        if not all(_I32_MIN <= d <= _I32_MAX for d in deltas):
+            raise ValueError(f"trace delta out of int32 range: {deltas}")
+        if self.last is None:
+            self.t0 = t_ms
+        self.dlat.append(deltas[0]); self.dlng.append(deltas[1]); self.dt.append(deltas[2])
+        self.last = (ilat, ilng, t_ms)
+        self.touched = time.time()
+        self.dirty = True
+
+    def encode(self) -> bytes:
+        return _pack(self.t0, self.dlat, self.dlng, self.dt)
+
+
+def _pack(t0: int, dlat: array, dlng: array, dt: array) -> bytes:
+    parts = [_HEADER.pack(_MAGIC, t0, len(dlat))]
+    for arr in (dlat, dlng, dt):
+        if sys.byteorder == "big":
+            arr = array("i", arr)
+            arr.byteswap()
+        parts.append(arr.tobytes())
+    return b"".join(parts)
+
+
+def decode(blob: bytes) -> List[Point]:
+    magic, t0, n = _HEADER.unpack_from(blob, 0)
+    if magic != _MAGIC:
+        raise ValueError("not a ride trace blob")
+    cols = []
+    off = _HEADER.size
+    for _ in range(3):
+        arr = array("i")
+        arr.frombytes(blob[off:off + 4 * n])
+        if sys.byteorder == "big":
+            arr.byteswap()
+        cols.append(arr)
+        off += 4 * n
+    out: List[Point] = []
+    lat = lng = 0
+    t = t0
+    for i, (a, b, c) in enumerate(zip(*cols)):
+        lat += a
+        lng += b
+        t = t0 if i == 0 else t + c
+        out.append((lat / 1e6, lng / 1e6, t))
+    return out
+
+
+def encode(points: Iterable[Point]) -> bytes:
+    buf = _TraceBuffer()
+    for lat, lng, t_ms in points:
+        buf.append(lat, lng, int(t_ms))
+    return buf.encode()
+
+
+_LOCK = threading.Lock()
+_BUFFERS: Dict[int, _TraceBuffer] = {}
+
+
+def _parts_key(ride_id: int) -> str:
+    return f"ride:{int(ride_id)}:trace:parts"
+
+def _part_key(ride_id: int, token: str) -> str:
+    return f"ride:{int(ride_id)}:trace:{token}"
+
+
+def plausible_ts_ms(ts_ms: int, now_ms: Optional[int] = None) -> bool:
+    """Horodatage client dans la fenêtre [now − TRACE_MAX_PAST_S, now + TRACE_MAX_FUTURE_S]."""
+    now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+    past_ms = int(getattr(settings, "TRACE_MAX_PAST_S", 3600)) * 1000
+    future_ms = int(getattr(settings, "TRACE_MAX_FUTURE_S", 60)) * 1000
+    return now_ms - past_ms <= ts_ms <= now_ms + future_ms
+
+
+def append_fix(ride_id: int, lat: float, lng: float, ts_ms: Optional[int] = None) -> None:
+    now_ms = int(time.time() * 1000)
+    t_ms = ts_ms if ts_ms is not None and plausible_ts_ms(ts_ms, now_ms) else now_ms
+    with _LOCK:
+        buf = _BUFFERS.get(int(ride_id))
+        if buf is None:
+            buf = _BUFFERS[int(ride_id)] = _TraceBuffer()
+        if buf.last is not None and t_ms < buf.last[2]:
+            # hors ordre (horloge remise à zéro, fix client après un fix serveur…)
+            t_ms = max(now_ms, buf.last[2])
+        try:
+            buf.append(lat, lng, t_ms)
+        except (ValueError, OverflowError) as e:  # delta hors int32, coordonnée non finie
+            logger.warning("[TRACE] fix dropped ride_id=%s: %s", ride_id, e)
+            return
+    every("trace-spill", float(getattr(settings, "LOCATION_FLUSH_INTERVAL_S", 5.0)), spill)
+
+
+def spill() -> None:
+    """Recopie les buffers modifiés de ce process dans le cache (appelé par le flusher)."""
+    now = time.time()
+    with _LOCK:
+        todo = [(rid, buf.encode()) for rid, buf in _BUFFERS.items() if buf.dirty]
+        for buf in _BUFFERS.values():
+            buf.dirty = False
+        for rid in [rid for rid, buf in _BUFFERS.items() if now - buf.touched > _PART_TTL_S]:
+            del _BUFFERS[rid]
+    for rid, blob in todo:
+        try:
+            cache.set(_part_key(rid, _TOKEN), blob, timeout=_PART_TTL_S)
+            parts = cache.get(_parts_key(rid)) or []
+            if _TOKEN not in parts:
+                cache.set(_parts_key(rid), parts + [_TOKEN], timeout=_PART_TTL_S)
+        except Exception as e:
+            logger.warning("[TRACE] spill failed ride_id=%s: %s", rid, e)
+
+
+def live_points(ride_id: int) -> List[Point]:
+    """Trace en cours (tous workers), triée par temps."""
+    spill()
+    points: List[Point] = []
+    try:
+        tokens = cache.get(_parts_key(ride_id)) or []
+        blobs = cache.get_many([_part_key(ride_id, t) for t in tokens])
+    except Exception as e:
+        logger.warning("[TRACE] read failed ride_id=%s: %s", ride_id, e)
+        blobs = {}
+    for blob in blobs.values():
+        points.extend(decode(blob))
+    points.sort(key=lambda p: p[2])
+    return points
+
+
+def _remerge_delay_s() -> float:
+    return 2 * float(getattr(settings, "LOCATION_FLUSH_INTERVAL_S", 5.0))
+
+
+def _store(ride_id: int, points: List[Point]):
+    from ..models import RideTrace
+
+    trace, _ = RideTrace.objects.update_or_create(
+        ride_id=ride_id, defaults={"data": encode(points), "points": len(points)},
+    )
+    return trace
+
+
+def _drop_parts(ride_id: int) -> None:
+    try:
+        tokens = cache.get(_parts_key(ride_id)) or []
+        cache.delete_many([_part_key(ride_id, t) for t in tokens] + [_parts_key(ride_id)])
+    except Exception:
+        pass
+
+
+def persist_trace(ride_id: int):
+    """Fusionne la trace de la course et l’enregistre (un seul blob). Retourne (RideTrace, points)."""
+    points = live_points(ride_id)
+    trace = _store(ride_id, points) if points else None
+    with _LOCK:
+        _BUFFERS.pop(int(ride_id), None)
+    # morceaux conservés pour la seconde fusion (fixes pas encore recopiés par les autres workers)
+    schedule(_remerge_delay_s(), remerge_trace, ride_id, len(points))
+    return trace, points
+
+
+def remerge_trace(ride_id: int, persisted: int) -> int:
+    """
+    Seconde fusion après finish : si d’autres workers ont recopié des fixes depuis,
+    réenregistre la trace et la mesure de la course. Retourne le nombre de points ajoutés.
+    """
+    from ..models import Ride
+    from .tripmeter import measure_blob
+
+    points = live_points(ride_id)
+    added = len(points) - persisted
+    if added > 0:
+        trace = _store(ride_id, points)
+        km, moving_s = measure_blob(bytes(trace.data))
+        Ride.objects.filter(id=ride_id).update(
+            measured_distance_km=round(km, 3), measured_duration_s=int(moving_s),
+        )
+        logger.info("[TRACE] remerge ride_id=%s added=%s points", ride_id, added)
+    _drop_parts(ride_id)
+    return max(0, added)
+
+
+def load_trace(ride_id: int) -> List[Point]:
+    """Trace persistée si la course est terminée, sinon la trace en cours."""
+    from ..models import RideTrace
+
+    row = RideTrace.objects.filter(ride_id=ride_id).only("data").first()
+    if row is not None:
+        return decode(bytes(row.data))
+    return live_points(ride_id)
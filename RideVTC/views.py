@@ -2,7 +2,7 @@
 
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.views import APIView
-from .models import RideVehicle, Ride, Payment, DriverStats, DriverRating, DriverPresence, DriverNavEvent
+from .models import RideVehicle, Ride, Payment, DriverStats, DriverRating, DriverNavEvent
 from .serializers import (
     RideVehicleSerializer,
     RideCreateSerializer,
@@ -16,6 +16,7 @@ from .serializers import (
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from django.db import transaction
 from django.shortcuts import get_object_or_404
+from django.http import Http404
 from rest_framework import viewsets, status, permissions, filters, mixins
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
@@ -30,6 +31,17 @@ from RideVTC.utils.payments import (
 from django.utils import timezone
 from django.conf import settings
 from RideVTC.utils.payloads import build_ride_offer_payload
+from RideVTC.utils.claims import claim_ride, release_ride_claim
+from RideVTC.utils.realtime import ride_accepted_messages
+from RideVTC.utils import eventbus, outbox
+from RideVTC.utils.locations import LocationRejected, publish_driver_location
+from RideVTC.utils.locbuffer import flush_ride, latest_location
+from RideVTC.utils.geoindex import mark_busy, mark_free
+from RideVTC.utils.trace import load_trace, persist_trace
+from RideVTC.utils.tripmeter import measure_blob
+from .dispatch import offer_ride, stop_dispatch, enrich_ride_offer
+from .presence import PRESENCE
+from blaze_backend.background import submit
 import re
 import logging
 import time
@@ -40,7 +52,6 @@ from django.db.models.functions import TruncHour
 from .permissions import IsDriverOrStaff
 from users.models import CustomerProfile
 
-from asgiref.sync import async_to_sync
 try:
     from channels.layers import get_channel_layer
     channel_layer = get_channel_layer()
@@ -51,6 +62,18 @@ from .ws import app_ws_send  # mock WS; remplace par ta vraie intégration si di
 
 logger = logging.getLogger(__name__)
 
+def _ride_pk(pk) -> int:
+    """pk d’URL → id de course ; le routeur DRF accepte [^/.]+ : un id non numérique est un 404."""
+    try:
+        return int(pk)
+    except (TypeError, ValueError):
+        raise Http404
+
+def _release_driver(ride, last=None):
+    """Course terminée / annulée → le chauffeur redevient proposable (index de dispatch)."""
+    lat, lng = (last[0], last[1]) if last else (ride.driver_lat, ride.driver_lng)
+    mark_free(ride.driver_id, lat, lng)
+
 def _has_success_payment(ride):
     return Payment.objects.filter(ride=ride, status="SUCCESS").exists()
 
@@ -164,6 +187,10 @@ class RideViewSet(viewsets.ModelViewSet):
             "driver_lat": getattr(ride, "driver_lat", None),
             "driver_lng": getattr(ride, "driver_lng", None),
         }
+        # position la plus fraîche : buffer write-behind (la DB peut avoir quelques s de retard)
+        buffered = latest_location(ride.id)
+        if buffered:
+            data["driver_lat"], data["driver_lng"] = buffered[0], buffered[1]
         if ride.driver_id:
             d = ride.driver
             vehicle = RideVehicle.objects.filter(driver=d).order_by("id").first()
@@ -214,41 +241,36 @@ class RideViewSet(viewsets.ModelViewSet):
     # ───────────────────────────────────────────────────────────
     @action(detail=True, methods=["post"], url_path="location")
     def location(self, request, pk=None):
-        ride = get_object_or_404(Ride, pk=pk)
-        if ride.driver_id != request.user.id:
-            return Response({"detail": "Forbidden"}, status=status.HTTP_403_FORBIDDEN)
-
         serializer = DriverLocationSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         lat = serializer.validated_data['lat']
         lng = serializer.validated_data['lng']
 
-        # Ne pousse pas si course terminée/annulée
-        if ride.status in {"cancelled", "completed", "finished"}:
-            logger.info("[LOC] reject location ride_id=%s status=%s", ride.id, ride.status)
+        # même logique que le message WS driver.location (DriverConsumer)
+        ride_id = _ride_pk(pk)
+        try:
+            try:
+                heading = float(request.data["heading"]) if request.data.get("heading") is not None else None
+            except (TypeError, ValueError):
+                heading = None
+            # "ts" client optionnel : validé par _fix_ts_ms (heure serveur si absent / invalide)
+            fix = {"lat": lat, "lng": lng, "ts": request.data.get("ts")}
+            messages = publish_driver_location(ride_id, request.user.id, lat, lng, heading, [fix])
+        except LocationRejected as e:
+            if e.reason == "not_found":
+                raise Http404
+            if e.reason == "forbidden":
+                return Response({"detail": "Forbidden"}, status=status.HTTP_403_FORBIDDEN)
+            # Ne pousse pas si course terminée/annulée
             resp = Response(
-                {"ok": False, "reason": "ride_ended", "ride_status": ride.status, "ride_id": ride.id},
+                {"ok": False, "reason": "ride_ended", "ride_status": e.status, "ride_id": ride_id},
                 status=status.HTTP_410_GONE,
             )
             resp["X-Ride-Ended"] = "1"
             return resp
 
-        ride.driver_lat = lat
-        ride.driver_lng = lng
-        ride.save(update_fields=['driver_lat', 'driver_lng'])
-
-        if channel_layer:
-            payload = {
-                "type": "ride.driver.location",
-                "requestId": ride.id,
-                "lat": lat,
-                "lng": lng,
-                "leg": "to_pickup" if ride.status == "accepted" else "to_dropoff"
-            }
-            async_to_sync(channel_layer.group_send)(
-                user_room(ride.user_id),
-                {"type": "evt", "event": "ride.driver.location", "payload": payload},
-            )
+        if channel_layer and messages:
+            eventbus.send(channel_layer, messages)
         return Response({"ok": True})
 
     # ───────────────────────────────────────────────────────────
@@ -272,10 +294,7 @@ class RideViewSet(viewsets.ModelViewSet):
 
         if channel_layer and ride.driver_id:
             payload = {"type": "ride.rider.location", "requestId": ride.id, "lat": lat, "lng": lng}
-            async_to_sync(channel_layer.group_send)(
-                driver_room(ride.driver_id),
-                {"type": "evt", "event": "ride.rider.location", "payload": payload},
-            )
+            eventbus.publish(channel_layer, "ride.rider.location", payload, [driver_room(ride.driver_id)])
         return Response({"ok": True})
 
     # ───────────────────────────────────────────────────────────
@@ -297,18 +316,23 @@ class RideViewSet(viewsets.ModelViewSet):
             raw_al = request.headers.get("Accept-Language", "fr")
             lang = (raw_al.split(",")[0].strip()[:5] or "fr") if raw_al else "fr"
 
+            # libellés bruts : aucun géocodage réseau pendant la transaction
             payload = build_ride_offer_payload(
                 ride,
                 category=category,
                 area=area,
                 language=lang,
+                enrich=False,
             )
-            room = pool_room(category, area)  # ex: "pool.eco.city-default"
-            async_to_sync(channel_layer.group_send)(
-                room,
-                {"type": "ride.requested", "ride": payload}
-            )
-            logger.info("[WS] sent ride.requested → group=%s ride_id=%s", room, ride.id)
+
+            def _offer():
+                groups = offer_ride(channel_layer, ride, payload, category, area)
+                logger.info("[WS] sent ride.requested → groups=%s ride_id=%s", groups, ride.id)
+                # enrichissement (plus codes, "Votre position actuelle"…) → ride.updated
+                submit(enrich_ride_offer, channel_layer, ride.id, category, area, lang)
+
+            # offre diffusée seulement une fois la course commitée (pas d’envoi réseau dans la transaction)
+            transaction.on_commit(_offer)
 
         return Response(RideSerializer(ride).data, status=status.HTTP_201_CREATED)
 
@@ -319,78 +343,39 @@ class RideViewSet(viewsets.ModelViewSet):
     # ───────────────────────────────────────────────────────────
     # ACCEPT → MAJ DB + push ride.accepted au client
     # ───────────────────────────────────────────────────────────
-    @transaction.atomic
     @action(detail=True, methods=["post"], url_path="accept")
     def accept(self, request, pk=None):
-        ride = get_object_or_404(Ride.objects.select_for_update(), pk=pk)
-
-        if ride.status != "pending":
-            return Response({"detail": f"Already {ride.status}"}, status=409)
+        ride_id = _ride_pk(pk)
+        # Arbitrage en cache (SET NX) : les perdants sont rejetés sans requête DB
+        if not claim_ride(ride_id, request.user.id):
+            return Response({"detail": "Already accepted"}, status=409)
 
-        # Chauffeur authentifié
-        ride.driver = request.user
-        ride.status = "accepted"
-        if hasattr(ride, "accepted_at"):
-            ride.accepted_at = timezone.now()
-            ride.save(update_fields=["driver", "status", "accepted_at"])
-        else:
-            ride.save(update_fields=["driver", "status"])
-
-        # WS → informer le client
-        if channel_layer:
-            try:
-                client_group = user_room(ride.user_id)
-                alt_group    = f"user.{ride.user_id}"
-                payload = {
-                    "requestId": ride.id,
-                    "driver": {
-                        "id": ride.driver_id,
-                        "email": getattr(ride.driver, "email", None),
-                        "phone_number": getattr(ride.driver, "phone_number", None),
-                    },
-                    "ride": {
-                        "id": ride.id,
-                        "pickup": {
-                            "label": ride.pickup_location,
-                            "lat": getattr(ride, "pickup_lat", None),
-                            "lng": getattr(ride, "pickup_lng", None),
-                        },
-                        "dropoff": {
-                            "label": ride.dropoff_location,
-                            "lat": getattr(ride, "dropoff_lat", None),
-                            "lng": getattr(ride, "dropoff_lng", None),
-                        },
-                        "price": str(ride.price),
-                        "status": ride.status,
-
-                        # ✅ ajouts lisibles pour le client aussi
-                        "pickup_label": (ride.pickup_location or None),
-                        "dropoff_label": (ride.dropoff_location or None),
-                        "price_text": f"{int(ride.price)} FCFA" if ride.price is not None else "—",
-                    },
-                }
-                # 1) Format générique (relay via AppConsumer.evt → {event, payload})
-                evt_msg = {"type": "evt", "event": "ride.accepted", "payload": payload}
-                async_to_sync(channel_layer.group_send)(client_group, evt_msg)
-                async_to_sync(channel_layer.group_send)(alt_group,    evt_msg)
-
-                # 2) Format direct (certains front écoutent msg.type)
-                direct_msg = {
-                    "type": "ride.accepted",
-                    "requestId": ride.id,
-                    "driver": payload["driver"],
-                    "ride": payload["ride"],
-                }
-                async_to_sync(channel_layer.group_send)(client_group, direct_msg)
-                async_to_sync(channel_layer.group_send)(alt_group,    direct_msg)
-                # (facultatif) notifier aussi le chauffeur affecté (canal privé)
-                async_to_sync(channel_layer.group_send)(
-                    driver_room(ride.driver_id),
-                    {"type": "evt", "event": "ride.assigned", "payload": {"requestId": ride.id}},
-                )
-                logger.info("[WS] accept: notified %s & %s ride_id=%s", client_group, alt_group, ride.id)
-            except Exception:
-                logger.exception("WS emit (accept) failed")
+        # claim libéré sur toute autre issue que le succès (404, 409, erreur)
+        accepted = False
+        try:
+            with transaction.atomic():
+                ride = get_object_or_404(Ride.objects.select_for_update(), pk=ride_id)
+
+                if ride.status != "pending":
+                    return Response({"detail": f"Already {ride.status}"}, status=409)
+
+                # Chauffeur authentifié
+                ride.driver = request.user
+                ride.status = "accepted"
+                if hasattr(ride, "accepted_at"):
+                    ride.accepted_at = timezone.now()
+                    ride.save(update_fields=["driver", "status", "accepted_at"])
+                else:
+                    ride.save(update_fields=["driver", "status"])
+                # WS → informer le client (outbox : diffusé après commit)
+                outbox.record(ride_accepted_messages(ride))
+            accepted = True
+        finally:
+            if not accepted:
+                release_ride_claim(ride_id, request.user.id)
+        stop_dispatch(ride.id)
+        mark_busy(request.user.id)  # plus proposé aux nouvelles courses jusqu’à la fin de celle-ci
+        logger.info("[WS] accept: queued ride.accepted for user.%s ride_id=%s", ride.user_id, ride.id)
 
         return Response({"ok": True})
     
@@ -419,8 +404,8 @@ class RideViewSet(viewsets.ModelViewSet):
                 "at": ride.pause_started_at.isoformat(),
                 "freeRemaining": max(0, getattr(settings,"PAUSE_FREE_SECONDS",300) - (ride.total_pause_seconds or 0)),
             }
-            for g in {user_room(ride.user_id), f"user.{ride.user_id}", driver_room(ride.driver_id)}:
-                async_to_sync(channel_layer.group_send)(g, {"type":"evt","event":"ride.pause.started","payload":payload})
+            eventbus.publish(channel_layer, "ride.pause.started", payload,
+                             [user_room(ride.user_id), driver_room(ride.driver_id)])
             
         return Response({"ok": True, "pause_active": True, "total_pause_s": ride.total_pause_seconds, "pause_fee": int(ride.pause_fee)}, status=200)
     
@@ -457,9 +442,11 @@ class RideViewSet(viewsets.ModelViewSet):
                 "pause_fee": int(ride.pause_fee),
                 "final_price": str(ride.final_price or base),
             }
-            for g in {user_room(ride.user_id), f"user.{ride.user_id}", driver_room(ride.driver_id)}:
-                async_to_sync(channel_layer.group_send)(g, {"type":"evt","event":"ride.pause.stopped","payload":payload})
-                async_to_sync(channel_layer.group_send)(g, {"type":"evt","event":"ride.fare.updated","payload":payload})
+            audiences = [user_room(ride.user_id), driver_room(ride.driver_id)]
+            eventbus.send(channel_layer, [
+                *eventbus.messages("ride.pause.stopped", payload, audiences),
+                *eventbus.messages("ride.fare.updated", payload, audiences),
+            ])
 
         return Response({"ok": True, "pause_active": False,
                          "total_pause_s": ride.total_pause_seconds,
@@ -482,12 +469,16 @@ class RideViewSet(viewsets.ModelViewSet):
         if ride.status in {"cancelled", "completed", "finished"}:
             return Response({"id": ride.id, "status": ride.status}, status=200)
 
+        last = flush_ride(ride.id)
         ride.status = "cancelled"
         if hasattr(ride, "cancelled_at"):
             ride.cancelled_at = timezone.now()
             ride.save(update_fields=["status", "cancelled_at"])
         else:
             ride.save(update_fields=["status"])
+        stop_dispatch(ride.id)
+        if ride.driver_id:
+            transaction.on_commit(lambda: _release_driver(ride, last))
 
         if channel_layer:
             try:
@@ -502,17 +493,10 @@ class RideViewSet(viewsets.ModelViewSet):
                     d = getattr(ride, "driver", None)
                     driver_ws_id = getattr(d, "user_id", None)
                     if driver_ws_id:
-                        driver_groups.add(f"user.{driver_ws_id}")
+                        driver_groups.add(user_room(driver_ws_id))
 
-                async_to_sync(channel_layer.group_send)(
-                    client_group,
-                    {"type": "evt", "event": "ride.cancelled", "payload": payload},
-                )
-                for g in driver_groups:
-                    async_to_sync(channel_layer.group_send)(
-                        g,
-                        {"type": "evt", "event": "ride.cancelled", "payload": payload},
-                    )
+                # outbox : diffusé après commit (rien ne part si la transaction est annulée)
+                outbox.record(eventbus.messages("ride.cancelled", payload, [client_group, *driver_groups]))
                 logger.info(
                     "[WS] cancel: notified user.%s & driver.%s ride_id=%s",
                     ride.user_id,
@@ -533,6 +517,8 @@ class RideViewSet(viewsets.ModelViewSet):
         if ride.driver_id != request.user.id:
             return Response({"detail": "Forbidden"}, status=403)
         
+        flush_ride(ride.id)
+
         # Optionnel: logguer l’heure d’arrivée si le champ existe
         if hasattr(ride, "arrived_at") and not ride.arrived_at:
             ride.arrived_at = timezone.now()
@@ -540,27 +526,19 @@ class RideViewSet(viewsets.ModelViewSet):
 
         ch = get_channel_layer()
         if ch:
-            groups = {user_room(ride.user_id), f"user.{ride.user_id}"}
             payload = {
                 "requestId": ride.id,
                 "driver": {"id": ride.driver_id},
                 "grace": 300,  # 5 minutes
                 "at": timezone.now().isoformat(),
             }
-            for g in groups:
-                # format générique
-                async_to_sync(ch.group_send)(g, {
-                    "type": "evt",
-                    "event": "ride.arrived",
-                    "payload": payload,
-                })
-                # format direct (compat)
-                async_to_sync(ch.group_send)(g, {
-                    "type": "ride.arrived",
-                    "requestId": ride.id,
-                    "driverId": ride.driver_id,
-                    "grace": 300,
-                })
+            # format générique (+ format direct pour les sockets v1)
+            eventbus.publish(ch, "ride.arrived", payload, [user_room(ride.user_id)], compat={
+                "type": "ride.arrived",
+                "requestId": ride.id,
+                "driverId": ride.driver_id,
+                "grace": 300,
+            })
         logger.info("[ARRIVED] ride_id=%s by driver_id=%s -> broadcasting to user.%s",
             ride.id, ride.driver_id, ride.user_id)
         return Response({"ok": True})
@@ -585,11 +563,11 @@ class RideViewSet(viewsets.ModelViewSet):
                     "at": timezone.now().isoformat(),
                     "stopCountdown": True,  # hint explicite pour le front
                 }
-                for g in {user_room(ride.user_id), f"user.{ride.user_id}"}:
-                    async_to_sync(ch.group_send)(g, {"type": "evt", "event": "ride.started", "payload": payload})
-                    async_to_sync(ch.group_send)(g, {"type": "ride.started", "requestId": ride.id, "driverId": ride.driver_id})
+                eventbus.publish(ch, "ride.started", payload, [user_room(ride.user_id)],
+                                 compat={"type": "ride.started", "requestId": ride.id, "driverId": ride.driver_id})
             return Response({"ok": True, "status": "in_progress"})
         
+        flush_ride(ride.id)
         ride.status = "in_progress"
         update_fields = ["status"]
         if hasattr(ride, "started_at") and not ride.started_at:
@@ -597,10 +575,9 @@ class RideViewSet(viewsets.ModelViewSet):
             update_fields.append("started_at")
         ride.save(update_fields=update_fields)
 
-        # push WS au client (2 formats + 2 groupes)
+        # push WS au client (format générique + format direct pour les sockets v1)
         ch = get_channel_layer()
         if ch:
-            groups = {user_room(ride.user_id), f"user.{ride.user_id}"}
             payload = {
                 "requestId": ride.id,
                 "driver": {
@@ -610,19 +587,8 @@ class RideViewSet(viewsets.ModelViewSet):
                 "at": timezone.now().isoformat(),
                 "stopCountdown": True,
             }
-            for g in groups:
-                # format générique
-                async_to_sync(ch.group_send)(g, {
-                    "type": "evt",
-                    "event": "ride.started",
-                    "payload": payload,
-                })
-                # format direct (compat)
-                async_to_sync(ch.group_send)(g, {
-                    "type": "ride.started",
-                    "requestId": ride.id,
-                    "driverId": ride.driver_id,
-                })
+            eventbus.publish(ch, "ride.started", payload, [user_room(ride.user_id)],
+                             compat={"type": "ride.started", "requestId": ride.id, "driverId": ride.driver_id})
         return Response({"ok": True, "status": "in_progress"})
 
     @action(detail=True, methods=["post"], url_path="finish")
@@ -642,13 +608,21 @@ class RideViewSet(viewsets.ModelViewSet):
         base = Decimal(ride.price or 0)
         ride.final_price = base + ride.pause_fee
 
+        last = flush_ride(ride.id)
+        trace, _ = persist_trace(ride.id)
+        if trace is not None:
+            km, moving_s = measure_blob(trace.data)
+            ride.measured_distance_km = round(km, 3)
+            ride.measured_duration_s = int(moving_s)
         ride.status = "completed"
         ride.completed_at = timezone.now()
         ride.save(update_fields=[
             "status", "completed_at",
             "pause_started_at", "total_pause_seconds",
-            "pause_fee", "final_price"
+            "pause_fee", "final_price",
+            "measured_distance_km", "measured_duration_s",
         ])
+        _release_driver(ride, last)
 
         if not _has_success_payment(ride):
             Payment.objects.get_or_create(
@@ -670,24 +644,40 @@ class RideViewSet(viewsets.ModelViewSet):
                 "base_price": str(base),
                 "pause_fee": int(ride.pause_fee),
                 "total_pause_s": total_pause_s,
+                "measured_distance_km": ride.measured_distance_km,
             }
-            async_to_sync(channel_layer.group_send)(
+            eventbus.publish(channel_layer, "ride.finished", payload, [
                 user_room(ride.user_id),
-                {"type": "evt", "event": "ride.finished", "payload": payload},
-            )
-            if ride.driver_id:
-                async_to_sync(channel_layer.group_send)(
-                    driver_room(ride.driver_id),
-                    {"type": "evt", "event": "ride.finished", "payload": payload},
-                )
+                driver_room(ride.driver_id) if ride.driver_id else None,
+            ])
         return Response({
             "ok": True,
             "final_price": str(ride.final_price),
             "base_price": str(base),
             "pause_fee": int(ride.pause_fee),
             "total_pause_s": total_pause_s,
+            "measured_distance_km": ride.measured_distance_km,
+            "measured_duration_s": ride.measured_duration_s,
         })
     
+    # ───────────────────────────────────────────────────────────
+    # TRACE GPS: persistée à finish, en cours sinon
+    # ───────────────────────────────────────────────────────────
+    @action(detail=True, methods=["get"], url_path="trace")
+    def trace(self, request, pk=None):
+        ride = get_object_or_404(Ride, pk=pk)
+        user = request.user
+        if not (user.is_staff or ride.user_id == user.id or ride.driver_id == user.id):
+            return Response({"detail": "Forbidden"}, status=status.HTTP_403_FORBIDDEN)
+
+        points = load_trace(ride.id)
+        return Response({
+            "rideId": ride.id,
+            "status": ride.status,
+            "count": len(points),
+            "points": [{"lat": lat, "lng": lng, "t": t_ms} for lat, lng, t_ms in points],
+        })
+
     @action(detail=True, methods=["get"], url_path="contact")
     def contact(self, request, pk=None):
         ride = get_object_or_404(Ride, pk=pk)
@@ -785,14 +775,7 @@ class RideViewSet(viewsets.ModelViewSet):
         return Response({'ok': True, 'rating': stars, 'rating_avg': round(new_avg, 2)}, status=200)
     
     def _driver_is_offline(self, driver_id: int, timeout_s: int = 30) -> bool:
-        pres = DriverPresence.objects.filter(driver_id=driver_id).first()
-        if not pres:
-            return True
-        if not pres.is_online:
-            return True
-        if not pres.last_seen:
-            return True
-        return (timezone.now() - pres.last_seen).total_seconds() > timeout_s
+        return not PRESENCE.is_online(driver_id, timeout_s=timeout_s)
     
     @action(
         detail=True,
@@ -836,19 +819,13 @@ class RideViewSet(viewsets.ModelViewSet):
 
             ride.completed_at = timezone.now()
             ride.save(update_fields=["status", "completed_at"])
+        mark_free(ride.driver_id)  # chauffeur hors ligne : réindexé à son prochain ping
 
         try:
             from channels.layers import get_channel_layer
-            from asgiref.sync import async_to_sync
             ch = get_channel_layer()
-            async_to_sync(ch.group_send)(
-                f"user.{ride.user_id}",
-                {
-                    "type": "evt",
-                    "event": "ride.completed",
-                    "payload": {"rideId": ride.id, "reason": "system_fail_safe"},
-                },
-            )
+            eventbus.publish(ch, "ride.completed", {"rideId": ride.id, "reason": "system_fail_safe"},
+                             [user_room(ride.user_id)])
         except Exception:
             pass
 
@@ -906,26 +883,31 @@ class DriverRideLocationView(APIView):
     permission_classes = [permissions.IsAuthenticated, IsDriver]
 
     def post(self, request, pk):
-        ride = get_object_or_404(Ride, pk=pk)
-
         serializer = DriverLocationSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         lat = serializer.validated_data['lat']
         lng = serializer.validated_data['lng']
 
-        # block si course finie/annulée
-        if ride.status in {"cancelled", "completed", "finished"}:
-            logger.info("[LOC] reject (legacy) ride_id=%s status=%s", ride.id, ride.status)
+        # même chemin que RideViewSet.location : contrôle d’appartenance, trace,
+        # write-behind et diffusion au client (filtrée par RELAY_FILTER)
+        ride_id = _ride_pk(pk)
+        try:
+            messages = publish_driver_location(ride_id, request.user.id, lat, lng)
+        except LocationRejected as e:
+            if e.reason == "not_found":
+                raise Http404
+            if e.reason == "forbidden":
+                return Response({"detail": "Forbidden"}, status=status.HTTP_403_FORBIDDEN)
+            # block si course finie/annulée
             resp = Response(
-                {"ok": False, "reason": "ride_ended", "ride_status": ride.status, "ride_id": ride.id},
+                {"ok": False, "reason": "ride_ended", "ride_status": e.status, "ride_id": ride_id},
                 status=status.HTTP_410_GONE,
             )
             resp["X-Ride-Ended"] = "1"
             return resp
 
-        ride.driver_lat = lat
-        ride.driver_lng = lng
-        ride.save(update_fields=['driver_lat', 'driver_lng'])
+        if channel_layer and messages:
+            eventbus.send(channel_layer, messages)
         return Response({"ok": True})
     
 # views.py (extraits)
@@ -1137,7 +1119,7 @@ class DriverMeView(APIView):
             "phone": getattr(user, "phone_number", "") or "",
             "photo_url": None,                # remplis si tu as un champ photo
             "category": None,                 # remplis si tu stockes la catégorie
-            "is_online": False,               # branche sur ton statut de présence chauffeur
+            "is_online": PRESENCE.is_online(user.id),
             "rating_avg": rating_avg,
             "rating_count": rating_count,
             "rides_done": rides_done,
@@ -0,0 +1,116 @@
+# blaze_backend/background.py
+"""
+Petites tâches de fond in-process (pas de Celery sur ce projet).
+
+  - submit(fn, ...)          → exécute tout de suite dans un pool de threads
+  - schedule(delay, fn, ...) → exécute après `delay` secondes (un seul thread
+    minuterie pour tout le process : tas des échéances, la tâche part dans le pool)
+  - every(name, interval, fn) → boucle périodique (1 thread daemon par nom, idempotent)
+
+Les connexions DB sont recyclées autour de chaque tâche (comme une requête).
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(getattr(settings, "BACKGROUND_MAX_WORKERS", 8)),
+    thread_name_prefix="blaze-bg",
+)
+
+
+def _run(fn, *args, **kwargs):
+    close_old_connections()
+    try:
+        return fn(*args, **kwargs)
+    except Exception:
+        logger.exception("[BG] task %s failed", getattr(fn, "__name__", fn))
+        raise
+    finally:
+        close_old_connections()
+
+
+def submit(fn, *args, **kwargs) -> Future:
+    return _EXECUTOR.submit(_run, fn, *args, **kwargs)
+
+
+class Scheduled:
+    """Tâche programmée ; cancel() avant l’échéance → jamais exécutée."""
+    __slots__ = ("fn", "args", "kwargs", "cancelled")
+
+    def __init__(self, fn, args, kwargs):
+        self.fn, self.args, self.kwargs = fn, args, kwargs
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+
+class _Timers:
+    """Tas (échéance, n°, tâche) servi par un seul thread daemon, démarré au premier schedule()."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._heap: list = []
+        self._seq = itertools.count()
+        self._thread = None
+
+    def add(self, delay: float, task: Scheduled) -> None:
+        with self._cond:
+            heapq.heappush(self._heap, (time.monotonic() + max(0.0, float(delay)), next(self._seq), task))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="blaze-timers", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    self._cond.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+                _, _, task = heapq.heappop(self._heap)
+            if not task.cancelled:
+                try:
+                    submit(task.fn, *task.args, **task.kwargs)
+                except RuntimeError:
+                    return  # pool arrêté (fin du process)
+
+
+_TIMERS = _Timers()
+
+
+def schedule(delay: float, fn, *args, **kwargs) -> Scheduled:
+    task = Scheduled(fn, args, kwargs)
+    _TIMERS.add(delay, task)
+    return task
+
+
+_PERIODIC: dict[str, threading.Thread] = {}
+_PERIODIC_LOCK = threading.Lock()
+
+
+def every(name: str, interval: float, fn) -> None:
+    """Démarre (une seule fois par process) une boucle qui appelle fn() toutes les `interval` s."""
+    with _PERIODIC_LOCK:
+        if name in _PERIODIC:
+            return
+
+        def _loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    _run(fn)
+                except Exception:
+                    pass  # déjà loggé par _run
+
+        t = threading.Thread(target=_loop, name=f"blaze-{name}", daemon=True)
+        _PERIODIC[name] = t
+        t.start()
@@ -3,6 +3,11 @@ from django.db import connection
 from django.conf import settings
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import get_user_model
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+
+from . import metrics
 
 def healthz(_request):
     return JsonResponse({"status": "ok"}, status=200)
@@ -49,4 +54,11 @@ def healthz_full(_request):
     checks["google_maps_key_present"] = bool(getattr(settings, "GOOGLE_MAPS_API_KEY", ""))
 
     status = 200 if all(v in (True, "no-user") for v in checks.values() if not isinstance(v, str)) else 503
-    return JsonResponse(checks, status=status)
\ No newline at end of file
+    return JsonResponse(checks, status=status)
+
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def metricsz(_request):
+    """Compteurs du worker courant (staff uniquement)."""
+    return Response(metrics.snapshot())
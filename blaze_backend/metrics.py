@@ -0,0 +1,82 @@
+# blaze_backend/metrics.py
+"""
+Compteurs et histogrammes in-process (par worker) exposés par /api/metricsz (staff).
+
+  - incr("geocache.rev.l1_hit")
+  - gauge("outbound.google.inflight", +1 / -1)
+  - observe("geocode.rev.google.ms", 182.0)   (buckets en ms)
+  - with timed("geocode.rev.google.ms"): ...
+  - snapshot() → {"counters": {...}, "gauges": {...}, "histograms": {...}}
+
+Volontairement minimal : pas de dépendance Prometheus sur ce projet.
+"""
+import bisect
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, List
+
+_LOCK = threading.Lock()
+_COUNTERS: Dict[str, int] = defaultdict(int)
+_GAUGES: Dict[str, float] = defaultdict(float)
+
+# bornes supérieures des buckets (ms) ; le dernier bucket = +inf
+BUCKETS_MS = (25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class _Histogram:
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self):
+        self.counts: List[int] = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def as_dict(self) -> dict:
+        labels = [f"le_{b}" for b in BUCKETS_MS] + ["le_inf"]
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 3),
+            "avg": round(self.sum / self.count, 3) if self.count else None,
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+_HISTOGRAMS: Dict[str, _Histogram] = defaultdict(_Histogram)
+
+
+def incr(name: str, n: int = 1) -> None:
+    with _LOCK:
+        _COUNTERS[name] += n
+
+
+def gauge(name: str, delta: float) -> None:
+    with _LOCK:
+        _GAUGES[name] += delta
+
+
+def observe(name: str, value_ms: float) -> None:
+    with _LOCK:
+        h = _HISTOGRAMS[name]
+        h.counts[bisect.bisect_left(BUCKETS_MS, value_ms)] += 1
+        h.count += 1
+        h.sum += value_ms
+
+
+@contextmanager
+def timed(name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, (time.perf_counter() - t0) * 1000.0)
+
+
+def snapshot() -> dict:
+    with _LOCK:
+        return {
+            "counters": dict(sorted(_COUNTERS.items())),
+            "gauges": dict(sorted(_GAUGES.items())),
+            "histograms": {k: h.as_dict() for k, h in sorted(_HISTOGRAMS.items())},
+        }
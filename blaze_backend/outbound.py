@@ -0,0 +1,211 @@
+# blaze_backend/outbound.py
+"""
+Client HTTP sortant partagé : une requests.Session par intégration.
+
+  - pool keep-alive par hôte (HTTPAdapter) → plus de handshake TCP/TLS à chaque appel
+  - timeout (connect, read) et budget de retries propres à chaque intégration
+  - métriques : outbound.<nom>.inflight / .pool_maxsize (gauges), .ms (latence),
+    .errors, .status.<code>
+
+    from blaze_backend import outbound
+    r = outbound.get("google", url, params=...)
+
+Version async (vues ASGI) : `await outbound.aget("google_maps", url, params=...)`
+→ httpx.AsyncClient partagé (pool de connexions) + sémaphore de concurrence par
+intégration ("concurrency"). Sans httpx (optionnel), repli sur la session sync
+exécutée hors de la boucle. Les clients sont propres à la boucle d’événements et
+fermés (aclose) à son arrêt : asyncio.run → loop.shutdown_asyncgens(), ce que font
+uvicorn et async_to_sync (vues async sous WSGI, une boucle par requête).
+
+Réglages surchargeables via settings.OUTBOUND = {"google": {"retries": 2}, ...}.
+"""
+import asyncio
+import logging
+import threading
+import weakref
+from typing import Dict
+
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import metrics
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover - httpx optionnel
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+# timeout = (connect_s, read_s) ; retries = budget total (connexion + 5xx idempotents)
+_DEFAULTS: Dict[str, dict] = {
+    "google":      {"timeout": (3, 6),  "retries": 1, "pool": 20},
+    "google_maps": {"timeout": (3, 15), "retries": 1, "pool": 20, "concurrency": 64},   # mapsproxy
+    "nominatim":   {"timeout": (3, 7),  "retries": 1, "pool": 4},
+    "fcm":         {"timeout": (3, 15), "retries": 2, "pool": 10},
+    # paiements : jamais de re-POST automatique (risque de double débit)
+    "airtel":      {"timeout": (5, 45), "retries": 0, "pool": 4},
+}
+
+_LOCK = threading.Lock()
+_SESSIONS: Dict[str, requests.Session] = {}
+
+
+def _config(name: str) -> dict:
+    cfg = dict(_DEFAULTS.get(name, {"timeout": (3, 10), "retries": 1, "pool": 10}))
+    cfg.update((getattr(settings, "OUTBOUND", {}) or {}).get(name, {}))
+    return cfg
+
+
+def _build_session(name: str) -> requests.Session:
+    cfg = _config(name)
+    n = int(cfg["retries"])
+    retry = Retry(
+        total=n,
+        connect=n,               # la requête n’est pas partie : toujours sûr
+        read=n,
+        status=n,
+        backoff_factor=0.2,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({"GET", "HEAD"}),  # read/status : idempotents seulement
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=int(cfg["pool"]), max_retries=retry)
+    s = requests.Session()
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    metrics.gauge(f"outbound.{name}.pool_maxsize", int(cfg["pool"]))
+    return s
+
+
+def session(name: str) -> requests.Session:
+    s = _SESSIONS.get(name)
+    if s is None:
+        with _LOCK:
+            s = _SESSIONS.get(name)
+            if s is None:
+                s = _SESSIONS[name] = _build_session(name)
+    return s
+
+
+def request(name: str, method: str, url: str, **kwargs) -> requests.Response:
+    kwargs.setdefault("timeout", tuple(_config(name)["timeout"]))
+    metrics.gauge(f"outbound.{name}.inflight", 1)
+    try:
+        with metrics.timed(f"outbound.{name}.ms"):
+            r = session(name).request(method, url, **kwargs)
+        metrics.incr(f"outbound.{name}.status.{r.status_code}")
+        return r
+    except requests.RequestException:
+        metrics.incr(f"outbound.{name}.errors")
+        raise
+    finally:
+        metrics.gauge(f"outbound.{name}.inflight", -1)
+
+
+def get(name: str, url: str, **kwargs) -> requests.Response:
+    return request(name, "GET", url, **kwargs)
+
+
+def post(name: str, url: str, **kwargs) -> requests.Response:
+    return request(name, "POST", url, **kwargs)
+
+
+# ─────────────────────────────────────────────────────────────
+# Async (httpx) : un client + des sémaphores par boucle d’événements
+# ─────────────────────────────────────────────────────────────
+class _LoopState:
+    def __init__(self):
+        self.clients: Dict[str, "httpx.AsyncClient"] = {}
+        self.semaphores: Dict[str, asyncio.Semaphore] = {}
+        self.closer = None  # générateur async finalisé à l’arrêt de la boucle
+
+
+_LOOPS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _LoopState]" = weakref.WeakKeyDictionary()
+
+
+def _loop_state() -> _LoopState:
+    loop = asyncio.get_running_loop()
+    st = _LOOPS.get(loop)
+    if st is None:
+        st = _LOOPS[loop] = _LoopState()
+    return st
+
+
+def _async_client(st: _LoopState, name: str) -> "httpx.AsyncClient":
+    client = st.clients.get(name)
+    if client is None:
+        cfg = _config(name)
+        connect, read = cfg["timeout"]
+        client = st.clients[name] = httpx.AsyncClient(
+            timeout=httpx.Timeout(read, connect=connect),
+            limits=httpx.Limits(max_connections=int(cfg["pool"]), max_keepalive_connections=int(cfg["pool"])),
+            # httpx ne re-tente que l’établissement de connexion (toujours sûr)
+            transport=httpx.AsyncHTTPTransport(retries=int(cfg["retries"])),
+        )
+    return client
+
+
+async def _close_on_shutdown(st: _LoopState):
+    """
+    Générateur jamais épuisé, enregistré auprès de la boucle au premier __anext__ :
+    loop.shutdown_asyncgens() le ferme → le finally ferme les clients de la boucle
+    (sockets keep-alive) avant que celle-ci ne disparaisse.
+    """
+    try:
+        yield
+    finally:
+        await _aclose_clients(st)
+
+
+async def _aclose_clients(st: _LoopState) -> None:
+    clients, st.clients = list(st.clients.values()), {}
+    for client in clients:
+        try:
+            await client.aclose()
+        except Exception:
+            logger.exception("outbound: échec de fermeture d’un client httpx")
+
+
+async def aclose() -> None:
+    """Ferme les clients httpx de la boucle courante (arrêt explicite, ex. lifespan ASGI)."""
+    st = _LOOPS.get(asyncio.get_running_loop())
+    if st is not None:
+        await _aclose_clients(st)
+
+
+def _semaphore(st: _LoopState, name: str) -> asyncio.Semaphore:
+    sem = st.semaphores.get(name)
+    if sem is None:
+        sem = st.semaphores[name] = asyncio.Semaphore(int(_config(name).get("concurrency", _config(name)["pool"])))
+    return sem
+
+
+async def arequest(name: str, method: str, url: str, **kwargs):
+    """Réponse httpx (ou requests en repli) : .status_code, .json()."""
+    if httpx is None:
+        return await sync_to_async(request, thread_sensitive=False)(name, method, url, **kwargs)
+
+    st = _loop_state()
+    if st.closer is None:
+        st.closer = _close_on_shutdown(st)
+        await st.closer.__anext__()
+    async with _semaphore(st, name):
+        metrics.gauge(f"outbound.{name}.inflight", 1)
+        try:
+            with metrics.timed(f"outbound.{name}.ms"):
+                r = await _async_client(st, name).request(method, url, **kwargs)
+            metrics.incr(f"outbound.{name}.status.{r.status_code}")
+            return r
+        except httpx.HTTPError:
+            metrics.incr(f"outbound.{name}.errors")
+            raise
+        finally:
+            metrics.gauge(f"outbound.{name}.inflight", -1)
+
+
+async def aget(name: str, url: str, **kwargs):
+    return await arequest(name, "GET", url, **kwargs)
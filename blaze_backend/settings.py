@@ -80,6 +80,19 @@ else:
         "default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}
     }
 
+# Cache partagé entre workers (présence, index spatial…) : Redis si dispo
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+    }
+
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
@@ -291,4 +304,110 @@ AIRTEL_MONEY = {
 PAUSE_FREE_SECONDS = 5 * 60
 PAUSE_RATE_PER_MIN = 250  # XAF
 
+# ─────────────────────────────────────────────
+# DISPATCH (index spatial des chauffeurs en ligne)
+# ─────────────────────────────────────────────
+GEOINDEX_CELL_DEG = env.float("GEOINDEX_CELL_DEG", default=0.01)   # ~1,1 km
+GEOINDEX_TTL_S = env.int("GEOINDEX_TTL_S", default=120)            # position périmée après 2 min
+GEOINDEX_BUSY_TTL_S = env.int("GEOINDEX_BUSY_TTL_S", default=14400) # marque "en course" (filet si la course ne se termine jamais)
+DISPATCH_NEAREST_K = env.int("DISPATCH_NEAREST_K", default=8)
+DISPATCH_RADIUS_KM = env.float("DISPATCH_RADIUS_KM", default=5.0)        # rayon max (dernière vague)
+
+# Dispatch par vagues : vague n → taille = FIRST_WAVE_SIZE * GROWTH^n, rayon = FIRST_WAVE_RADIUS_KM * GROWTH^n
+DISPATCH_WAVE_TTL_S = env.float("DISPATCH_WAVE_TTL_S", default=15)
+DISPATCH_FIRST_WAVE_SIZE = env.int("DISPATCH_FIRST_WAVE_SIZE", default=3)
+DISPATCH_FIRST_WAVE_RADIUS_KM = env.float("DISPATCH_FIRST_WAVE_RADIUS_KM", default=2.0)
+DISPATCH_WAVE_GROWTH = env.float("DISPATCH_WAVE_GROWTH", default=2.0)
+DISPATCH_MAX_WAVES = env.int("DISPATCH_MAX_WAVES", default=4)
+
+# Mode de dispatch : "waves" (défaut) ou "batch" (matching global périodique)
+DISPATCH_MODE = env("DISPATCH_MODE", default="waves")
+DISPATCH_BATCH_WINDOW_S = env.float("DISPATCH_BATCH_WINDOW_S", default=2.0)
+DISPATCH_BATCH_MAX_ROUNDS = env.int("DISPATCH_BATCH_MAX_ROUNDS", default=5)   # puis repli en vagues
+DISPATCH_BATCH_CANDIDATES = env.int("DISPATCH_BATCH_CANDIDATES", default=20)  # chauffeurs candidats / course
+
+# Arbitrage "premier qui accepte gagne" (SET NX ride:<id>:claim)
+RIDE_CLAIM_TTL_S = env.int("RIDE_CLAIM_TTL_S", default=120)
+
+# ─────────────────────────────────────────────
+# GÉOCODAGE (cache LRU local + cache Django partagé)
+# ─────────────────────────────────────────────
+GEOCODE_SNAP_DECIMALS = env.int("GEOCODE_SNAP_DECIMALS", default=4)       # 4 décimales ≈ 11 m
+GEOCODE_CACHE_TTL_S = env.int("GEOCODE_CACHE_TTL_S", default=86400)
+GEOCODE_NEGATIVE_TTL_S = env.int("GEOCODE_NEGATIVE_TTL_S", default=300)  # "pas d’adresse" : TTL court
+GEOCODE_L1_MAX = env.int("GEOCODE_L1_MAX", default=2048)                 # entrées par process
+PLUSCODE_DEFAULT_LOCALITY = env("PLUSCODE_DEFAULT_LOCALITY", default="libreville")  # codes courts sans ville
+GEOCODE_HEDGE_DELAY_S = env.float("GEOCODE_HEDGE_DELAY_S", default=0.3)  # < 0 → Google puis Nominatim en séquence
+GEOCODE_HEDGE_WORKERS = env.int("GEOCODE_HEDGE_WORKERS", default=8)
+
+# ─────────────────────────────────────────────
+# MAPSPROXY (cache des réponses Google)
+# ─────────────────────────────────────────────
+MAPSPROXY_COORD_DECIMALS = env.int("MAPSPROXY_COORD_DECIMALS", default=4)
+MAPSPROXY_STALE_RATIO = env.float("MAPSPROXY_STALE_RATIO", default=1.0)  # fenêtre "stale" = ratio × TTL
+MAPSPROXY_CACHE_TTL = {
+    "place_details": env.int("MAPSPROXY_TTL_PLACE_DETAILS_S", default=7 * 86400),
+    "geocode": env.int("MAPSPROXY_TTL_GEOCODE_S", default=86400),
+    "forward_geocode": env.int("MAPSPROXY_TTL_FORWARD_GEOCODE_S", default=86400),
+    "places": env.int("MAPSPROXY_TTL_PLACES_S", default=3600),
+    "directions": env.int("MAPSPROXY_TTL_DIRECTIONS_S", default=300),
+}
+# directions?slim=1&zoom=.. : polyline simplifiée à ~MAPSPROXY_SLIM_PX pixel près
+MAPSPROXY_SLIM_DEFAULT_ZOOM = env.float("MAPSPROXY_SLIM_DEFAULT_ZOOM", default=15)
+MAPSPROXY_SLIM_PX = env.float("MAPSPROXY_SLIM_PX", default=1.0)
+
+# ─────────────────────────────────────────────
+# ETA local (SpeedProfile, `manage.py rebuild_eta_model`)
+# ─────────────────────────────────────────────
+ETA_CELL_DEG = env.float("ETA_CELL_DEG", default=0.01)
+ETA_DETOUR_FACTOR = env.float("ETA_DETOUR_FACTOR", default=1.3)        # distance route ≈ haversine × facteur
+ETA_DEFAULT_SPEED_KMH = env.float("ETA_DEFAULT_SPEED_KMH", default=22.0)
+ETA_HISTORY_DAYS = env.int("ETA_HISTORY_DAYS", default=60)
+ETA_PRIOR_WEIGHT = env.float("ETA_PRIOR_WEIGHT", default=5.0)
+ETA_RELOAD_S = env.int("ETA_RELOAD_S", default=300)
+# coût du matching batch : "eta" (secondes estimées) ou "distance" (km)
+DISPATCH_BATCH_COST = env("DISPATCH_BATCH_COST", default="eta")
+
+# ─────────────────────────────────────────────
+# POSITIONS CHAUFFEUR (buffer write-behind)
+# ─────────────────────────────────────────────
+LOCATION_FLUSH_INTERVAL_S = env.float("LOCATION_FLUSH_INTERVAL_S", default=5.0)
+LOCATION_BUFFER_TTL_S = env.int("LOCATION_BUFFER_TTL_S", default=600)
+# horodatage client ("ts") d’un fix accepté dans [maintenant − PAST, maintenant + FUTURE], sinon heure serveur
+TRACE_MAX_PAST_S = env.int("TRACE_MAX_PAST_S", default=3600)       # lots renvoyés après une coupure réseau
+TRACE_MAX_FUTURE_S = env.int("TRACE_MAX_FUTURE_S", default=60)     # dérive d’horloge du téléphone
+# filtre de relais ride.driver.location (par course × chauffeur)
+LOCATION_RELAY_MIN_INTERVAL_MS = env.int("LOCATION_RELAY_MIN_INTERVAL_MS", default=1000)
+LOCATION_RELAY_MIN_DISTANCE_M = env.float("LOCATION_RELAY_MIN_DISTANCE_M", default=5.0)
+LOCATION_RELAY_MIN_HEADING_DEG = env.float("LOCATION_RELAY_MIN_HEADING_DEG", default=15.0)
+LOCATION_RELAY_MAX_SILENCE_MS = env.int("LOCATION_RELAY_MAX_SILENCE_MS", default=10000)  # relais forcé
 
+# ─────────────────────────────────────────────
+# MESURE DE COURSE (trace GPS → distance / temps en mouvement à finish)
+# ─────────────────────────────────────────────
+TRIP_MAX_SPEED_KMH = env.float("TRIP_MAX_SPEED_KMH", default=160.0)    # au-delà : saut GPS
+TRIP_MIN_MOVING_KMH = env.float("TRIP_MIN_MOVING_KMH", default=2.0)    # en dessous : à l’arrêt (bruit)
+
+# ─────────────────────────────────────────────
+# WEBSOCKETS (bus d’événements)
+# ─────────────────────────────────────────────
+# protocole par défaut si le client n’envoie pas ?proto= : 1 = générique + format direct, 2 = générique seul
+WS_PROTOCOL_DEFAULT = env.int("WS_PROTOCOL_DEFAULT", default=1)
+# outbox : événements enregistrés dans la transaction, relayés après commit (au moins une fois)
+OUTBOX_RELAY_INTERVAL_S = env.float("OUTBOX_RELAY_INTERVAL_S", default=5.0)
+OUTBOX_LEASE_S = env.float("OUTBOX_LEASE_S", default=30.0)        # délai avant re-livraison d’un envoi non confirmé
+OUTBOX_BATCH_SIZE = env.int("OUTBOX_BATCH_SIZE", default=500)
+OUTBOX_RETENTION_S = env.int("OUTBOX_RETENTION_S", default=86400)
+# relais périodique démarré sous daphne/uvicorn/gunicorn/hypercorn ou runserver uniquement
+# (False : `manage.py relay_outbox --loop` dans un worker dédié)
+OUTBOX_RELAY_AUTOSTART = env.bool("OUTBOX_RELAY_AUTOSTART", default=True)
+# registre des sockets chauffeur (cache) : TTL rafraîchi à chaque ping ; envoi direct aux driver.<id>
+DRIVER_SOCKET_TTL_S = env.int("DRIVER_SOCKET_TTL_S", default=120)
+DRIVER_SOCKET_DIRECT_SEND = env.bool("DRIVER_SOCKET_DIRECT_SEND", default=True)
+
+# ─────────────────────────────────────────────
+# PRÉSENCE CHAUFFEURS (RideVTC.presence)
+# ─────────────────────────────────────────────
+PRESENCE_TIMEOUT_S = env.float("PRESENCE_TIMEOUT_S", default=90.0)          # sans ping au-delà → hors ligne
+# pings en mémoire ; miroir cache + DriverPresence écrits en lot à chaque intervalle
+PRESENCE_FLUSH_INTERVAL_S = env.float("PRESENCE_FLUSH_INTERVAL_S", default=5.0)
@@ -24,7 +24,7 @@ from django.conf.urls.static import static
 from RideVTC.views import RideDetailView, RideViewSet, RideVehicleViewSet, DriverRideLocationView, DriverNavEventViewSet
 from rest_framework.routers import DefaultRouter
 from vehicles.views import VehicleViewSet, RentalPromoView
-from .health import healthz, readyz, healthz_full
+from .health import healthz, readyz, healthz_full, metricsz
 from analytics.views import AnalyticsViewSet
 from drivers.views import DriverDocsMeView, DriverEarningsSummary
 from notifications.views import RegisterDeviceView
@@ -44,6 +44,7 @@ urlpatterns = [
     re_path(r"^api/healthz/?$", healthz, name="api-healthz"),
     re_path(r"^api/readyz/?$", readyz, name="api-readyz"),
     re_path(r"^api/healthz/full/?$", healthz_full),
+    re_path(r"^api/metricsz/?$", metricsz, name="api-metricsz"),
     re_path(r"^api/driver/docs/?$", DriverDocsMeView.as_view()),
     re_path(r"^api/driver/earnings/summary/?$", DriverEarningsSummary.as_view()),
 
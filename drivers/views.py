@@ -29,6 +29,8 @@ from .serializers import (
     EarningSummarySerializer,
 )
 from RideVTC.models import Payment
+from RideVTC.utils.geoindex import update_driver_location, remove_driver
+from RideVTC.presence import PRESENCE
 from RideVTC.permissions import CanViewDriverProfile
 import datetime
 import logging, uuid
@@ -436,13 +438,23 @@ class DriverPresenceView(APIView):
         lat = ser.validated_data.get("lat")
         lng = ser.validated_data.get("lng")
 
-        driver.is_online = online
+        # is_online n’est pas écrit ici : PRESENCE est la seule source (Driver.is_online recopié au flush)
         if lat is not None and lng is not None:
             driver.last_latitude = lat
             driver.last_longitude = lng
-        driver.save()
+            driver.save(update_fields=["last_latitude", "last_longitude"])
+
+        # index spatial (dispatch au plus proche) : driver_room = user.id
+        if online:
+            update_driver_location(
+                request.user.id, driver.last_latitude, driver.last_longitude, category=driver.category,
+            )
+            PRESENCE.touch(request.user.id, category=driver.category)
+        else:
+            remove_driver(request.user.id)
+            PRESENCE.go_offline(request.user.id)
 
-        return Response({"detail": "Présence mise à jour.", "online": driver.is_online})
+        return Response({"detail": "Présence mise à jour.", "online": PRESENCE.is_online(request.user.id)})
 
 
 class MockRideRequestView(APIView):
@@ -458,7 +470,7 @@ class MockRideRequestView(APIView):
         except Driver.DoesNotExist:
             return Response({"detail": "Pas de profil chauffeur."}, status=404)
 
-        if not driver.is_online:
+        if not PRESENCE.is_online(request.user.id):
             return Response({"ok": False, "message": "Vous êtes hors-ligne."}, status=200)
 
         # Ici on pourrait filtrer par driver.category, distance, etc.
@@ -0,0 +1,131 @@
+# mapsproxy/cache.py
+"""
+Cache des réponses Google Maps relayées par mapsproxy.
+
+  - clé = endpoint + paramètres normalisés (coords arrondies ; texte libre
+    input/address/query en minuscules, espaces réduits ; autres valeurs — place_id,
+    sessiontoken… — inchangées, sensibles à la casse ; clé API exclue) ;
+  - TTL par endpoint (MAPSPROXY_CACHE_TTL) : long pour place_details, court pour directions ;
+  - stale-while-revalidate : pendant MAPSPROXY_STALE_RATIO × TTL après expiration,
+    on sert la réponse périmée et on la rafraîchit en tâche de fond ;
+  - seules les réponses HTTP 200 avec status Google "OK" sont mises en cache.
+
+Statut renvoyé dans l’en-tête X-Cache : HIT | STALE | MISS.
+"""
+import hashlib
+import json
+import logging
+import re
+import time
+from typing import Awaitable, Callable, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from blaze_backend import metrics
+from blaze_backend.background import submit
+
+logger = logging.getLogger(__name__)
+
+_DEFAULT_TTL_S = {
+    "place_details": 7 * 86400,
+    "geocode": 86400,
+    "forward_geocode": 86400,
+    "places": 3600,
+    "directions": 300,
+}
+
+_FREE_TEXT_PARAMS = frozenset({"input", "address", "query"})
+
+_LATLNG_RE = re.compile(r"^\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*$")
+
+Fetched = Tuple[int, object]   # (status HTTP, corps JSON)
+
+
+def ttl_for(endpoint: str) -> int:
+    overrides = getattr(settings, "MAPSPROXY_CACHE_TTL", {}) or {}
+    return int(overrides.get(endpoint, _DEFAULT_TTL_S.get(endpoint, 0)))
+
+
+def _stale_s(ttl: int) -> int:
+    return int(ttl * float(getattr(settings, "MAPSPROXY_STALE_RATIO", 1.0)))
+
+
+def _normalize_value(name: str, v: str) -> str:
+    m = _LATLNG_RE.match(v or "")
+    if m:
+        nd = int(getattr(settings, "MAPSPROXY_COORD_DECIMALS", 4))
+        return f"{round(float(m.group(1)), nd)},{round(float(m.group(2)), nd)}"
+    if name in _FREE_TEXT_PARAMS:
+        return " ".join((v or "").lower().split())
+    return v or ""
+
+
+def cache_key(endpoint: str, params: dict) -> str:
+    norm = sorted((k, _normalize_value(k, str(v))) for k, v in params.items() if k != "key" and v is not None)
+    digest = hashlib.sha1(json.dumps(norm, ensure_ascii=False).encode("utf-8")).hexdigest()
+    return f"maps:{endpoint}:{digest}"
+
+
+def _cacheable(status: int, body) -> bool:
+    return status == 200 and isinstance(body, dict) and body.get("status") == "OK"
+
+
+def _store(key: str, ttl: int, status: int, body) -> None:
+    if not _cacheable(status, body):
+        return
+    try:
+        cache.set(key, (time.time() + ttl, status, body), timeout=ttl + _stale_s(ttl))
+    except Exception as e:
+        logger.warning("[MAPS] cache write failed: %s", e)
+
+
+def _revalidate(key: str, ttl: int, fetch: Callable[[], Fetched]) -> None:
+    try:
+        status, body = fetch()
+        _store(key, ttl, status, body)
+    finally:
+        cache.delete(f"{key}:lock")
+
+
+def lookup(endpoint: str, params: dict) -> Tuple[Optional[str], Optional[Fetched], str, int]:
+    """(clé, réponse en cache ou None, état HIT|STALE|MISS, ttl)."""
+    ttl = ttl_for(endpoint)
+    if ttl <= 0:
+        return None, None, "MISS", ttl
+    key = cache_key(endpoint, params)
+    try:
+        rec = cache.get(key)
+    except Exception as e:
+        logger.warning("[MAPS] cache read failed: %s", e)
+        rec = None
+    if rec is None:
+        metrics.incr(f"mapsproxy.{endpoint}.miss")
+        return key, None, "MISS", ttl
+    fresh_until, status, body = rec
+    state = "HIT" if time.time() < fresh_until else "STALE"
+    metrics.incr(f"mapsproxy.{endpoint}.{state.lower()}")
+    return key, (status, body), state, ttl
+
+
+async def acached_fetch(
+    endpoint: str,
+    params: dict,
+    afetch: Callable[[], Awaitable[Fetched]],
+    fetch: Callable[[], Fetched],
+) -> Tuple[Fetched, str]:
+    """
+    Sert depuis le cache si possible ; sinon attend afetch() et mémorise la réponse.
+    fetch (sync) sert au rafraîchissement en tâche de fond des entrées STALE
+    (un seul à la fois grâce au verrou <clé>:lock).
+    """
+    key, hit, state, ttl = await sync_to_async(lookup, thread_sensitive=False)(endpoint, params)
+    if hit is not None:
+        if state == "STALE" and await cache.aadd(f"{key}:lock", 1, timeout=30):
+            submit(_revalidate, key, ttl, fetch)
+        return hit, state
+    status, body = await afetch()
+    if key is not None:
+        await sync_to_async(_store, thread_sensitive=False)(key, ttl, status, body)
+    return (status, body), state
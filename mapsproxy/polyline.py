@@ -0,0 +1,102 @@
+# mapsproxy/polyline.py
+"""
+Polylines Google (Encoded Polyline Algorithm) + simplification Douglas–Peucker.
+
+  - decode("_p~iF~ps|U...") → [(lat, lng), ...]
+  - encode(points)          → chaîne encodée (précision 1e-5)
+  - simplify(points, tol_deg) → points conservés (Douglas–Peucker, distances vectorisées NumPy)
+  - tolerance_for_zoom(zoom, px) → tolérance en degrés ≈ `px` pixels au zoom donné
+"""
+from __future__ import annotations
+
+import math
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+Point = Tuple[float, float]
+
+
+def decode(encoded: str, precision: int = 5) -> List[Point]:
+    factor = 10 ** precision
+    points: List[Point] = []
+    index = lat = lng = 0
+    n = len(encoded or "")
+    while index < n:
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                b = ord(encoded[index]) - 63
+                index += 1
+                result |= (b & 0x1F) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lng += deltas[1]
+        points.append((lat / factor, lng / factor))
+    return points
+
+
+def _encode_value(v: int) -> str:
+    v = ~(v << 1) if v < 0 else v << 1
+    out = []
+    while v >= 0x20:
+        out.append(chr((0x20 | (v & 0x1F)) + 63))
+        v >>= 5
+    out.append(chr(v + 63))
+    return "".join(out)
+
+
+def encode(points: Sequence[Point], precision: int = 5) -> str:
+    factor = 10 ** precision
+    out = []
+    plat = plng = 0
+    for lat, lng in points:
+        ilat, ilng = int(round(lat * factor)), int(round(lng * factor))
+        out.append(_encode_value(ilat - plat))
+        out.append(_encode_value(ilng - plng))
+        plat, plng = ilat, ilng
+    return "".join(out)
+
+
+def tolerance_for_zoom(zoom: float, px: float = 1.0) -> float:
+    """Tolérance (degrés) correspondant à `px` pixels (tuiles 256 px) au niveau de zoom."""
+    return px * 360.0 / (256.0 * 2.0 ** float(zoom))
+
+
+def _simplify(points: Sequence[Point], tol: float) -> List[Point]:
+    pts = np.asarray(points, dtype=float)
+    # projection équirectangulaire locale : x = lng·cos(lat0), y = lat
+    xy = np.column_stack((pts[:, 1] * math.cos(math.radians(float(pts[:, 0].mean()))), pts[:, 0]))
+    keep = np.zeros(len(pts), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(pts) - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2:
+            continue
+        a, b = xy[i], xy[j]
+        seg = b - a
+        mid = xy[i + 1:j]
+        seg_len2 = float(seg @ seg)
+        if seg_len2 == 0.0:
+            d = np.hypot(*(mid - a).T)
+        else:
+            t = np.clip(((mid - a) @ seg) / seg_len2, 0.0, 1.0)
+            d = np.hypot(*(mid - (a + t[:, None] * seg)).T)
+        k = int(np.argmax(d))
+        if d[k] > tol:
+            k += i + 1
+            keep[k] = True
+            stack.append((i, k))
+            stack.append((k, j))
+    return [tuple(p) for p in pts[keep].tolist()]
+
+
+def simplify(points: Sequence[Point], tol_deg: float) -> List[Point]:
+    if len(points) < 3 or tol_deg <= 0:
+        return list(points)
+    return _simplify(points, tol_deg)
@@ -1,3 +1,139 @@
-from django.test import TestCase
+import math
+import time
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from mapsproxy import cache as maps_cache
+from mapsproxy import polyline
+
+
+class PolylineCodecTests(SimpleTestCase):
+    # exemple de la documentation Google (Encoded Polyline Algorithm Format)
+    GOOGLE_POINTS = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+    GOOGLE_ENCODED = "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+
+    def test_encode_matches_reference(self):
+        self.assertEqual(polyline.encode(self.GOOGLE_POINTS), self.GOOGLE_ENCODED)
+
+    def test_decode_matches_reference(self):
+        for (lat, lng), (elat, elng) in zip(polyline.decode(self.GOOGLE_ENCODED), self.GOOGLE_POINTS):
+            self.assertAlmostEqual(lat, elat, places=5)
+            self.assertAlmostEqual(lng, elng, places=5)
+
+    def test_round_trip(self):
+        points = [(0.4162 + i * 0.00137, 9.4673 - i * 0.00091) for i in range(200)]
+        decoded = polyline.decode(polyline.encode(points))
+        self.assertEqual(len(decoded), len(points))
+        for (lat, lng), (elat, elng) in zip(decoded, points):
+            self.assertLessEqual(abs(lat - elat), 0.5e-5)
+            self.assertLessEqual(abs(lng - elng), 0.5e-5)
+
+    def test_decode_empty(self):
+        self.assertEqual(polyline.decode(""), [])
+
+
+class SimplifyTests(SimpleTestCase):
+    def test_collinear_points_collapse_to_endpoints(self):
+        points = [(0.4, 9.4 + i * 0.001) for i in range(50)]
+        self.assertEqual(polyline.simplify(points, 1e-6), [points[0], points[-1]])
+
+    def test_keeps_corner_beyond_tolerance(self):
+        points = [(0.0, 0.0), (0.0, 0.005), (0.0, 0.01), (0.005, 0.01), (0.01, 0.01)]
+        self.assertEqual(polyline.simplify(points, 1e-4), [(0.0, 0.0), (0.0, 0.01), (0.01, 0.01)])
+
+    def test_dropped_points_stay_within_tolerance(self):
+        points = [(0.4 + i * 1e-4, 9.4 + math.sin(i / 7.0) * 2e-4) for i in range(300)]
+        tol = 5e-5
+        kept = polyline.simplify(points, tol)
+        self.assertLess(len(kept), len(points))
+        self.assertEqual((kept[0], kept[-1]), (points[0], points[-1]))
+        # chaque point retiré est à ≤ tol du segment conservé qui l’encadre
+        coslat = math.cos(math.radians(sum(p[0] for p in points) / len(points)))
+        idx = [points.index(p) for p in kept]
+        for a, b in zip(idx, idx[1:]):
+            (ay, ax), (by, bx) = points[a], points[b]
+            ax, bx = ax * coslat, bx * coslat
+            for py, px in points[a + 1:b]:
+                px *= coslat
+                sx, sy = bx - ax, by - ay
+                t = max(0.0, min(1.0, ((px - ax) * sx + (py - ay) * sy) / (sx * sx + sy * sy)))
+                self.assertLessEqual(math.hypot(px - (ax + t * sx), py - (ay + t * sy)), tol + 1e-12)
+
+    def test_short_or_zero_tolerance_unchanged(self):
+        points = [(0.0, 0.0), (1.0, 1.0)]
+        self.assertEqual(polyline.simplify(points, 1.0), points)
+        wiggly = [(0.0, 0.0), (0.1, 0.2), (0.0, 0.4)]
+        self.assertEqual(polyline.simplify(wiggly, 0), wiggly)
+
+    def test_tolerance_for_zoom_halves_per_level(self):
+        self.assertAlmostEqual(polyline.tolerance_for_zoom(15), 2 * polyline.tolerance_for_zoom(16))
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "mapsproxy-tests"}},
+    MAPSPROXY_CACHE_TTL={"geocode": 100, "directions": 0},
+    MAPSPROXY_STALE_RATIO=1.0,
+    MAPSPROXY_COORD_DECIMALS=4,
+)
+class MapsCacheTests(SimpleTestCase):
+    OK = (200, {"status": "OK", "results": [1]})
+
+    def setUp(self):
+        cache.clear()
+        self.calls = []
+        patcher = mock.patch.object(maps_cache, "submit", side_effect=lambda fn, *a: self.calls.append((fn, a)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fetch(self, endpoint="geocode", params=None, response=None):
+        response = response or self.OK
+        fetched = []
+
+        async def afetch():
+            fetched.append(1)
+            return response
+
+        result = async_to_sync(maps_cache.acached_fetch)(endpoint, params or {"latlng": "0.4,9.4"},
+                                                         afetch, lambda: response)
+        return result, len(fetched)
+
+    def test_key_normalizes_free_text_and_coords_but_not_ids(self):
+        key = maps_cache.cache_key
+        self.assertEqual(key("places", {"input": "  Rond-Point  DE LA Démocratie ", "key": "k1"}),
+                         key("places", {"input": "rond-point de la démocratie", "key": "k2"}))
+        self.assertEqual(key("geocode", {"latlng": "0.41623,9.46731"}),
+                         key("geocode", {"latlng": " 0.41621 , 9.46729 "}))
+        self.assertNotEqual(key("place_details", {"place_id": "ChIJabc"}),
+                            key("place_details", {"place_id": "ChIJABC"}))
+        self.assertNotEqual(key("geocode", {"latlng": "0.4,9.4"}), key("places", {"latlng": "0.4,9.4"}))
+
+    def test_miss_then_hit(self):
+        (resp, state), fetched = self.fetch()
+        self.assertEqual((resp, state, fetched), (self.OK, "MISS", 1))
+        (resp, state), fetched = self.fetch()
+        self.assertEqual((resp, state, fetched), (self.OK, "HIT", 0))
+        self.assertEqual(self.calls, [])
+
+    def test_stale_served_and_revalidated_once(self):
+        self.fetch()
+        with mock.patch.object(maps_cache.time, "time", return_value=time.time() + 150):
+            (resp, state), fetched = self.fetch()
+            self.assertEqual((resp, state, fetched), (self.OK, "STALE", 0))
+            self.fetch()                                   # verrou : pas de second rafraîchissement
+        self.assertEqual(len(self.calls), 1)
+        fn, args = self.calls[0]
+        fn(*args)
+        (_, state), _ = self.fetch()
+        self.assertEqual(state, "HIT")
+
+    def test_errors_and_disabled_endpoints_not_cached(self):
+        denied = (200, {"status": "OVER_QUERY_LIMIT"})
+        self.fetch(response=denied)
+        (resp, state), fetched = self.fetch(response=denied)
+        self.assertEqual((resp, state, fetched), (denied, "MISS", 1))
+        self.fetch("directions", {"origin": "a"})
+        (_, state), fetched = self.fetch("directions", {"origin": "a"})
+        self.assertEqual((state, fetched), ("MISS", 1))
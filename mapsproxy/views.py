@@ -1,18 +1,64 @@
 # mapsproxy/views.py
+# Vues async : servies par blaze_backend.asgi, un appel Google lent n’occupe
+# qu’une coroutine (et non un thread du pool sync_to_async).
 import os
-import requests
 from django.http import JsonResponse
 from django.views.decorators.http import require_GET
 from django.conf import settings
 
+from blaze_backend import outbound
+from .cache import acached_fetch
+from .polyline import decode, encode, simplify, tolerance_for_zoom
+
 GOOGLE_KEY = getattr(settings, "GOOGLE_KEY", "")
 
-def _proxy(url, params):
-    r = requests.get(url, params=params, timeout=15)
-    return JsonResponse(r.json(), status=r.status_code, safe=False)
+async def _proxy(endpoint, url, params, transform=None):
+    def fetch():
+        r = outbound.get("google_maps", url, params=params)
+        return r.status_code, r.json()
+
+    async def afetch():
+        r = await outbound.aget("google_maps", url, params=params)
+        return r.status_code, r.json()
+
+    (status, body), state = await acached_fetch(endpoint, params, afetch, fetch)
+    if transform is not None:
+        body = transform(body)  # après le cache : la réponse complète reste partagée
+    resp = JsonResponse(body, status=status, safe=False)
+    resp["X-Cache"] = state
+    return resp
+
+def _slim_directions(body, zoom):
+    """
+    Réponse allégée pour mobile : legs (distance/durée/extrémités) + polyline
+    simplifiée (Douglas–Peucker à ~MAPSPROXY_SLIM_PX pixel au zoom demandé).
+    Steps, instructions HTML, warnings… sont supprimés.
+    """
+    if not isinstance(body, dict) or body.get('status') != 'OK':
+        return body
+    tol = tolerance_for_zoom(zoom, float(getattr(settings, 'MAPSPROXY_SLIM_PX', 1.0)))
+    routes = []
+    for route in body.get('routes') or []:
+        points = decode((route.get('overview_polyline') or {}).get('points') or '')
+        legs = [
+            {k: leg[k] for k in (
+                'distance', 'duration', 'duration_in_traffic',
+                'start_location', 'end_location', 'start_address', 'end_address',
+            ) if k in leg}
+            for leg in route.get('legs') or []
+        ]
+        routes.append({
+            'summary': route.get('summary'),
+            'bounds': route.get('bounds'),
+            'legs': legs,
+            'distance_m': sum((leg.get('distance') or {}).get('value') or 0 for leg in legs),
+            'duration_s': sum((leg.get('duration') or {}).get('value') or 0 for leg in legs),
+            'overview_polyline': {'points': encode(simplify(points, tol))},
+        })
+    return {'status': 'OK', 'slim': True, 'routes': routes}
 
 @require_GET
-def directions(request):
+async def directions(request):
     origin = request.GET.get('origin')
     destination = request.GET.get('destination')
     language = request.GET.get('language', 'fr')
@@ -20,30 +66,37 @@ def directions(request):
         return JsonResponse({'detail': 'origin et destination requis'}, status=400)
     url = 'https://maps.googleapis.com/maps/api/directions/json'
     params = {'origin': origin, 'destination': destination, 'key': GOOGLE_KEY, 'language': language, 'mode': 'driving'}
-    return _proxy(url, params)
+    transform = None
+    if request.GET.get('slim') in ('1', 'true'):
+        try:
+            zoom = min(21.0, max(0.0, float(request.GET.get('zoom', getattr(settings, 'MAPSPROXY_SLIM_DEFAULT_ZOOM', 15)))))
+        except ValueError:
+            return JsonResponse({'detail': 'zoom invalide'}, status=400)
+        transform = lambda body: _slim_directions(body, zoom)
+    return await _proxy('directions', url, params, transform)
 
 @require_GET
-def geocode(request):
+async def geocode(request):
     latlng = request.GET.get('latlng')
     language = request.GET.get('language', 'fr')
     if not latlng:
         return JsonResponse({'detail': 'latlng requis'}, status=400)
     url = 'https://maps.googleapis.com/maps/api/geocode/json'
     params = {'latlng': latlng, 'key': GOOGLE_KEY, 'language': language}
-    return _proxy(url, params)
+    return await _proxy('geocode', url, params)
 
 @require_GET
-def places(request):
+async def places(request):
     input_text = request.GET.get('input')
     language = request.GET.get('language', 'fr')
     if not input_text:
         return JsonResponse({'detail': 'input requis'}, status=400)
     url = 'https://maps.googleapis.com/maps/api/place/autocomplete/json'
     params = {'input': input_text, 'key': GOOGLE_KEY, 'language': language}
-    return _proxy(url, params)
+    return await _proxy('places', url, params)
 
 @require_GET
-def place_details(request):
+async def place_details(request):
     place_id = request.GET.get('place_id')
     language = request.GET.get('language', 'fr')
     if not place_id:
@@ -55,14 +108,14 @@ def place_details(request):
         'language': language,
         'fields': 'geometry,name,formatted_address'
     }
-    return _proxy(url, params)
+    return await _proxy('place_details', url, params)
 
 @require_GET
-def forward_geocode(request):
+async def forward_geocode(request):
     address = request.GET.get('address')
     language = request.GET.get('language', 'fr')
     if not address:
         return JsonResponse({'detail': 'address requis'}, status=400)
     url = 'https://maps.googleapis.com/maps/api/geocode/json'
     params = {'address': address, 'key': GOOGLE_KEY, 'language': language}
-    return _proxy(url, params)
\ No newline at end of file
+    return await _proxy('forward_geocode', url, params)
\ No newline at end of file
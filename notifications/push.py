@@ -1,8 +1,9 @@
 import json
 import logging
-import requests
 from typing import Iterable, Optional, Dict, Any
 from django.conf import settings
+
+from blaze_backend import outbound
 from .models import Device
 
 logger = logging.getLogger(__name__)
@@ -21,7 +22,7 @@ def _send(payload: Dict[str, Any]) -> Dict[str, Any]:
         "Authorization": f"key={_server_key()}",
     }
     try:
-        r = requests.post(FCM_ENDPOINT, headers=headers, data=json.dumps(payload), timeout=15)
+        r = outbound.post("fcm", FCM_ENDPOINT, headers=headers, data=json.dumps(payload))
         r.raise_for_status()
         j = r.json()
         logger.info("[FCM] success=%s failure=%s", j.get("success"), j.get("failure"))